@@ -1,16 +1,54 @@
 import logging
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext, ConversationHandler, CallbackQueryHandler, JobQueue
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext, ConversationHandler, CallbackQueryHandler, JobQueue, BasePersistence, PersistenceInput
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time as dt_time
 import os
 import asyncio
 import csv
+import html
 import io
+import json
+import math
+import shutil
+import string
+import sys
+import tempfile
+import timeit
+import multiprocessing
+import queue
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# NumPy нужен только для колоночного движка аналитики, без него используются дневные агрегаты
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# matplotlib нужен только для картинки тепловой карты загрузки, без него отправляется текстовая сетка
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
 
 # Токен бота
 TOKEN = os.environ.get('BOT_TOKEN')
 
+# Файл базы данных
+DB_PATH = 'studio_schedule.db'
+
+# Количество страниц, копируемых за один шаг online backup (между шагами база доступна для записи)
+BACKUP_PAGES_PER_STEP = 64
+
+# Резервные копии: каталог, интервал (в секундах) и сколько последних копий хранить
+BACKUP_DIR = 'backups'
+BACKUP_INTERVAL = 6 * 60 * 60
+BACKUP_KEEP = 10
+
 # Состояния для бронирования
 SELECT_BOOKING_TYPE, SELECT_DAY, SELECT_TIME, SELECT_DURATION = range(4)
 
@@ -29,6 +67,12 @@ ADMIN_ADD_DAY, ADMIN_ADD_TIME, ADMIN_ADD_DURATION, ADMIN_ADD_CLIENT_NAME, ADMIN_
 # Состояния для отмены записей админом
 ADMIN_CANCEL_DAY, ADMIN_CANCEL_SELECT = range(15, 17)
 
+# Состояние для ввода диапазона дат админ расписания
+ADMIN_SCHEDULE_RANGE = 17
+
+# Состояния для поиска свободного времени
+FIND_DURATION, FIND_HOURS, FIND_SELECT, FIND_FROM = range(18, 22)
+
 # Настройка логирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
@@ -39,29 +83,327 @@ logger = logging.getLogger(__name__)
 # ID администратора
 ADMIN_ID = 407671600
 
+# Шаблоны сообщений: имя -> (текст с полями {поле}, поля). Значения полей при подстановке
+# экранируются для HTML, шаблоны без полей формируются один раз при загрузке
+MESSAGE_TEMPLATES = {
+    # Приветствие главного меню
+    'welcome': ("""🎧 Добро пожаловать в бот студии звукозаписи MS Studio!
+
+Выберите действие:""", ()),
+
+    # Прайс-лист
+    'prices': ("""🎹 <b>ПРАЙС-ЛИСТ СТУДИИ ЗВУКОЗАПИСИ</b> 🎹
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🎤 <b>ОСНОВНЫЕ УСЛУГИ ЗАПИСИ</b>
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+🎵 <b>Запись</b>
+💰 <i>1000 ₽/час</i>
+📝 Запись вокала или многодорожечная запись любых музыкальных инструментов (до 16-ти каналов)
+
+🎵 <b>Трек под минус</b>
+💰 <i>5 000 ₽</i>
+📝 Запись вокала под ваш готовый минус
+✅ В услугу входит:
+   • 2 часа записи
+   • Ручная коррекция вокала
+   • Сведение вокала с минусом
+   • Мастеринг трека
+
+🎵 <b>Запись песни</b>
+💰 <i>12 000 ₽</i>
+📝 Полный цикл производства трека от записи до мастеринга
+✅ В услугу входит:
+   • Запись вокала и инструментов (до 7 часов)
+   • Ручная коррекция вокала
+   • Ритмические коррекции инструментов
+   • Эффекты и саундизайн
+   • Сведение и мастеринг
+   • До 3-х пакетов правок
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🎧 <b>ОБРАБОТКА И ПРОДАКШЕН</b>
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+🎵 <b>Сведение и мастеринг</b>
+💰 <i>7 500 ₽</i>
+📝 Полное сведение мультитрека
+✅ В услугу входит:
+   • Ручная коррекция вокала
+   • Ритмические коррекции инструментов
+   • Эффекты и саундизайн
+   • Сведение и мастеринг
+   • До 3-х пакетов правок
+
+🎵 <b>Сведение вместе с артистом</b>
+💰 <i>1 500 ₽/час</i>
+📝 Совместная работа над сведением с участием артиста
+✅ Идеально для:
+   • Точной реализации вашего видения звука
+   • Обучения процессу сведения
+   • Быстрой обратной связи и правок
+
+🎵 <b>Аранжировка</b>
+💰 <i>от 10 000 ₽</i>
+📝 Написание бита/аранжировки с нуля по референсу или вместе с артистом
+✅ В услугу входит:
+   • Непосредственное написание аранжировки
+   • Эффекты, саундизайн
+   • Типовое сведение
+   • Экспорт мультитрека
+   • Полные права
+   • До 3-х пакетов правок
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+👨‍🏫 <b>ОБУЧЕНИЕ</b>
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+🎵 <b>Обучение звукорежиссуре</b>
+💰 <i>1 500 ₽/занятие</i>
+📝 Обучение звукорежиссуре, написанию аранжировок, битов и студийной работе
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🛠️ <b>ДОПОЛНИТЕЛЬНЫЕ УСЛУГИ</b>
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+• 🎛️ <b>Мастеринг</b>: 2 000 ₽
+• 🎤 <b>Ручная коррекция вокала</b>: 750 ₽/трек
+• 🥁 <b>Ритмические коррекции инструментов</b>: 1 500 ₽/инструмент
+• 📝 <b>Написание текста</b>: от 5 000 ₽
+• 🎨 <b>Обложка к релизу</b>: от 3 000 ₽
+• 🌐 <b>Дистрибуция</b>: 750 ₽
+• 💼 <b>Коммерческий трек</b>: цены обсуждаются индивидуально
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🏢 <b>АРЕНДА СТУДИИ</b>
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+🎵 <b>Для самостоятельной работы:</b>
+• ⏱️ 3 часа — 3 000 ₽
+• ⏱️ 6 часов — 5 500 ₽
+• ⏱️ 12 часов — 10 000 ₽
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+🎯 <i>Индивидуальный подход к каждому клиенту</i>
+
+📞 <b>Для записи и консультации - свяжитесь с администратором!</b>""", ()),
+
+    # Контакты администратора
+    'contacts': ("""👨‍💻 <b>Связь с администратором</b>
+
+📞 <b>Телефон</b>: +7 (918) 880-52-92
+📱 <b>Telegram</b>: @Solnyshkin_Mikhail
+🔗 <b>Telegram канал студии</b>: https://t.me/+UPYAZ7ULL403YmEy
+👥 <b>VK группа</b>: https://vk.com/m_s_studio?from=groups
+🌐 <b>Сайт студии</b>: https://msstudio-stav.ru/
+⏰ <b>Время связи</b>: 9:00-22:00
+
+💬 <i>Напишите или позвоните для уточнения деталей!</i>
+🎵 <i>Поможем подобрать оптимальное решение для вашего проекта</i>""", ()),
+
+    # Подтверждение брони для клиента
+    'booking_confirmed': ("""🎉 <b>ВАША БРОНЬ ПОДТВЕРЖДЕНА!</b>
+
+📅 <b>Дата</b>: {day}
+🕐 <b>Время</b>: {time}
+⏱ <b>Продолжительность</b>: {duration} час(а)
+
+🏢 <b>MS Studio</b>
+📍 <b>Адрес</b>: г. Ставрополь, ул. Спартака 8, 2-ой этаж
+
+✅ <i>Ждем вас в студии!</i>
+📞 <b>По всем вопросам:</b> +7 (918) 880-52-92
+
+💡 <i>Вы получите напоминания за 24 часа и за 2 часа до сессии.</i>""", ('day', 'time', 'duration')),
+
+    # Отмена записи администратором (для клиента)
+    'booking_cancelled_by_admin': ("""😔 <b>ВАША ЗАПИСЬ ОТМЕНЕНА АДМИНИСТРАТОРОМ</b>
+
+📅 <b>Дата:</b> {day}
+🕐 <b>Время:</b> {time}
+⏱ <b>Продолжительность:</b> {duration} час(а)
+
+💡 <b>Что делать дальше?</b>
+
+🎵 <b>Забронируйте новое время</b> - выберите удобное время для записи
+📞 <b>Свяжитесь с администратором</b> - для уточнения деталей
+
+📱 <b>Контакты:</b>
+Телефон: +7 (918) 880-52-92
+Telegram: @Solnyshkin_Mikhail
+
+🙏 <i>Приносим извинения за доставленные неудобства!</i>
+🎶 <i>Надеемся увидеть вас в нашей студии в другое время!</i>""", ('day', 'time', 'duration')),
+
+    # Напоминание клиенту за 24 часа
+    'reminder_24h': ("""🎵 <b>НАПОМИНАНИЕ О ЗАПИСИ</b>
+
+⏰ До вашей сессии в студии осталось <b>24 часа</b>!
+
+📅 <b>Дата</b>: {selected_date}
+🕐 <b>Время</b>: {selected_time}
+⏱ <b>Продолжительность</b>: {duration} час(а)
+
+🏢 <b>MS Studio</b>
+📍 <b>Адрес</b>: г. Ставрополь, ул. Спартака 8, 2-ой этаж
+
+💡 <i>Пожалуйста, планируйте свое время заранее.</i>
+🚗 <i>Рекомендуем приехать за 10-15 минут до начала сессии.</i>
+
+📞 <b>По всем вопросам:</b> +7 (918) 880-52-92
+
+🎶 <i>Ждем вас в студии!</i>""", ('selected_date', 'selected_time', 'duration')),
+
+    # Напоминание клиенту за 2 часа
+    'reminder_2h': ("""🎵 <b>НАПОМИНАНИЕ О ЗАПИСИ</b>
+
+⏰ До вашей сессии в студии осталось <b>2 часа</b>!
+
+📅 <b>Дата</b>: {selected_date}
+🕐 <b>Время</b>: {selected_time}
+⏱ <b>Продолжительность</b>: {duration} час(а)
+
+🏢 <b>MS Studio</b>
+📍 <b>Адрес</b>: г. Ставрополь, ул. Спартака 8, 2-ой этаж
+
+🚗 <i>Скоро начинаем! Рекомендуем приехать за 10-15 минут до начала.</i>
+🎤 <i>Не забудьте взять все необходимое для записи!</i>
+
+📞 <b>Если опаздываете:</b> +7 (918) 880-52-92
+
+🎶 <i>До скорой встречи в студии!</i>""", ('selected_date', 'selected_time', 'duration')),
+
+    # Напоминание администратору о неподтвержденной заявке
+    'admin_reminder': ("""🔔 <b>НАПОМИНАНИЕ О НЕПОДТВЕРЖДЕННОЙ ЗАЯВКЕ!</b>
+
+Заявка ожидает подтверждения уже более 30 минут:
+
+👤 <b>Клиент</b>: {user_name}
+📅 <b>Дата</b>: {selected_date}
+🕐 <b>Время</b>: {selected_time}
+⏱ <b>Продолжительность</b>: {duration} час(а)
+🆔 <b>ID заявки</b>: {booking_id}
+
+❗ <i>Пожалуйста, подтвердите или отклоните заявку как можно скорее!</i>""", ('user_name', 'selected_date', 'selected_time', 'duration', 'booking_id')),
+
+    # Уведомление администратору о новой заявке
+    'admin_new_booking': ("""🎵 <b>НОВАЯ ЗАПИСЬ!</b>
+
+👤 <b>Клиент</b>: {user_name}
+📱 <b>Telegram</b>: @{username}
+📅 <b>Дата</b>: {selected_date}
+🕐 <b>Время</b>: {selected_time}
+⏱ <b>Продолжительность</b>: {duration} час(а)
+🆔 <b>ID клиента</b>: {user_id}
+📋 <b>ID заявки</b>: {booking_id}
+
+⏰ <i>Заявка ожидает подтверждения!</i>""", ('user_name', 'username', 'selected_date', 'selected_time', 'duration', 'user_id', 'booking_id'))
+}
+
+# Загруженные шаблоны: имя -> (функция подстановки, поля); готовый текст шаблонов без полей
+_compiled_templates = {}
+_static_messages = {}
+
+# Загрузка и проверка шаблонов (при запуске): поля в тексте должны совпадать с объявленными
+def load_message_templates():
+    formatter = string.Formatter()
+    compiled = {}
+    static = {}
+    
+    for name, (text, fields) in MESSAGE_TEMPLATES.items():
+        used = set()
+        for _, field_name, format_spec, conversion in formatter.parse(text):
+            if field_name is None:
+                continue
+            if not field_name.isidentifier() or format_spec or conversion:
+                raise ValueError(f"Шаблон '{name}': недопустимое поле '{field_name}'")
+            used.add(field_name)
+        
+        if used != set(fields):
+            raise ValueError(f"Шаблон '{name}': поля в тексте {sorted(used)} не совпадают с объявленными {sorted(fields)}")
+        
+        compiled[name] = (text.format, frozenset(fields))
+        if not fields:
+            static[name] = text.format()
+    
+    _compiled_templates.clear()
+    _compiled_templates.update(compiled)
+    _static_messages.clear()
+    _static_messages.update(static)
+    print(f"✅ Шаблоны сообщений загружены: {len(compiled)} (без полей: {len(static)})")
+
+# Текст сообщения по шаблону
+def render_template(name, **values):
+    static = _static_messages.get(name)
+    if static is not None:
+        return static
+    
+    if not _compiled_templates:
+        load_message_templates()
+    
+    render, fields = _compiled_templates[name]
+    if values.keys() != fields:
+        raise KeyError(f"Шаблон '{name}' ожидает поля {sorted(fields)}, переданы {sorted(values)}")
+    
+    return render(**{key: html.escape(str(value)) for key, value in values.items()})
+
+# Замер скорости подстановки шаблонов (python studio_bot.py --bench-templates)
+def benchmark_templates(iterations=20000):
+    load_message_templates()
+    sample_values = {
+        'day': '25.12.2024 (Среда)', 'time': '14:00', 'duration': 2, 'user_name': 'Иван <Тест>',
+        'username': 'ivan_test', 'user_id': 123456789, 'booking_id': 4242,
+        'selected_date': '25.12.2024 (Среда)', 'selected_time': '14:00'
+    }
+    
+    for name, (_, fields) in MESSAGE_TEMPLATES.items():
+        values = {field: sample_values[field] for field in fields}
+        seconds = timeit.timeit(lambda: render_template(name, **values), number=iterations)
+        print(f"{name:28} {seconds / iterations * 1e6:8.2f} мкс")
+
+# Клавиатуры, которые не зависят от данных: объекты разметки создаются один раз
+_main_keyboards = {}
+BACK_KEYBOARD = ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+
 # Функция для создания клавиатуры с учетом прав администратора
 def get_main_keyboard(user_id: int):
-    keyboard = [
-        ['📅 Расписание', '🎵 Забронировать'],
-        ['💰 Цены', '👨‍💻 Связь']
-    ]
+    role = 'admin' if user_id == ADMIN_ID else 'client'
     
-    # Добавляем кнопку админ-панели только для администратора
-    if user_id == ADMIN_ID:
-        keyboard.append(['👑 Админ панель'])
+    if role not in _main_keyboards:
+        keyboard = [
+            ['📅 Расписание', '🎵 Забронировать'],
+            ['💰 Цены', '👨‍💻 Связь']
+        ]
+        
+        # Добавляем кнопку админ-панели только для администратора
+        if role == 'admin':
+            keyboard.append(['👑 Админ панель'])
+        
+        _main_keyboards[role] = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return _main_keyboards[role]
 
-# Полностью пересоздаем базу данных
+# Инициализация базы данных
 def init_db():
-    # Удаляем старую базу данных если она есть
-    if os.path.exists('studio_schedule.db'):
-        os.remove('studio_schedule.db')
-        print("🗑️ Старая база данных удалена")
+    # Пересоздаем базу только по явному запросу (RESET_DB=1), предварительно сохранив копию
+    if os.environ.get('RESET_DB') == '1' and os.path.exists('studio_schedule.db'):
+        backup_path = create_rotating_backup()
+        if not backup_path:
+            print("❌ Не удалось сохранить копию базы, сброс отменен")
+        else:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(f'studio_schedule.db{suffix}'):
+                    os.remove(f'studio_schedule.db{suffix}')
+            print(f"🗑️ Старая база данных удалена (копия: {backup_path})")
     
     conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
     cursor = conn.cursor()
     
+    # WAL: снимки и бэкапы читают базу, не блокируя запись бронирований
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
     # Таблица бронирований (ОБНОВЛЕНО: добавлено поле client_contact)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS bookings (
@@ -78,6 +420,82 @@ def init_db():
         )
     ''')
     
+    # Дата сессии в формате ГГГГ-ММ-ДД: по ней работают диапазонные запросы (day хранится как ДД.ММ.ГГГГ)
+    cursor.execute('PRAGMA table_info(bookings)')
+    if 'session_date' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE bookings ADD COLUMN session_date TEXT')
+        cursor.execute("UPDATE bookings SET session_date = substr(day, 7, 4) || '-' || substr(day, 4, 2) || '-' || substr(day, 1, 2)")
+    
+    # Покрывающий индекс по сессиям: загрузка студии за период читается без обращения к таблице
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_session ON bookings (status, session_date, time, duration)')
+    
+    # Индексы постраничных списков: расписание на дату и брони клиента в порядке времени сессии
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_session_time ON bookings (session_date, time)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_user_session ON bookings (user_id, session_date, time)')
+    
+    # Серии регулярных записей: правило хранится один раз, сессии вносятся в bookings по мере приближения дат
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recurring_series (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            user_name TEXT,
+            client_contact TEXT,
+            time TEXT,
+            duration INTEGER,
+            interval_weeks INTEGER DEFAULT 1,
+            start_date TEXT,
+            materialized_until TEXT,
+            status TEXT DEFAULT 'active',
+            created_at TEXT,
+            added_by_admin BOOLEAN DEFAULT FALSE
+        )
+    ''')
+    
+    # Серия, из которой внесена бронь (NULL - обычная бронь)
+    cursor.execute('PRAGMA table_info(bookings)')
+    if 'series_id' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE bookings ADD COLUMN series_id INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_series ON bookings (series_id, session_date)')
+    
+    # Индексы для аналитики: диапазон по дате создания и месячная динамика без чтения таблицы
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_created_at ON bookings (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bookings_status_created ON bookings (status, created_at, duration)')
+    
+    # Дневные агрегаты для аналитики: дата сессии (ГГГГ-ММ-ДД) и час начала
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT,
+            hour INTEGER,
+            bookings_count INTEGER DEFAULT 0,
+            hours_count INTEGER DEFAULT 0,
+            cancelled_count INTEGER DEFAULT 0,
+            total_count INTEGER DEFAULT 0,
+            PRIMARY KEY (day, hour)
+        )
+    ''')
+    
+    # Подтвержденные брони по клиентам за день - для уникальных клиентов и топа клиентов
+    # (user_id = 0 для записей, добавленных администратором без Telegram аккаунта)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_client_stats (
+            day TEXT,
+            user_id INTEGER,
+            user_name TEXT,
+            bookings_count INTEGER DEFAULT 0,
+            hours_count INTEGER DEFAULT 0,
+            PRIMARY KEY (day, user_id, user_name)
+        )
+    ''')
+    
+    # Заранее рассчитанные отчеты аналитики за стандартные периоды (payload - JSON результата)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_reports (
+            period_days INTEGER PRIMARY KEY,
+            computed_at TEXT,
+            payload TEXT
+        )
+    ''')
+    
     # Таблица пользователей для статистики
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -92,9 +510,75 @@ def init_db():
         )
     ''')
     
+    # Индекс по последней активности: счетчики активных пользователей и постраничный список
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users (last_activity)')
+    
+    # Журнал активности: одна строка на пользователя за день
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_activity_daily (
+            day TEXT,
+            user_id INTEGER,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Пользователи, уже учтенные в счетчике недели (period = понедельник) или месяца (period = ГГГГ-ММ)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_activity_periods (
+            period_type TEXT,
+            period TEXT,
+            user_id INTEGER,
+            PRIMARY KEY (period_type, period, user_id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Счетчики DAU/WAU/MAU и новых пользователей по календарным дням, неделям и месяцам
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activity_counts (
+            period_type TEXT,
+            period TEXT,
+            active_users INTEGER DEFAULT 0,
+            new_users INTEGER DEFAULT 0,
+            PRIMARY KEY (period_type, period)
+        )
+    ''')
+    
+    # Когорты удержания: неделя первого визита и сколько ее пользователей активны через N недель
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS retention_cohorts (
+            cohort_week TEXT,
+            weeks_since INTEGER,
+            active_users INTEGER DEFAULT 0,
+            PRIMARY KEY (cohort_week, weeks_since)
+        )
+    ''')
+    
+    # Состояние диалогов и user_data - чтобы перезапуск бота не сбрасывал начатое бронирование
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_states (
+            name TEXT,
+            conversation_key TEXT,
+            state TEXT,
+            PRIMARY KEY (name, conversation_key)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persisted_user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT
+        )
+    ''')
+    
     conn.commit()
     conn.close()
-    print("✅ Новая база данных создана с правильной структурой")
+    
+    # Заполняем дневные агрегаты для уже существующих бронирований
+    backfill_daily_stats()
+    
+    # Заполняем журнал активности для уже существующих пользователей
+    backfill_user_activity()
+    
+    print("✅ База данных готова к работе")
 
 # Функция для получения текущего времени в правильном формате
 def get_current_time():
@@ -137,6 +621,10 @@ def update_user_stats(user_id: int, username: str, first_name: str, last_name: s
                 VALUES (?, ?, ?, ?, ?, ?)
             ''', (user_id, username, first_name, last_name, current_time, current_time))
         
+        # Журнал активности по дням и счетчики вовлеченности - в той же транзакции
+        first_seen = user_exists[4] if user_exists else current_time
+        record_user_activity(cursor, user_id, first_seen, current_time, is_new=not user_exists)
+        
         conn.commit()
         conn.close()
         print(f"✅ Статистика обновлена для пользователя {user_id} в {current_time}")
@@ -144,35 +632,168 @@ def update_user_stats(user_id: int, username: str, first_name: str, last_name: s
     except Exception as e:
         logger.error(f"Error updating user stats: {e}")
 
-# Функция для обновления статистики бронирований пользователя
-def update_user_booking_stats(user_id: int):
+# Понедельник недели, к которой относится дата (ГГГГ-ММ-ДД) - ключ недели в счетчиках и когортах
+def week_start(day):
+    date = datetime.strptime(day, '%Y-%m-%d').date()
+    return (date - timedelta(days=date.weekday())).isoformat()
+
+# Увеличение счетчика вовлеченности за день, неделю или месяц
+def bump_activity_count(cursor, period_type, period, is_new):
+    cursor.execute('''
+        INSERT INTO activity_counts (period_type, period, active_users, new_users)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT (period_type, period) DO UPDATE SET
+            active_users = active_users + 1,
+            new_users = new_users + excluded.new_users
+    ''', (period_type, period, int(is_new)))
+
+# Запись активности пользователя в дневной журнал и инкрементальные счетчики DAU/WAU/MAU и когорт
+def record_user_activity(cursor, user_id, first_seen, current_time, is_new=False):
+    """Вызывается в транзакции update_user_stats. Счетчики меняются только при первой
+    активности пользователя за день, неделю или месяц, поэтому повторные сообщения стоят
+    одного INSERT OR IGNORE"""
+    day = current_time[:10]
+    cursor.execute('INSERT OR IGNORE INTO user_activity_daily (day, user_id) VALUES (?, ?)', (day, user_id))
+    if cursor.rowcount == 0:
+        return
+    
+    bump_activity_count(cursor, 'day', day, is_new)
+    
+    week = week_start(day)
+    for period_type, period in (('week', week), ('month', day[:7])):
+        cursor.execute(
+            'INSERT OR IGNORE INTO user_activity_periods (period_type, period, user_id) VALUES (?, ?, ?)',
+            (period_type, period, user_id)
+        )
+        if cursor.rowcount == 0:
+            continue
+        
+        bump_activity_count(cursor, period_type, period, is_new)
+        
+        # Когорта - неделя первого визита, номер недели жизни считается от нее
+        if period_type == 'week':
+            cohort_week = week_start(first_seen[:10])
+            weeks_since = (datetime.strptime(week, '%Y-%m-%d') - datetime.strptime(cohort_week, '%Y-%m-%d')).days // 7
+            cursor.execute('''
+                INSERT INTO retention_cohorts (cohort_week, weeks_since, active_users)
+                VALUES (?, ?, 1)
+                ON CONFLICT (cohort_week, weeks_since) DO UPDATE SET active_users = active_users + 1
+            ''', (cohort_week, weeks_since))
+
+# Первичное заполнение журнала активности по существующим пользователям
+def backfill_user_activity():
+    """До появления журнала известны только первый визит и последняя активность,
+    из них и восстанавливаются дни активности, недельные и месячные счетчики и когорты"""
     try:
         conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
         cursor = conn.cursor()
         
-        # Считаем количество бронирований и общее время
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM user_activity_daily), EXISTS (SELECT 1 FROM users)')
+        has_activity, has_users = cursor.fetchone()
+        
+        if has_activity or not has_users:
+            conn.close()
+            return
+        
         cursor.execute('''
-            SELECT COUNT(*), COALESCE(SUM(duration), 0) 
-            FROM bookings 
-            WHERE user_id = ? AND status = 'confirmed'
-        ''', (user_id,))
+            INSERT OR IGNORE INTO user_activity_daily (day, user_id)
+            SELECT substr(first_seen, 1, 10), user_id FROM users
+            UNION
+            SELECT substr(last_activity, 1, 10), user_id FROM users
+        ''')
         
-        result = cursor.fetchone()
-        bookings_count = result[0] if result else 0
-        total_hours = result[1] if result else 0
+        # date(day, 'weekday 0', '-6 days') - понедельник недели, как в week_start()
+        cursor.execute('''
+            INSERT OR IGNORE INTO user_activity_periods (period_type, period, user_id)
+            SELECT 'week', date(day, 'weekday 0', '-6 days'), user_id FROM user_activity_daily
+            UNION
+            SELECT 'month', substr(day, 1, 7), user_id FROM user_activity_daily
+        ''')
         
-        # Обновляем статистику пользователя
         cursor.execute('''
-            UPDATE users 
-            SET bookings_count = ?, total_hours = ?
-            WHERE user_id = ?
-        ''', (bookings_count, total_hours, user_id))
+            INSERT INTO activity_counts (period_type, period, active_users, new_users)
+            SELECT 'day', day, COUNT(*), 0 FROM user_activity_daily GROUP BY day
+            UNION ALL
+            SELECT period_type, period, COUNT(*), 0 FROM user_activity_periods GROUP BY period_type, period
+        ''')
+        
+        cursor.execute('''
+            UPDATE activity_counts
+            SET new_users = (
+                SELECT COUNT(*) FROM users
+                WHERE CASE activity_counts.period_type
+                    WHEN 'day' THEN substr(first_seen, 1, 10)
+                    WHEN 'week' THEN date(substr(first_seen, 1, 10), 'weekday 0', '-6 days')
+                    ELSE substr(first_seen, 1, 7)
+                END = activity_counts.period
+            )
+        ''')
+        
+        cursor.execute('''
+            INSERT INTO retention_cohorts (cohort_week, weeks_since, active_users)
+            SELECT
+                date(substr(u.first_seen, 1, 10), 'weekday 0', '-6 days') AS cohort_week,
+                CAST(round((julianday(p.period) - julianday(date(substr(u.first_seen, 1, 10), 'weekday 0', '-6 days'))) / 7) AS INTEGER),
+                COUNT(*)
+            FROM user_activity_periods p
+            JOIN users u ON u.user_id = p.user_id
+            WHERE p.period_type = 'week'
+            GROUP BY 1, 2
+        ''')
+        
+        conn.commit()
+        conn.close()
+        print("✅ Журнал активности пользователей заполнен по первому визиту и последней активности")
+        
+    except Exception as e:
+        logger.error(f"Error in backfill_user_activity: {e}")
+
+# Проверка счетчиков бронирований пользователей (bookings_count, total_hours) по таблице bookings
+def check_user_booking_stats():
+    """Счетчики ведутся приращениями в record_booking_transition, проверка одним
+    GROUP BY находит и исправляет расхождения (например, после правки базы вручную)"""
+    try:
+        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+        cursor = conn.cursor()
+        
+        # Чтение и исправление в одной транзакции: приращение, записанное между ними, не будет затерто
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT u.user_id, COALESCE(b.bookings_count, 0), COALESCE(b.total_hours, 0)
+            FROM users u
+            LEFT JOIN (
+                SELECT user_id, COUNT(*) AS bookings_count, SUM(duration) AS total_hours
+                FROM bookings
+                WHERE status = 'confirmed' AND user_id IS NOT NULL
+                GROUP BY user_id
+            ) b ON b.user_id = u.user_id
+            WHERE u.bookings_count IS NOT COALESCE(b.bookings_count, 0)
+               OR u.total_hours IS NOT COALESCE(b.total_hours, 0)
+        ''')
+        mismatches = cursor.fetchall()
+        
+        if mismatches:
+            cursor.executemany(
+                'UPDATE users SET bookings_count = ?, total_hours = ? WHERE user_id = ?',
+                [(bookings_count, total_hours, user_id) for user_id, bookings_count, total_hours in mismatches]
+            )
+            logger.warning(f"User booking stats fixed for {len(mismatches)} users")
         
         conn.commit()
         conn.close()
+        print(f"✅ Проверка счетчиков бронирований пользователей: расхождений {len(mismatches)}")
+        return len(mismatches)
         
     except Exception as e:
-        logger.error(f"Error updating user booking stats: {e}")
+        logger.error(f"Error in check_user_booking_stats: {e}")
+        return None
+
+# Как часто (в секундах) проверять счетчики бронирований пользователей
+USER_STATS_CHECK_INTERVAL = 24 * 60 * 60
+
+# Плановая проверка счетчиков бронирований пользователей
+async def run_user_stats_check(context: CallbackContext):
+    await asyncio.to_thread(check_user_booking_stats)
 
 # Функция для получения всех пользователей
 def get_all_users():
@@ -187,67 +808,628 @@ def get_all_users():
         logger.error(f"Error getting users: {e}")
         return []
 
-# Функция для получения расширенной аналитики
-def get_advanced_analytics(period_days=30):
+# Сколько разобранных подписей дат хранить (кнопки ближайших дней, введенные даты, даты из базы)
+STUDIO_DATE_CACHE_SIZE = 4096
+
+# Дата сессии: разбирается из подписи кнопки или ДД.ММ.ГГГГ один раз, форматы хранятся готовыми
+class StudioDate:
+    __slots__ = ('date', 'clean', 'iso', 'weekday_name')
+    
+    # Подпись или ДД.ММ.ГГГГ -> дата; date -> дата
+    _by_text = {}
+    _by_date = {}
+    
+    def __init__(self, date):
+        self.date = date
+        self.clean = date.strftime("%d.%m.%Y")
+        self.iso = date.isoformat()
+        self.weekday_name = WEEKDAY_NAMES[date.weekday()]
+    
+    @classmethod
+    def from_date(cls, date):
+        studio_date = cls._by_date.get(date)
+        if studio_date is None:
+            if len(cls._by_date) >= STUDIO_DATE_CACHE_SIZE:
+                cls._by_date.clear()
+            studio_date = cls._by_date[date] = cls(date)
+        return studio_date
+    
+    @classmethod
+    def parse(cls, text):
+        """Принимает "ДД.ММ.ГГГГ", подпись "ДД.ММ.ГГГГ (День) - Сегодня" или готовый StudioDate.
+        Неверный формат - ValueError, как у strptime"""
+        if isinstance(text, StudioDate):
+            return text
+        
+        studio_date = cls._by_text.get(text)
+        if studio_date is None:
+            clean = text.replace(" - Сегодня", "").split(' (')[0]
+            studio_date = cls.from_date(datetime.strptime(clean, "%d.%m.%Y").date())
+            if len(cls._by_text) >= STUDIO_DATE_CACHE_SIZE:
+                cls._by_text.clear()
+            cls._by_text[text] = studio_date
+        return studio_date
+    
+    @property
+    def is_today(self):
+        return self.date == datetime.now().date()
+    
+    # Подпись как на кнопках выбора даты. Пометка "Сегодня" зависит от текущего дня и не кэшируется
+    @property
+    def label(self):
+        label = f"{self.clean} ({self.weekday_name})"
+        return f"{label} - Сегодня" if self.is_today else label
+    
+    def __str__(self):
+        return self.label
+    
+    def __repr__(self):
+        return f"StudioDate({self.clean})"
+    
+    def __eq__(self, other):
+        return isinstance(other, StudioDate) and self.date == other.date
+    
+    def __hash__(self):
+        return hash(self.date)
+
+# Подписи времени "ЧЧ:ММ" (с шагом 5 минут, включая "24:00" для конца дня) -> минуты от полуночи
+TIME_LABEL_MINUTES = {f"{minutes // 60:02d}:{minutes % 60:02d}": minutes for minutes in range(0, 24 * 60 + 5, 5)}
+
+# Разбор времени "ЧЧ:ММ" в минуты от полуночи
+def clock_minutes(time):
+    minutes = TIME_LABEL_MINUTES.get(time)
+    if minutes is None:
+        parsed = datetime.strptime(time, "%H:%M")
+        minutes = parsed.hour * 60 + parsed.minute
+    return minutes
+
+# Сессия в студии: дата, время начала и продолжительность в часах
+class SessionSlot:
+    __slots__ = ('day', 'time', 'hour', 'minute', 'duration')
+    
+    def __init__(self, day, time, duration=1):
+        self.day = StudioDate.parse(day)
+        self.time = time
+        self.duration = duration
+        
+        self.hour, self.minute = divmod(clock_minutes(time), 60)
+    
+    # Начало и конец сессии в минутах от полуночи
+    @property
+    def start_minutes(self):
+        return self.hour * 60 + self.minute
+    
+    @property
+    def end_minutes(self):
+        return self.start_minutes + self.duration * 60
+    
+    @property
+    def start(self):
+        return datetime.combine(self.day.date, dt_time(self.hour, self.minute))
+    
+    def __repr__(self):
+        return f"SessionSlot({self.day.clean} {self.time}, {self.duration} ч)"
+
+# Преобразование даты брони (ДД.ММ.ГГГГ) в дату сессии для индексированных запросов (ГГГГ-ММ-ДД)
+def to_session_date(day):
+    return StudioDate.parse(day).iso
+
+# Обновление дневных агрегатов и счетчиков пользователя при создании брони или смене ее статуса
+def record_booking_transition(cursor, day, time, duration, user_id, user_name, old_status, new_status):
+    """Вызывается в той же транзакции, что и запись в bookings.
+    old_status = None означает новую бронь"""
+    record_booking_transitions(cursor, [(day, time, duration, user_id, user_name, old_status, new_status)])
+
+# То же для пачки переходов: приращения суммируются, и каждая строка агрегатов обновляется один раз
+def record_booking_transitions(cursor, transitions):
+    """transitions - список (day, time, duration, user_id, user_name, old_status, new_status)"""
+    slot_deltas = {}
+    client_deltas = {}
+    user_deltas = {}
+    
+    for day, time, duration, user_id, user_name, old_status, new_status in transitions:
+        bookings_delta = (new_status == 'confirmed') - (old_status == 'confirmed')
+        cancelled_delta = (new_status == 'cancelled') - (old_status == 'cancelled')
+        total_delta = 1 if old_status is None else 0
+        
+        if not (bookings_delta or cancelled_delta or total_delta):
+            continue
+        
+        session_day = to_session_date(day)
+        slot = slot_deltas.setdefault((session_day, int(time.split(':')[0])), [0, 0, 0, 0])
+        slot[0] += bookings_delta
+        slot[1] += bookings_delta * duration
+        slot[2] += cancelled_delta
+        slot[3] += total_delta
+        
+        if bookings_delta:
+            client = client_deltas.setdefault((session_day, user_id or 0, user_name), [0, 0])
+            client[0] += bookings_delta
+            client[1] += bookings_delta * duration
+            
+            # Счетчики пользователя меняются на то же приращение - без пересчета по всей его истории
+            if user_id:
+                user = user_deltas.setdefault(user_id, [0, 0])
+                user[0] += bookings_delta
+                user[1] += bookings_delta * duration
+    
+    cursor.executemany('''
+        INSERT INTO daily_stats (day, hour, bookings_count, hours_count, cancelled_count, total_count)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (day, hour) DO UPDATE SET
+            bookings_count = bookings_count + excluded.bookings_count,
+            hours_count = hours_count + excluded.hours_count,
+            cancelled_count = cancelled_count + excluded.cancelled_count,
+            total_count = total_count + excluded.total_count
+    ''', [key + tuple(deltas) for key, deltas in slot_deltas.items()])
+    
+    cursor.executemany('''
+        INSERT INTO daily_client_stats (day, user_id, user_name, bookings_count, hours_count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (day, user_id, user_name) DO UPDATE SET
+            bookings_count = bookings_count + excluded.bookings_count,
+            hours_count = hours_count + excluded.hours_count
+    ''', [key + tuple(deltas) for key, deltas in client_deltas.items()])
+    
+    cursor.executemany('''
+        UPDATE users
+        SET bookings_count = bookings_count + ?, total_hours = total_hours + ?
+        WHERE user_id = ?
+    ''', [(count, hours, user_id) for user_id, (count, hours) in user_deltas.items()])
+
+# Названия статусов брони для сообщений
+BOOKING_STATUS_NAMES = {
+    'pending': 'ожидает подтверждения',
+    'confirmed': 'подтверждена',
+    'cancelled': 'отменена клиентом',
+    'cancelled_by_admin': 'отменена администратором'
+}
+
+# Допустимые переходы статусов: новый статус -> из каких статусов в него можно перейти
+BOOKING_TRANSITIONS = {
+    'confirmed': ('pending',),
+    'cancelled': ('pending', 'confirmed'),
+    'cancelled_by_admin': ('pending', 'confirmed')
+}
+
+# Смена статуса брони по принципу compare-and-set
+def transition_booking(booking_id, new_status, from_statuses=None):
+    """Статус меняется, только если он все еще тот, что был прочитан, и переход допустим.
+    Возвращает (user_id, user_name, day, time, duration, status, username, client_contact) и
+    признак, что переход выполнен. Если нет - status содержит текущий статус брони.
+    Повторное нажатие кнопки ничего не меняет и не приводит к повторным уведомлениям"""
+    if from_statuses is None:
+        from_statuses = BOOKING_TRANSITIONS[new_status]
+    
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            SELECT b.user_id, b.user_name, b.day, b.time, b.duration, b.status, u.username, b.client_contact
+            FROM bookings b
+            LEFT JOIN users u ON b.user_id = u.user_id
+            WHERE b.id = ?
+        ''', (booking_id,))
+        booking = cursor.fetchone()
+        
+        if not booking or booking[5] not in from_statuses:
+            return booking, False
+        
+        user_id, user_name, day, time, duration, status = booking[:6]
+        
+        # Обновление проходит, только если статус не изменился с момента чтения
+        cursor.execute('UPDATE bookings SET status = ? WHERE id = ? AND status = ?', (new_status, booking_id, status))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            cursor.execute('SELECT status FROM bookings WHERE id = ?', (booking_id,))
+            return booking[:5] + (cursor.fetchone()[0],) + booking[6:], False
+        
+        record_booking_transition(cursor, day, time, duration, user_id, user_name, status, new_status)
+        conn.commit()
+    finally:
+        conn.close()
+    
+    mark_bookings_changed(booking_id)
+    return booking, True
+
+# Сколько последних id нажатий на кнопки помнить для отсева повторной доставки
+CALLBACK_DEDUP_KEEP = 1000
+_seen_callback_ids = set()
+_seen_callback_order = deque()
+
+# Проверка повторной доставки того же нажатия (один и тот же callback_query.id)
+def is_duplicate_callback(query):
+    if query.id in _seen_callback_ids:
+        print(f"🔁 Повторное нажатие {query.id} ({query.data}) пропущено")
+        return True
+    
+    _seen_callback_ids.add(query.id)
+    _seen_callback_order.append(query.id)
+    if len(_seen_callback_order) > CALLBACK_DEDUP_KEEP:
+        _seen_callback_ids.discard(_seen_callback_order.popleft())
+    return False
+
+# Ответ на нажатие по уже обработанной брони - всплывающее уведомление без новых сообщений
+async def answer_stale_booking(query, booking_id, status):
+    await query.answer(f"ℹ️ Бронь #{booking_id} уже {BOOKING_STATUS_NAMES.get(status, status)}", show_alert=True)
+
+# Первичное заполнение дневных агрегатов по существующим бронированиям
+def backfill_daily_stats():
+    try:
+        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM daily_stats), EXISTS (SELECT 1 FROM bookings)')
+        has_stats, has_bookings = cursor.fetchone()
+        
+        # Агрегаты ведутся вместе с бронированиями, пересчет нужен только для базы без них
+        if has_stats or not has_bookings:
+            conn.close()
+            return
+        
+        session_day = "substr(day, 7, 4) || '-' || substr(day, 4, 2) || '-' || substr(day, 1, 2)"
+        
+        cursor.execute(f'''
+            INSERT INTO daily_stats (day, hour, bookings_count, hours_count, cancelled_count, total_count)
+            SELECT 
+                {session_day},
+                CAST(substr(time, 1, 2) AS INTEGER),
+                SUM(status = 'confirmed'),
+                COALESCE(SUM(CASE WHEN status = 'confirmed' THEN duration END), 0),
+                SUM(status = 'cancelled'),
+                COUNT(*)
+            FROM bookings
+            GROUP BY 1, 2
+        ''')
+        
+        cursor.execute(f'''
+            INSERT INTO daily_client_stats (day, user_id, user_name, bookings_count, hours_count)
+            SELECT {session_day}, COALESCE(user_id, 0), user_name, COUNT(*), SUM(duration)
+            FROM bookings
+            WHERE status = 'confirmed'
+            GROUP BY 1, 2, 3
+        ''')
+        
+        conn.commit()
+        conn.close()
+        print("✅ Дневные агрегаты аналитики заполнены по существующим бронированиям")
+        
+    except Exception as e:
+        logger.error(f"Error in backfill_daily_stats: {e}")
+
+# Версия данных бронирований: увеличивается при каждой записи в bookings
+_bookings_data_version = 0
+
+# Кэш аналитики: (period_days, версия данных) -> (время расчета, результат)
+_analytics_cache = {}
+
+# Сколько секунд результат из кэша считается актуальным (период "последние N дней" сдвигается со временем)
+ANALYTICS_CACHE_TTL = 600
+
+# Журнал изменений бронирований: (версия данных, id броней). По нему колоночный движок
+# перечитывает статусы, в том числе в процессах пула аналитики, где свой экземпляр хранилища
+BOOKING_CHANGES_KEEP = 5000
+_booking_changes = deque(maxlen=BOOKING_CHANGES_KEEP)
+
+# Время последней записи в bookings. До первой записи считаем им время запуска:
+# изменения, сделанные до перезапуска, этому процессу неизвестны
+_bookings_changed_at = datetime.now()
+
+# Отметка об изменении бронирований (вызывается после каждой записи в bookings)
+def mark_bookings_changed(*booking_ids):
+    global _bookings_data_version, _bookings_changed_at
+    _bookings_data_version += 1
+    _bookings_changed_at = datetime.now()
+    # Результаты для старых версий больше не понадобятся
+    _analytics_cache.clear()
+    _booking_changes.append((_bookings_data_version, booking_ids))
+
+# Получение аналитики из кэша (None, если актуального результата нет)
+def get_cached_analytics(period_days):
+    cached = _analytics_cache.get((period_days, _bookings_data_version))
+    
+    if cached and (datetime.now() - cached[0]).total_seconds() < ANALYTICS_CACHE_TTL:
+        print(f"📦 Аналитика за {period_days} дней взята из кэша (версия данных {_bookings_data_version})")
+        return cached[1]
+    
+    return None
+
+# Сохранение аналитики в кэш для версии данных, на которой она считалась
+def store_cached_analytics(period_days, data_version, analytics):
+    if analytics and data_version == _bookings_data_version:
+        _analytics_cache[(period_days, data_version)] = (datetime.now(), analytics)
+
+# Расчет аналитики подходящим движком (без кэша)
+def compute_analytics_for_period(period_days):
+    # Длинные периоды считаются колоночным движком, если доступен NumPy
+    if np is not None and period_days > COLUMNAR_MIN_PERIOD_DAYS:
+        return compute_columnar_analytics(period_days)
+    return compute_advanced_analytics(period_days)
+
+# Функция для получения расширенной аналитики (с кэшированием)
+def get_advanced_analytics(period_days=30):
+    analytics = get_cached_analytics(period_days)
+    if analytics:
+        return analytics
+    
+    data_version = _bookings_data_version
+    analytics = compute_analytics_for_period(period_days)
+    store_cached_analytics(period_days, data_version, analytics)
+    return analytics
+
+# Стандартные периоды меню аналитики, отчеты за которые рассчитываются заранее
+STANDARD_ANALYTICS_PERIODS = (7, 30, 90)
+
+# Ночной расчет отчетов - в часы, когда записей почти нет
+ANALYTICS_PRECOMPUTE_TIME = dt_time(4, 0, tzinfo=datetime.now().astimezone().tzinfo)
+
+# Сохраненный отчет старше этого срока не используется, даже если записей не было (период сдвигается)
+ANALYTICS_REPORT_MAX_AGE = timedelta(hours=24)
+
+# Сохранение заранее рассчитанного отчета
+def save_analytics_report(period_days, computed_at, analytics):
+    try:
+        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO analytics_reports (period_days, computed_at, payload)
+            VALUES (?, ?, ?)
+        ''', (period_days, computed_at.strftime('%Y-%m-%d %H:%M:%S'), json.dumps(analytics, ensure_ascii=False)))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"Error in save_analytics_report: {e}")
+
+# Получение сохраненного отчета, если после его расчета бронирования не менялись
+def get_stored_analytics(period_days):
+    try:
+        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+        cursor = conn.cursor()
+        cursor.execute('SELECT computed_at, payload FROM analytics_reports WHERE period_days = ?', (period_days,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if not row:
+            return None
+        
+        computed_at = parse_db_time(row[0])
+        if computed_at < _bookings_changed_at or datetime.now() - computed_at > ANALYTICS_REPORT_MAX_AGE:
+            return None
+        
+        analytics = json.loads(row[1])
+        analytics['computed_at'] = row[0]
+        print(f"📦 Аналитика за {period_days} дней взята из сохраненного отчета от {row[0]}")
+        return analytics
+        
+    except Exception as e:
+        logger.error(f"Error in get_stored_analytics: {e}")
+        return None
+
+# Функция для получения расширенной аналитики без блокировки бота (расчет в пуле процессов)
+async def get_advanced_analytics_async(period_days=30, on_progress=None):
+    # Сначала сохраненный ночной отчет, если после него не было записей, затем кэш
+    if period_days in STANDARD_ANALYTICS_PERIODS:
+        analytics = get_stored_analytics(period_days)
+        if analytics:
+            return analytics
+    
+    analytics = get_cached_analytics(period_days)
+    if analytics:
+        return analytics
+    
+    data_version = _bookings_data_version
+    analytics = await run_analytics_task(
+        build_analytics_report, period_days, data_version, list(_booking_changes),
+        on_progress=on_progress
+    )
+    store_cached_analytics(period_days, data_version, analytics)
+    return analytics
+
+# Пул процессов для тяжелых отчетов: аналитика, CSV экспорт и графики не занимают поток бота
+ANALYTICS_WORKERS = 2
+
+# Как часто (в секундах) проверять прогресс задачи и обновлять сообщение о загрузке
+ANALYTICS_PROGRESS_INTERVAL = 1.0
+
+_analytics_pool = None
+_analytics_progress_queue = None
+_analytics_progress = {}   # id задачи -> последнее сообщение о прогрессе
+_analytics_task_counter = 0
+
+# Состояние процесса пула (в основном процессе не меняется)
+_analytics_read_only = False
+_analytics_worker_queue = None
+_analytics_task_id = None
+
+# Инициализация процесса пула
+def _init_analytics_worker(progress_queue):
+    global _analytics_read_only, _analytics_worker_queue
+    _analytics_read_only = True
+    _analytics_worker_queue = progress_queue
+
+# Выполнение задачи в процессе пула с привязкой сообщений о прогрессе к задаче
+def _run_analytics_task(task_id, func, *args):
+    global _analytics_task_id
+    _analytics_task_id = task_id
+    try:
+        return func(*args)
+    finally:
+        _analytics_task_id = None
+
+# Сообщение о ходе расчета (в основном процессе ничего не делает)
+def report_progress(text):
+    if _analytics_worker_queue is not None and _analytics_task_id is not None:
+        _analytics_worker_queue.put((_analytics_task_id, text))
+
+# Соединение для отчетов: в процессах пула база открывается только на чтение
+def connect_analytics_db():
+    if _analytics_read_only:
+        return sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True, check_same_thread=False)
+    return sqlite3.connect('studio_schedule.db', check_same_thread=False)
+
+# Получение пула процессов аналитики (создается при первом обращении)
+def get_analytics_pool():
+    global _analytics_pool, _analytics_progress_queue
+    if _analytics_pool is None:
+        # spawn: процессы не наследуют потоки и соединения бота
+        mp_context = multiprocessing.get_context('spawn')
+        _analytics_progress_queue = mp_context.Queue()
+        _analytics_pool = ProcessPoolExecutor(
+            max_workers=ANALYTICS_WORKERS,
+            mp_context=mp_context,
+            initializer=_init_analytics_worker,
+            initargs=(_analytics_progress_queue,)
+        )
+        print(f"⚙️ Запущен пул аналитики ({ANALYTICS_WORKERS} процесса)")
+    return _analytics_pool
+
+# Сброс сломанного пула (процесс упал, например, по нехватке памяти): пул пересоздается при следующем обращении
+def _reset_analytics_pool(pool, e):
+    """Пул, уже пересозданный другой задачей, не трогается"""
+    global _analytics_pool
+    logger.error(f"Analytics pool is broken: {e}")
+    pool.shutdown(wait=False, cancel_futures=True)
+    if _analytics_pool is pool:
+        _analytics_pool = None
+
+# Перенос сообщений о прогрессе из очереди пула к ожидающим задачам
+def _drain_analytics_progress():
+    while True:
+        try:
+            task_id, text = _analytics_progress_queue.get_nowait()
+        except queue.Empty:
+            return
+        if task_id in _analytics_progress:
+            _analytics_progress[task_id] = text
+
+# Запуск задачи в пуле аналитики с передачей прогресса в on_progress(text)
+async def run_analytics_task(func, *args, on_progress=None):
+    """Если пул недоступен, задача выполняется в отдельном потоке основного процесса"""
+    global _analytics_task_counter
+    loop = asyncio.get_running_loop()
+    
     try:
-        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+        pool = get_analytics_pool()
+        _analytics_task_counter += 1
+        task_id = _analytics_task_counter
+        _analytics_progress[task_id] = None
+        future = loop.run_in_executor(pool, _run_analytics_task, task_id, func, *args)
+    except BrokenProcessPool as e:
+        # Пул сломался, пока простаивал - ошибка приходит уже при отправке задачи
+        _analytics_progress.pop(task_id, None)
+        _reset_analytics_pool(pool, e)
+        return await asyncio.to_thread(func, *args)
+    except Exception as e:
+        logger.error(f"Error starting analytics task: {e}")
+        return await asyncio.to_thread(func, *args)
+    
+    last_text = None
+    try:
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=ANALYTICS_PROGRESS_INTERVAL)
+            if done:
+                return future.result()
+            
+            _drain_analytics_progress()
+            text = _analytics_progress.get(task_id)
+            if on_progress and text and text != last_text:
+                last_text = text
+                try:
+                    await on_progress(text)
+                except Exception as e:
+                    logger.error(f"Error in analytics progress callback: {e}")
+    
+    except BrokenProcessPool as e:
+        # Процесс пула упал - пересоздаем пул при следующем обращении, а отчет считаем здесь
+        _reset_analytics_pool(pool, e)
+        return await asyncio.to_thread(func, *args)
+    
+    finally:
+        _analytics_progress.pop(task_id, None)
+
+# Точка входа пула для расчета аналитики
+def build_analytics_report(period_days, data_version, booking_changes):
+    """Версия данных и журнал изменений передаются из основного процесса,
+    чтобы колоночное хранилище процесса пула обновило измененные статусы"""
+    global _bookings_data_version
+    if _analytics_read_only:
+        _bookings_data_version = data_version
+        _booking_changes.clear()
+        _booking_changes.extend(booking_changes)
+    
+    report_progress("🔍 Считаю показатели за период...")
+    return compute_analytics_for_period(period_days)
+
+# Названия дней недели (индекс - datetime.weekday())
+WEEKDAY_NAMES = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+# Функция для расчета расширенной аналитики
+def compute_advanced_analytics(period_days=30):
+    """Показатели считаются по дневным агрегатам daily_stats, поэтому стоимость расчета
+    зависит от количества дней, а не от количества бронирований.
+    Период - сессии начиная с даты period_days дней назад, включая уже запланированные"""
+    try:
+        conn = connect_analytics_db()
         cursor = conn.cursor()
         
         end_date = datetime.now()
-        start_date = end_date - timedelta(days=period_days)
-        start_date_str = start_date.strftime('%Y-%m-%d %H:%M:%S')
-        end_date_str = end_date.strftime('%Y-%m-%d %H:%M:%S')
+        start_day = (end_date - timedelta(days=period_days)).strftime('%Y-%m-%d')
         
         # Основная статистика
         cursor.execute('''
             SELECT 
-                COUNT(*) as total_bookings,
-                SUM(duration) as total_hours,
-                AVG(duration) as avg_session_length,
-                COUNT(DISTINCT user_id) as unique_clients
-            FROM bookings 
-            WHERE status = 'confirmed' 
-            AND created_at BETWEEN ? AND ?
-        ''', (start_date_str, end_date_str))
+                SUM(bookings_count),
+                SUM(hours_count),
+                SUM(cancelled_count),
+                SUM(total_count)
+            FROM daily_stats
+            WHERE day >= ?
+        ''', (start_day,))
+        
+        total_bookings, total_hours, cancelled_count, total_count = cursor.fetchone()
+        total_bookings = total_bookings or 0
+        total_hours = total_hours or 0
         
-        stats = cursor.fetchone()
-        total_bookings, total_hours, avg_session_length, unique_clients = stats
-        
-        # Статистика по дням недели
         cursor.execute('''
-            SELECT 
-                CASE strftime('%w', created_at)
-                    WHEN '0' THEN 'Воскресенье'
-                    WHEN '1' THEN 'Понедельник'
-                    WHEN '2' THEN 'Вторник'
-                    WHEN '3' THEN 'Среда'
-                    WHEN '4' THEN 'Четверг'
-                    WHEN '5' THEN 'Пятница'
-                    WHEN '6' THEN 'Суббота'
-                END as day_name,
-                COUNT(*) as bookings_count,
-                SUM(duration) as hours_count
-            FROM bookings 
-            WHERE status = 'confirmed' 
-            AND created_at BETWEEN ? AND ?
-            GROUP BY day_name
-            ORDER BY bookings_count DESC
-        ''', (start_date_str, end_date_str))
+            SELECT COUNT(DISTINCT user_id)
+            FROM daily_client_stats
+            WHERE day >= ? AND user_id != 0 AND bookings_count > 0
+        ''', (start_day,))
         
-        days_stats = cursor.fetchall()
+        unique_clients = cursor.fetchone()[0]
+        
+        # Статистика по дням недели (день недели считаем по дате в Python)
+        cursor.execute('''
+            SELECT day, SUM(bookings_count), SUM(hours_count)
+            FROM daily_stats
+            WHERE day >= ?
+            GROUP BY day
+            HAVING SUM(bookings_count) > 0
+        ''', (start_day,))
+        
+        days = {}
+        for day, bookings_count, hours_count in cursor.fetchall():
+            day_stats = days.setdefault(datetime.strptime(day, '%Y-%m-%d').weekday(), [0, 0])
+            day_stats[0] += bookings_count
+            day_stats[1] += hours_count
+        
+        days_stats = sorted(
+            ((WEEKDAY_NAMES[weekday], count, hours_count) for weekday, (count, hours_count) in days.items()),
+            key=lambda item: item[1],
+            reverse=True
+        )
         
         # Статистика по времени суток
         cursor.execute('''
-            SELECT 
-                substr(time, 1, 2) as hour,
-                COUNT(*) as bookings_count
-            FROM bookings 
-            WHERE status = 'confirmed' 
-            AND created_at BETWEEN ? AND ?
-            GROUP BY substr(time, 1, 2)
+            SELECT printf('%02d', hour), SUM(bookings_count) as bookings_count
+            FROM daily_stats
+            WHERE day >= ?
+            GROUP BY hour
+            HAVING SUM(bookings_count) > 0
             ORDER BY bookings_count DESC
             LIMIT 5
-        ''', (start_date_str, end_date_str))
+        ''', (start_day,))
         
         hours_stats = cursor.fetchall()
         
@@ -257,45 +1439,37 @@ def get_advanced_analytics(period_days=30):
                 u.user_id,
                 u.first_name,
                 u.last_name,
-                b.user_name,
-                COUNT(b.id) as bookings_count,
-                SUM(b.duration) as total_hours
-            FROM bookings b
-            LEFT JOIN users u ON b.user_id = u.user_id
-            WHERE b.status = 'confirmed' 
-            AND b.created_at BETWEEN ? AND ?
-            GROUP BY b.user_name, u.user_id, u.first_name, u.last_name
+                c.user_name,
+                SUM(c.bookings_count) as bookings_count,
+                SUM(c.hours_count) as total_hours
+            FROM daily_client_stats c
+            LEFT JOIN users u ON c.user_id = u.user_id
+            WHERE c.day >= ?
+            GROUP BY c.user_name, u.user_id, u.first_name, u.last_name
+            HAVING SUM(c.bookings_count) > 0
             ORDER BY bookings_count DESC
             LIMIT 10
-        ''', (start_date_str, end_date_str))
+        ''', (start_day,))
         
         top_clients = cursor.fetchall()
         
-        # Статистика отмен
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as cancelled_count,
-                (SELECT COUNT(*) FROM bookings WHERE created_at BETWEEN ? AND ?) as total_count
-            FROM bookings 
-            WHERE status = 'cancelled' 
-            AND created_at BETWEEN ? AND ?
-        ''', (start_date_str, end_date_str, start_date_str, end_date_str))
-        
-        cancel_stats = cursor.fetchone()
-        cancelled_count, total_count = cancel_stats
+        # Ежемесячная динамика за последние 6 месяцев (по дате сессии)
+        month_start = end_date.replace(day=1)
+        for _ in range(5):
+            month_start = (month_start - timedelta(days=1)).replace(day=1)
+        next_month_start = (end_date.replace(day=1) + timedelta(days=32)).replace(day=1)
         
-        # Ежемесячная динамика
         cursor.execute('''
             SELECT 
-                strftime('%Y-%m', created_at) as month,
-                COUNT(*) as bookings_count,
-                SUM(duration) as hours_count
-            FROM bookings 
-            WHERE status = 'confirmed'
-            GROUP BY strftime('%Y-%m', created_at)
+                substr(day, 1, 7) as month,
+                SUM(bookings_count) as bookings_count,
+                SUM(hours_count) as hours_count
+            FROM daily_stats
+            WHERE day >= ? AND day < ?
+            GROUP BY month
+            HAVING SUM(bookings_count) > 0
             ORDER BY month DESC
-            LIMIT 6
-        ''')
+        ''', (month_start.strftime('%Y-%m-%d'), next_month_start.strftime('%Y-%m-%d')))
         
         monthly_stats = cursor.fetchall()
         
@@ -303,10 +1477,10 @@ def get_advanced_analytics(period_days=30):
         
         return {
             'period_days': period_days,
-            'total_bookings': total_bookings or 0,
-            'total_hours': total_hours or 0,
-            'avg_session_length': round(avg_session_length or 0, 1),
-            'unique_clients': unique_clients or 0,
+            'total_bookings': total_bookings,
+            'total_hours': total_hours,
+            'avg_session_length': round(total_hours / total_bookings, 1) if total_bookings else 0,
+            'unique_clients': unique_clients,
             'days_stats': days_stats,
             'hours_stats': hours_stats,
             'top_clients': top_clients,
@@ -316,14 +1490,454 @@ def get_advanced_analytics(period_days=30):
         }
         
     except Exception as e:
-        logger.error(f"Error in get_advanced_analytics: {e}")
+        logger.error(f"Error in compute_advanced_analytics: {e}")
+        return None
+
+# Колоночный движок аналитики: бронирования в массивах NumPy, загружаются один раз
+# и дополняются новыми строками, расчет за любой период - векторные свертки
+COLUMNAR_MIN_PERIOD_DAYS = 30
+
+# Коды статусов в колоночном хранилище
+BOOKING_STATUS_CODES = {'pending': 0, 'confirmed': 1, 'cancelled': 2, 'cancelled_by_admin': 3}
+
+_columnar_store = {
+    'size': 0,
+    'columns': None,      # имя колонки -> массив NumPy (с запасом емкости)
+    'clients': [],        # код клиента -> (user_id, user_name)
+    'client_codes': {},   # (user_id, user_name) -> код клиента
+    'version': 0          # версия данных бронирований, до которой применены изменения статусов
+}
+
+# Добавление строк бронирований в колоночное хранилище
+def _columnar_append(rows):
+    store = _columnar_store
+    size = store['size']
+    needed = size + len(rows)
+    
+    if store['columns'] is None or needed > len(store['columns']['id']):
+        # Емкость растет удвоением, чтобы добавление одной брони не копировало все массивы
+        capacity = max(1024, needed * 2)
+        columns = {
+            'id': np.zeros(capacity, dtype=np.int64),
+            'day': np.zeros(capacity, dtype=np.int32),       # порядковый номер даты сессии
+            'month': np.zeros(capacity, dtype=np.int32),     # год * 12 + месяц - 1
+            'weekday': np.zeros(capacity, dtype=np.int8),
+            'hour': np.zeros(capacity, dtype=np.int8),
+            'duration': np.zeros(capacity, dtype=np.int16),
+            'status': np.zeros(capacity, dtype=np.int8),
+            'user_id': np.zeros(capacity, dtype=np.int64),
+            'client': np.zeros(capacity, dtype=np.int32)
+        }
+        if store['columns'] is not None:
+            for name, column in store['columns'].items():
+                columns[name][:size] = column[:size]
+        store['columns'] = columns
+    
+    columns = store['columns']
+    # Дат в выборке намного меньше, чем броней, поэтому разбор строки кешируется по дню
+    parsed_days = {}
+    for offset, (booking_id, day, time, duration, status, user_id, user_name) in enumerate(rows, size):
+        session_date = parsed_days.get(day)
+        if session_date is None:
+            session_date = parsed_days[day] = datetime.strptime(day, "%d.%m.%Y").date()
+        client_key = (user_id or 0, user_name)
+        client_code = store['client_codes'].get(client_key)
+        if client_code is None:
+            client_code = store['client_codes'][client_key] = len(store['clients'])
+            store['clients'].append(client_key)
+        
+        columns['id'][offset] = booking_id
+        columns['day'][offset] = session_date.toordinal()
+        columns['month'][offset] = session_date.year * 12 + session_date.month - 1
+        columns['weekday'][offset] = session_date.weekday()
+        columns['hour'][offset] = int(time.split(':')[0])
+        columns['duration'][offset] = duration or 0
+        columns['status'][offset] = BOOKING_STATUS_CODES.get(status, 0)
+        columns['user_id'][offset] = user_id or 0
+        columns['client'][offset] = client_code
+    
+    store['size'] = needed
+
+# Синхронизация колоночного хранилища с базой: новые брони и измененные статусы
+def _columnar_sync(cursor):
+    store = _columnar_store
+    size = store['size']
+    last_id = int(store['columns']['id'][size - 1]) if size else 0
+    
+    cursor.execute('''
+        SELECT id, day, time, duration, status, user_id, user_name
+        FROM bookings
+        WHERE id > ?
+        ORDER BY id
+    ''', (last_id,))
+    new_rows = cursor.fetchall()
+    
+    changes = [entry for entry in list(_booking_changes) if entry[0] > store['version']]
+    
+    # Журнал изменений ограничен по длине: если часть изменений из него уже вытеснена,
+    # хранилище загружается заново
+    if size and changes and changes[0][0] != store['version'] + 1:
+        print("🔄 Колоночное хранилище отстало от журнала изменений, загружаю заново")
+        store.update(size=0, columns=None, clients=[], client_codes={})
+        store['version'] = _bookings_data_version
+        return _columnar_sync(cursor)
+    
+    dirty_ids = sorted({booking_id for _, booking_ids in changes for booking_id in booking_ids if booking_id <= last_id})
+    store['version'] = _bookings_data_version
+    
+    if new_rows:
+        report_progress(f"📥 Загружаю новые брони: {len(new_rows)}")
+        _columnar_append(new_rows)
+    
+    # id в хранилище возрастают, поэтому позицию брони находим бинарным поиском
+    for i in range(0, len(dirty_ids), 500):
+        chunk = dirty_ids[i:i + 500]
+        cursor.execute(
+            f"SELECT id, status FROM bookings WHERE id IN ({','.join('?' * len(chunk))})",
+            chunk
+        )
+        ids = store['columns']['id'][:store['size']]
+        for booking_id, status in cursor.fetchall():
+            position = np.searchsorted(ids, booking_id)
+            if position < len(ids) and ids[position] == booking_id:
+                store['columns']['status'][position] = BOOKING_STATUS_CODES.get(status, 0)
+
+# Функция для расчета расширенной аналитики колоночным движком
+def compute_columnar_analytics(period_days=30):
+    """Те же показатели, что и compute_advanced_analytics, но векторными операциями по массивам"""
+    try:
+        conn = connect_analytics_db()
+        cursor = conn.cursor()
+        
+        _columnar_sync(cursor)
+        
+        store = _columnar_store
+        size = store['size']
+        columns = {name: column[:size] for name, column in store['columns'].items()} if size else None
+        
+        end_date = datetime.now()
+        start_ordinal = (end_date - timedelta(days=period_days)).date().toordinal()
+        
+        if columns is None:
+            conn.close()
+            return {
+                'period_days': period_days, 'total_bookings': 0, 'total_hours': 0,
+                'avg_session_length': 0, 'unique_clients': 0, 'days_stats': [],
+                'hours_stats': [], 'top_clients': [], 'cancelled_count': 0,
+                'total_count': 0, 'monthly_stats': []
+            }
+        
+        in_period = columns['day'] >= start_ordinal
+        confirmed = in_period & (columns['status'] == BOOKING_STATUS_CODES['confirmed'])
+        durations = columns['duration'][confirmed].astype(np.int64)
+        
+        total_bookings = int(confirmed.sum())
+        total_hours = int(durations.sum())
+        total_count = int(in_period.sum())
+        cancelled_count = int((in_period & (columns['status'] == BOOKING_STATUS_CODES['cancelled'])).sum())
+        
+        user_ids = columns['user_id'][confirmed]
+        unique_clients = int(np.unique(user_ids[user_ids != 0]).size)
+        
+        # Гистограммы по дням недели и часам
+        weekdays = columns['weekday'][confirmed]
+        weekday_counts = np.bincount(weekdays, minlength=7)
+        weekday_hours = np.bincount(weekdays, weights=durations, minlength=7)
+        days_stats = sorted(
+            ((WEEKDAY_NAMES[weekday], int(weekday_counts[weekday]), int(weekday_hours[weekday]))
+             for weekday in range(7) if weekday_counts[weekday]),
+            key=lambda item: item[1],
+            reverse=True
+        )
+        
+        hour_counts = np.bincount(columns['hour'][confirmed], minlength=24)
+        hours_stats = [
+            (f"{hour:02d}", int(hour_counts[hour]))
+            for hour in np.argsort(-hour_counts, kind='stable')[:5] if hour_counts[hour]
+        ]
+        
+        # Топ клиентов
+        clients = columns['client'][confirmed]
+        client_counts = np.bincount(clients, minlength=len(store['clients']))
+        client_hours = np.bincount(clients, weights=durations, minlength=len(store['clients']))
+        top_codes = [code for code in np.argsort(-client_counts, kind='stable')[:10] if client_counts[code]]
+        
+        top_user_ids = [store['clients'][code][0] for code in top_codes if store['clients'][code][0]]
+        user_names = {}
+        if top_user_ids:
+            cursor.execute(
+                f"SELECT user_id, first_name, last_name FROM users WHERE user_id IN ({','.join('?' * len(top_user_ids))})",
+                top_user_ids
+            )
+            user_names = {row[0]: row for row in cursor.fetchall()}
+        
+        top_clients = []
+        for code in top_codes:
+            user_id, user_name = store['clients'][code]
+            client_id, first_name, last_name = user_names.get(user_id, (None, None, None))
+            top_clients.append((client_id, first_name, last_name, user_name, int(client_counts[code]), int(client_hours[code])))
+        
+        conn.close()
+        
+        # Ежемесячная динамика за последние 6 месяцев (по дате сессии)
+        current_month = end_date.year * 12 + end_date.month - 1
+        all_confirmed = columns['status'] == BOOKING_STATUS_CODES['confirmed']
+        month_offsets = current_month - columns['month'][all_confirmed]
+        recent = (month_offsets >= 0) & (month_offsets < 6)
+        month_counts = np.bincount(month_offsets[recent], minlength=6)
+        month_hours = np.bincount(
+            month_offsets[recent],
+            weights=columns['duration'][all_confirmed][recent].astype(np.int64),
+            minlength=6
+        )
+        monthly_stats = [
+            (f"{(current_month - offset) // 12}-{(current_month - offset) % 12 + 1:02d}", int(month_counts[offset]), int(month_hours[offset]))
+            for offset in range(6) if month_counts[offset]
+        ]
+        
+        return {
+            'period_days': period_days,
+            'total_bookings': total_bookings,
+            'total_hours': total_hours,
+            'avg_session_length': round(total_hours / total_bookings, 1) if total_bookings else 0,
+            'unique_clients': unique_clients,
+            'days_stats': days_stats,
+            'hours_stats': hours_stats,
+            'top_clients': top_clients,
+            'cancelled_count': cancelled_count,
+            'total_count': total_count,
+            'monthly_stats': monthly_stats
+        }
+        
+    except Exception as e:
+        logger.error(f"Error in compute_columnar_analytics: {e}")
+        return None
+
+# Функция для расчета загрузки студии по сетке "день недели × час"
+def compute_utilization(period_days=30):
+    """Матрица занятых слотов за последние period_days дней (по дате сессии, включая сегодня).
+    Многочасовая бронь занимает все свои слоты, заполняемость считается от часов работы каждого дня:
+    выходные, праздники и закрытые периоды в емкость не входят"""
+    try:
+        today = datetime.now().date()
+        start_date = today - timedelta(days=period_days - 1)
+        
+        conn = connect_analytics_db()
+        cursor = conn.cursor()
+        
+        # Один проход по покрывающему индексу idx_bookings_session
+        cursor.execute('''
+            SELECT session_date, time, duration
+            FROM bookings
+            WHERE session_date BETWEEN ? AND ? AND status = 'confirmed'
+        ''', (start_date.isoformat(), today.isoformat()))
+        
+        booked_by_date = {}
+        for session_date, time, duration in cursor:
+            booked_by_date.setdefault(session_date, []).append((time, duration))
+        
+        conn.close()
+        
+        # Клетка "день недели × час" копит занятые слоты и рабочие слоты всех таких дней периода
+        hours = get_working_hour_columns()
+        first_hour = hours[0] if hours else 0
+        matrix = [[0] * len(hours) for _ in range(7)]
+        capacity = [[0] * len(hours) for _ in range(7)]
+        
+        for offset in range(period_days):
+            studio_date = StudioDate.from_date(start_date + timedelta(days=offset))
+            day = build_day_capacity(studio_date, booked_by_date.get(studio_date.iso, ()))
+            if day is None:
+                continue
+            
+            window, open_mask, booked_mask = day
+            weekday = studio_date.date.weekday()
+            for index in range((window[1] - window[0]) // SLOT_MINUTES):
+                column = (window[0] + index * SLOT_MINUTES) // 60 - first_hour
+                capacity[weekday][column] += open_mask >> index & 1
+                matrix[weekday][column] += booked_mask >> index & 1
+        
+        def rate(booked, total):
+            return round(booked / total, 3) if total else 0
+        
+        booked_slots = sum(sum(row) for row in matrix)
+        capacity_slots = sum(sum(row) for row in capacity)
+        
+        return {
+            'period_days': period_days,
+            'start_date': start_date,
+            'end_date': today,
+            'hours': hours,
+            'matrix': matrix,
+            'fill_rates': [
+                [rate(booked, total) for booked, total in zip(matrix[weekday], capacity[weekday])]
+                for weekday in range(7)
+            ],
+            'weekday_fill': [rate(sum(matrix[weekday]), sum(capacity[weekday])) for weekday in range(7)],
+            'hour_fill': [
+                rate(sum(row[column] for row in matrix), sum(row[column] for row in capacity))
+                for column in range(len(hours))
+            ],
+            'booked_hours': slots_to_hours(booked_slots),
+            'capacity_hours': slots_to_hours(capacity_slots),
+            'fill_rate': rate(booked_slots, capacity_slots)
+        }
+        
+    except Exception as e:
+        logger.error(f"Error in compute_utilization: {e}")
+        return None
+
+# Символы текстовой тепловой карты от пустого слота к полностью занятому
+HEATMAP_SHADES = ' ░▒▓█'
+
+# Функция для формирования текстовой тепловой карты загрузки
+def format_utilization_grid(utilization):
+    short_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+    lines = ['   ' + ''.join(f"{hour:>2}" for hour in utilization['hours']) + '   %']
+    
+    for weekday in range(7):
+        cells = ''
+        for rate in utilization['fill_rates'][weekday]:
+            # Любая занятость видна: доля округляется вверх до ближайшего оттенка
+            cells += HEATMAP_SHADES[min(math.ceil(rate * (len(HEATMAP_SHADES) - 1)), len(HEATMAP_SHADES) - 1)] * 2
+        lines.append(f"{short_names[weekday]} {cells} {round(utilization['weekday_fill'][weekday] * 100):>3}")
+    
+    return '\n'.join(lines)
+
+# Функция для отрисовки тепловой карты загрузки в PNG (None, если matplotlib недоступен)
+def render_utilization_heatmap(utilization):
+    if plt is None:
+        return None
+    
+    try:
+        fig, ax = plt.subplots(figsize=(9, 4))
+        image = ax.imshow(
+            [[rate * 100 for rate in row] for row in utilization['fill_rates']],
+            cmap='YlOrRd', vmin=0, vmax=100, aspect='auto'
+        )
+        ax.set_xticks(range(len(utilization['hours'])))
+        ax.set_xticklabels([f"{hour}:00" for hour in utilization['hours']], rotation=45)
+        ax.set_yticks(range(7))
+        ax.set_yticklabels(WEEKDAY_NAMES)
+        ax.set_title(
+            f"Загрузка студии {utilization['start_date'].strftime('%d.%m.%Y')} - {utilization['end_date'].strftime('%d.%m.%Y')}"
+        )
+        fig.colorbar(image, ax=ax, label='% занятых слотов')
+        fig.tight_layout()
+        
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=120)
+        plt.close(fig)
+        return buffer.getvalue()
+        
+    except Exception as e:
+        logger.error(f"Error in render_utilization_heatmap: {e}")
+        return None
+
+# Точка входа пула для тепловой карты: расчет загрузки и картинка одной задачей
+def build_utilization_report(period_days):
+    report_progress("🔍 Считаю загрузку по дням недели и часам...")
+    utilization = compute_utilization(period_days)
+    if not utilization:
+        return None
+    
+    report_progress("🎨 Рисую тепловую карту...")
+    return {'utilization': utilization, 'image': render_utilization_heatmap(utilization)}
+
+# Сколько недельных когорт и недель жизни показывать в отчете вовлеченности
+ENGAGEMENT_COHORTS = 6
+
+# Функция для расчета вовлеченности пользователей по счетчикам активности
+def compute_engagement_stats():
+    """Все показатели читаются из инкрементальных счетчиков activity_counts и retention_cohorts
+    и индексных диапазонов по users.last_activity - журнал активности не сканируется"""
+    try:
+        conn = connect_analytics_db()
+        cursor = conn.cursor()
+        
+        now = datetime.now()
+        today = now.date()
+        
+        # Скользящие WAU/MAU - по индексу последней активности
+        rolling = {}
+        for days in (1, 7, 30):
+            since = (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+            cursor.execute('SELECT COUNT(*) FROM users WHERE last_activity >= ?', (since,))
+            rolling[days] = cursor.fetchone()[0]
+        
+        # Дневная динамика за 30 дней (для DAU за сегодня/вчера и среднего DAU)
+        month_start = (today - timedelta(days=29)).isoformat()
+        cursor.execute('''
+            SELECT period, active_users, new_users FROM activity_counts
+            WHERE period_type = 'day' AND period >= ?
+            ORDER BY period
+        ''', (month_start,))
+        daily = {day: (active_users, new_users) for day, active_users, new_users in cursor.fetchall()}
+        daily_stats = [
+            ((today - timedelta(days=offset)).isoformat(),) + daily.get((today - timedelta(days=offset)).isoformat(), (0, 0))
+            for offset in range(13, -1, -1)
+        ]
+        avg_dau = sum(active_users for active_users, _ in daily.values()) / 30
+        
+        report_progress("📅 Считаю недельную и месячную динамику...")
+        
+        cursor.execute('''
+            SELECT period, active_users, new_users FROM activity_counts
+            WHERE period_type = 'week' AND period >= ?
+            ORDER BY period
+        ''', (week_start((today - timedelta(weeks=7)).isoformat()),))
+        weekly_stats = cursor.fetchall()
+        
+        cursor.execute('''
+            SELECT period, active_users, new_users FROM activity_counts
+            WHERE period_type = 'month'
+            ORDER BY period DESC
+            LIMIT 6
+        ''')
+        monthly_stats = cursor.fetchall()[::-1]
+        
+        # Когорты: доля пользователей недели первого визита, активных через N недель
+        first_cohort = week_start((today - timedelta(weeks=ENGAGEMENT_COHORTS - 1)).isoformat())
+        cursor.execute('''
+            SELECT cohort_week, weeks_since, active_users FROM retention_cohorts
+            WHERE cohort_week >= ? AND weeks_since < ?
+            ORDER BY cohort_week, weeks_since
+        ''', (first_cohort, ENGAGEMENT_COHORTS))
+        cohorts = {}
+        for cohort_week, weeks_since, active_users in cursor.fetchall():
+            cohorts.setdefault(cohort_week, {})[weeks_since] = active_users
+        
+        conn.close()
+        
+        return {
+            'dau': rolling[1],
+            'wau': rolling[7],
+            'mau': rolling[30],
+            'avg_dau': round(avg_dau, 1),
+            'stickiness': round(avg_dau / rolling[30], 3) if rolling[30] else 0,
+            'daily_stats': daily_stats,
+            'weekly_stats': weekly_stats,
+            'monthly_stats': monthly_stats,
+            'cohorts': [
+                (cohort_week, weeks.get(0, 0), [
+                    round(weeks.get(weeks_since, 0) / weeks[0], 3) if weeks.get(0) else 0
+                    for weeks_since in range(ENGAGEMENT_COHORTS)
+                    if (datetime.strptime(cohort_week, '%Y-%m-%d').date() + timedelta(weeks=weeks_since)) <= today
+                ])
+                for cohort_week, weeks in sorted(cohorts.items())
+            ]
+        }
+        
+    except Exception as e:
+        logger.error(f"Error in compute_engagement_stats: {e}")
         return None
 
 # Функция для экспорта данных в CSV
-def export_analytics_to_csv(period_days=30):
-    """Экспорт данных аналитики в CSV файлы"""
+def export_analytics_to_csv(period_days=30, analytics=None):
+    """Экспорт данных аналитики в CSV файлы (готовую аналитику можно передать, чтобы не считать ее заново)"""
     try:
-        analytics = get_advanced_analytics(period_days)
+        if analytics is None:
+            analytics = get_advanced_analytics(period_days)
         if not analytics:
             return None
         
@@ -402,7 +2016,8 @@ def export_analytics_to_csv(period_days=30):
         monthly_stats_csv.close()
         
         # 6. Экспорт всех бронирований за период
-        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+        report_progress("📋 Выгружаю все бронирования за период...")
+        conn = connect_analytics_db()
         cursor = conn.cursor()
         
         end_date = datetime.now()
@@ -430,6 +2045,7 @@ def export_analytics_to_csv(period_days=30):
         all_bookings = cursor.fetchall()
         conn.close()
         
+        report_progress(f"📝 Формирую CSV: {len(all_bookings)} бронирований...")
         bookings_data = [['ID брони', 'ID клиента', 'Имя клиента', 'Дата', 'Время', 'Продолжительность', 'Статус', 'Дата создания', 'Добавлено админом', 'Контакт клиента']]
         for booking in all_bookings:
             bookings_data.append(list(booking))
@@ -459,7 +2075,7 @@ def export_analytics_to_csv(period_days=30):
 def export_users_to_csv():
     """Экспорт данных пользователей в CSV"""
     try:
-        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+        conn = connect_analytics_db()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -506,113 +2122,711 @@ def export_users_to_csv():
         logger.error(f"Error in export_users_to_csv: {e}")
         return None
 
-# Генерация дат на 7 дней вперед (НАЧИНАЯ С СЕГОДНЯШНЕГО ДНЯ)
-def generate_dates():
-    dates = []
-    today = datetime.now()
+# Копирование базы данных через online backup API SQLite
+def backup_database(target_path, pages=BACKUP_PAGES_PER_STEP, sleep=0.05):
+    """Консистентная копия базы: копирование идет шагами по pages страниц,
+    между шагами соединение отпускает базу, и запись бронирований не блокируется"""
+    source = sqlite3.connect(DB_PATH, check_same_thread=False)
+    target = sqlite3.connect(target_path, check_same_thread=False)
+    try:
+        source.backup(target, pages=pages, sleep=sleep)
+    finally:
+        target.close()
+        source.close()
+
+# Функция для создания снимка базы данных
+def create_db_snapshot(vacuum=True):
+    """Снимок базы данных на текущий момент для выгрузки одним файлом"""
+    try:
+        export_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"studio_schedule_{export_time}.db"
+        snapshot_dir = tempfile.mkdtemp(prefix='studio_snapshot_')
+
+        try:
+            snapshot_path = os.path.join(snapshot_dir, f"raw_{filename}")
+            backup_database(snapshot_path)
+
+            if vacuum:
+                # Сжимаем снимок: VACUUM INTO пишет компактную копию без пустых страниц
+                compact_path = os.path.join(snapshot_dir, filename)
+                conn = sqlite3.connect(snapshot_path, check_same_thread=False)
+                conn.execute('VACUUM INTO ?', (compact_path,))
+                conn.close()
+                snapshot_path = compact_path
+
+            with open(snapshot_path, 'rb') as snapshot_file:
+                snapshot_content = snapshot_file.read()
+        finally:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+        print(f"💾 Снимок базы данных создан: {filename} ({len(snapshot_content)} байт)")
+
+        return {
+            'content': snapshot_content,
+            'filename': filename,
+            'export_time': export_time,
+            'vacuumed': vacuum
+        }
+
+    except Exception as e:
+        logger.error(f"Error in create_db_snapshot: {e}")
+        return None
+
+# Функция для создания резервной копии с ротацией
+def create_rotating_backup():
+    """Резервная копия базы в BACKUP_DIR, хранятся только BACKUP_KEEP последних копий"""
+    try:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        backup_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_path = os.path.join(BACKUP_DIR, f"studio_schedule_{backup_time}.db")
+        partial_path = backup_path + '.partial'
+
+        # Пишем во временный файл и переименовываем, чтобы в каталоге не оставались недописанные копии
+        backup_database(partial_path)
+        os.replace(partial_path, backup_path)
+
+        # Ротация: имена содержат время, поэтому сортировка по имени - сортировка по возрасту
+        backups = sorted(
+            name for name in os.listdir(BACKUP_DIR)
+            if name.startswith('studio_schedule_') and name.endswith('.db')
+        )
+        for old_backup in backups[:-BACKUP_KEEP]:
+            os.remove(os.path.join(BACKUP_DIR, old_backup))
+            print(f"🗑️ Удалена старая резервная копия {old_backup}")
+
+        print(f"💾 Резервная копия создана: {backup_path}")
+        return backup_path
+
+    except Exception as e:
+        logger.error(f"Error in create_rotating_backup: {e}")
+        return None
+
+# Плановое резервное копирование базы данных
+async def run_scheduled_backup(context: CallbackContext):
+    # Копирование идет в отдельном потоке шагами по BACKUP_PAGES_PER_STEP страниц,
+    # поэтому бот продолжает обрабатывать сообщения и записывать бронирования
+    await asyncio.to_thread(create_rotating_backup)
+
+# Плановый расчет отчетов аналитики за стандартные периоды (ночью и при запуске бота)
+async def precompute_analytics_reports(context: CallbackContext):
+    for period_days in STANDARD_ANALYTICS_PERIODS:
+        # Время фиксируется до расчета: запись, сделанная во время расчета, сделает отчет устаревшим
+        computed_at = datetime.now()
+        data_version = _bookings_data_version
+        analytics = await run_analytics_task(
+            build_analytics_report, period_days, data_version, list(_booking_changes)
+        )
+        
+        if not analytics:
+            logger.error(f"Error precomputing analytics for {period_days} days")
+            continue
+        
+        await asyncio.to_thread(save_analytics_report, period_days, computed_at, analytics)
+        store_cached_analytics(period_days, data_version, analytics)
+    
+    print(f"✅ Отчеты аналитики за {', '.join(map(str, STANDARD_ANALYTICS_PERIODS))} дней рассчитаны заранее")
+
+# Как часто (в секундах) изменения состояния диалогов и user_data записываются в базу
+PERSISTENCE_UPDATE_INTERVAL = 30
+
+# Хранение состояния диалогов и user_data в SQLite
+class SQLitePersistence(BasePersistence):
+    """Записывает только изменившиеся данные, все накопленные изменения - одной транзакцией.
+    user_data пользователя читается из базы при первом его обращении после запуска"""
+    
+    def __init__(self, db_path=DB_PATH, update_interval=PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db_path = db_path
+        # Последнее записанное (или прочитанное) содержимое - для сравнения при обновлении
+        self._saved_user_data = {}
+        self._loaded_users = set()
+        self._conversations = {}
+        # Изменения, ожидающие записи (None - удалить запись)
+        self._pending_user_data = {}
+        self._pending_conversations = {}
+        self._write_task = None
+    
+    def _connect(self):
+        return sqlite3.connect(self.db_path, check_same_thread=False)
+    
+    # Запись накопленных изменений одной транзакцией
+    def _write_pending(self):
+        if not (self._pending_user_data or self._pending_conversations):
+            return
+        
+        user_data, self._pending_user_data = self._pending_user_data, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany('DELETE FROM persisted_user_data WHERE user_id = ?',
+                               [(user_id,) for user_id, data in user_data.items() if data is None])
+            cursor.executemany('''
+                INSERT INTO persisted_user_data (user_id, data) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET data = excluded.data
+            ''', [(user_id, data) for user_id, data in user_data.items() if data is not None])
+            
+            cursor.executemany('DELETE FROM conversation_states WHERE name = ? AND conversation_key = ?',
+                               [key for key, state in conversations.items() if state is None])
+            cursor.executemany('''
+                INSERT INTO conversation_states (name, conversation_key, state) VALUES (?, ?, ?)
+                ON CONFLICT (name, conversation_key) DO UPDATE SET state = excluded.state
+            ''', [key + (state,) for key, state in conversations.items() if state is not None])
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error in SQLitePersistence._write_pending: {e}")
+            # Не записанные изменения вернутся в очередь, если их не перекрыли более новые
+            self._pending_user_data = {**user_data, **self._pending_user_data}
+            self._pending_conversations = {**conversations, **self._pending_conversations}
+        finally:
+            conn.close()
+    
+    # Приложение сообщает обо всех изменениях за интервал подряд - запись одна на всю пачку
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.get_running_loop().create_task(self._write_soon())
+    
+    async def _write_soon(self):
+        await asyncio.sleep(0)
+        self._write_pending()
+    
+    async def get_user_data(self):
+        # Данные пользователей читаются по одному при первом обращении (refresh_user_data)
+        return {}
+    
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded_users:
+            return
+        
+        self._loaded_users.add(user_id)
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT data FROM persisted_user_data WHERE user_id = ?', (user_id,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if row:
+            user_data.update(json.loads(row[0]))
+            self._saved_user_data[user_id] = row[0]
+    
+    async def update_user_data(self, user_id, data):
+        payload = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str) if data else None
+        if payload == self._saved_user_data.get(user_id):
+            return
+        
+        self._saved_user_data[user_id] = payload
+        self._pending_user_data[user_id] = payload
+        self._schedule_write()
+    
+    async def drop_user_data(self, user_id):
+        self._saved_user_data.pop(user_id, None)
+        self._pending_user_data[user_id] = None
+        self._schedule_write()
+    
+    async def get_conversations(self, name):
+        if name not in self._conversations:
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute('SELECT conversation_key, state FROM conversation_states WHERE name = ?', (name,))
+            self._conversations[name] = {
+                tuple(json.loads(key)): json.loads(state) for key, state in cursor.fetchall()
+            }
+            conn.close()
+        return dict(self._conversations[name])
+    
+    async def update_conversation(self, name, key, new_state):
+        conversations = self._conversations.setdefault(name, {})
+        if conversations.get(key) == new_state:
+            return
+        
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        self._pending_conversations[(name, json.dumps(list(key)))] = None if new_state is None else json.dumps(new_state)
+        self._schedule_write()
+    
+    async def flush(self):
+        self._write_pending()
+    
+    # Данные чатов, бота и callback_data не хранятся
+    async def get_chat_data(self):
+        return {}
+    
+    async def get_bot_data(self):
+        return {}
+    
+    async def get_callback_data(self):
+        return None
+    
+    async def update_chat_data(self, chat_id, data):
+        pass
+    
+    async def update_bot_data(self, data):
+        pass
+    
+    async def update_callback_data(self, data):
+        pass
+    
+    async def drop_chat_data(self, chat_id):
+        pass
+    
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+    
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+# Даты на 7 дней вперед (НАЧИНАЯ С СЕГОДНЯШНЕГО ДНЯ)
+def generate_studio_dates():
+    today = datetime.now().date()
+    return [StudioDate.from_date(today + timedelta(days=i)) for i in range(0, 7)]
+
+# Подписи кнопок дат на 7 дней вперед (для сегодняшнего дня - с пометкой "Сегодня")
+def generate_dates():
+    return [studio_date.label for studio_date in generate_studio_dates()]
+
+# Часы работы по дням недели (0 - понедельник): (открытие, закрытие) "ЧЧ:ММ", None - выходной
+STUDIO_WEEKLY_HOURS = {weekday: ('09:00', '22:00') for weekday in range(7)}
+
+# Праздничные дни, когда студия закрыта: "ДД.ММ.ГГГГ"
+STUDIO_HOLIDAYS = set()
+
+# Закрытые периоды (ремонт, мероприятия): ("ДД.ММ.ГГГГ ЧЧ:ММ", "ДД.ММ.ГГГГ ЧЧ:ММ")
+STUDIO_BLACKOUTS = []
+
+# Шаг сетки времени начала сессий в минутах: 60, 30 или 15
+SLOT_MINUTES = 60
+
+# Продолжительности сессий: подпись кнопки -> часы
+SESSION_DURATIONS = {
+    '1 час': 1,
+    '2 часа': 2,
+    '3 часа': 3,
+    '4 часа': 4
+}
+
+# Клавиатура продолжительностей: по две кнопки в ряд и "Назад"
+def duration_keyboard_rows(durations):
+    durations = list(durations)
+    return [durations[i:i+2] for i in range(0, len(durations), 2)] + [['🔙 Назад']]
+
+DURATION_KEYBOARD = ReplyKeyboardMarkup(duration_keyboard_rows(SESSION_DURATIONS), resize_keyboard=True)
+
+# Разобранный календарь: окна работы по дням недели (в минутах), праздники, закрытые периоды
+_weekly_windows = {}
+_holidays = set()
+_blackouts = []
+
+# Сетки слотов по типу дня: (открытие, закрытие) -> (подписи слотов, подпись -> номер слота)
+_slot_grids = {}
+
+# Состояния дней месяца для календаря: (год, месяц) -> (версия данных о бронях, {дата: состояние})
+_month_states_cache = {}
+
+# Разбор и проверка настроек календаря (при запуске)
+def load_studio_calendar():
+    if 60 % SLOT_MINUTES:
+        raise ValueError(f"Шаг сетки {SLOT_MINUTES} мин должен делить час (60, 30, 15...)")
+    
+    windows = {}
+    for weekday in range(7):
+        hours = STUDIO_WEEKLY_HOURS.get(weekday)
+        if hours is None:
+            windows[weekday] = None
+            continue
+        
+        open_minutes, close_minutes = (clock_minutes(value) for value in hours)
+        if open_minutes % SLOT_MINUTES or close_minutes % SLOT_MINUTES or open_minutes >= close_minutes:
+            raise ValueError(f"Часы работы {hours} не совпадают с сеткой {SLOT_MINUTES} мин")
+        windows[weekday] = (open_minutes, close_minutes)
+    
+    blackouts = []
+    for start_text, end_text in STUDIO_BLACKOUTS:
+        start, end = (datetime.strptime(value, "%d.%m.%Y %H:%M") for value in (start_text, end_text))
+        if start >= end:
+            raise ValueError(f"Закрытый период {start_text} - {end_text}: начало позже конца")
+        blackouts.append((start, end))
+    
+    _weekly_windows.clear()
+    _weekly_windows.update(windows)
+    _holidays.clear()
+    _holidays.update(StudioDate.parse(day).date for day in STUDIO_HOLIDAYS)
+    _blackouts[:] = blackouts
+    _slot_grids.clear()
+    _month_states_cache.clear()
+    print(f"✅ Календарь студии загружен: шаг {SLOT_MINUTES} мин, праздников {len(_holidays)}, закрытых периодов {len(_blackouts)}")
+
+# Часы работы в дату: (открытие, закрытие) в минутах от полуночи или None, если студия закрыта
+def get_working_window(selected_date):
+    if not _weekly_windows:
+        load_studio_calendar()
+    
+    studio_date = StudioDate.parse(selected_date)
+    if studio_date.date in _holidays:
+        return None
+    return _weekly_windows[studio_date.date.weekday()]
+
+# Сетка слотов для окна работы - одна на все дни с такими часами
+def get_slot_grid(window):
+    grid = _slot_grids.get(window)
+    if grid is None:
+        labels = tuple(f"{minutes // 60:02d}:{minutes % 60:02d}" for minutes in range(window[0], window[1], SLOT_MINUTES))
+        grid = _slot_grids[window] = (labels, {label: index for index, label in enumerate(labels)})
+    return grid
+
+# Битовая маска слотов сетки, которые пересекает интервал [start, end) в минутах
+def interval_mask(window, start_minutes, end_minutes):
+    first = max((start_minutes - window[0]) // SLOT_MINUTES, 0)
+    last = min(-((window[0] - end_minutes) // SLOT_MINUTES), (window[1] - window[0]) // SLOT_MINUTES)
+    if first >= last:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+# Занятость даты по подтвержденным броням (время, часы): (окно работы, сетка, маска занятых слотов) или None, если студия закрыта
+def build_day_occupancy(studio_date, booked_slots):
+    window = get_working_window(studio_date)
+    if window is None:
+        return None
+    
+    busy_mask = 0
+    
+    # Закрытые периоды, пересекающие эту дату
+    day_start = datetime.combine(studio_date.date, dt_time())
+    for start, end in _blackouts:
+        if start < day_start + timedelta(days=1) and end > day_start:
+            busy_mask |= interval_mask(window, int((start - day_start).total_seconds() // 60), int((end - day_start).total_seconds() // 60))
+    
+    for time_slot, duration in booked_slots:
+        slot = SessionSlot(studio_date, time_slot, duration)
+        busy_mask |= interval_mask(window, slot.start_minutes, slot.end_minutes)
+    
+    return window, get_slot_grid(window), busy_mask
+
+# Занятость даты: (окно работы, сетка, маска занятых слотов) или None, если студия закрыта
+def get_day_occupancy(selected_date):
+    studio_date = StudioDate.parse(selected_date)
+    if get_working_window(studio_date) is None:
+        return None
+    
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT time, duration FROM bookings 
+        WHERE status = 'confirmed' AND session_date = ?
+    ''', (studio_date.iso,))
+    booked_slots = cursor.fetchall()
+    conn.close()
+    
+    return build_day_occupancy(studio_date, booked_slots)
+
+# Занятость дней подряд начиная с start_date: (дата, занятость) по порядку дней
+def get_range_occupancy(start_date, days):
+    """Брони всего диапазона читаются одним запросом, а маски строятся по мере перебора,
+    поэтому поиск, остановившийся на первых днях, не считает остальные"""
+    start = StudioDate.parse(start_date).date
+    end = start + timedelta(days=days - 1)
+    
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT session_date, time, duration FROM bookings 
+        WHERE status = 'confirmed' AND session_date BETWEEN ? AND ?
+    ''', (start.isoformat(), end.isoformat()))
+    booked_by_date = {}
+    for session_date, time_slot, duration in cursor:
+        booked_by_date.setdefault(session_date, []).append((time_slot, duration))
+    conn.close()
+    
+    for offset in range(days):
+        studio_date = StudioDate.from_date(start + timedelta(days=offset))
+        yield studio_date, build_day_occupancy(studio_date, booked_by_date.get(studio_date.iso, ()))
+
+# Рабочие и занятые бронями слоты даты: (окно работы, маска рабочих слотов, маска занятых) или None, если студия закрыта.
+# Закрытые периоды не входят ни в рабочее, ни в занятое время
+def build_day_capacity(studio_date, booked_slots):
+    closed = build_day_occupancy(studio_date, ())
+    if closed is None:
+        return None
+    
+    window, (labels, _), closed_mask = closed
+    busy_mask = build_day_occupancy(studio_date, booked_slots)[2]
+    open_mask = ((1 << len(labels)) - 1) & ~closed_mask
+    return window, open_mask, busy_mask & open_mask
+
+# Перевод числа слотов сетки в часы (целое, если получается ровно)
+def slots_to_hours(count):
+    hours = count * SLOT_MINUTES / 60
+    return int(hours) if hours.is_integer() else round(hours, 2)
+
+# Часы, в которые студия открыта хотя бы в один день недели (колонки отчетов о загрузке)
+def get_working_hour_columns():
+    if not _weekly_windows:
+        load_studio_calendar()
+    
+    windows = [window for window in _weekly_windows.values() if window]
+    if not windows:
+        return []
+    return list(range(min(window[0] for window in windows) // 60, -(-max(window[1] for window in windows) // 60)))
+
+# Недельный график работы одной строкой: дни подряд с одинаковыми часами объединяются ("Пн-Пт 09:00 - 22:00, Вс выходной")
+def format_weekly_hours():
+    if not _weekly_windows:
+        load_studio_calendar()
+    
+    short_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+    groups = []
+    for weekday in range(7):
+        window = _weekly_windows[weekday]
+        if groups and groups[-1][2] == window:
+            groups[-1][1] = weekday
+        else:
+            groups.append([weekday, weekday, window])
+    
+    parts = []
+    for first, last, window in groups:
+        days = short_names[first] if first == last else f"{short_names[first]}-{short_names[last]}"
+        hours = " - ".join(f"{minutes // 60:02d}:{minutes % 60:02d}" for minutes in window) if window else "выходной"
+        parts.append(f"{days} {hours}")
+    return ", ".join(parts)
+
+# Номер первого слота, с которого можно начать сессию (для сегодняшнего дня - не раньше текущего времени)
+def first_bookable_slot(studio_date, window):
+    if not studio_date.is_today:
+        return 0
+    now = datetime.now()
+    return max(-((window[0] - now.hour * 60 - now.minute) // SLOT_MINUTES), 0)
+
+# Получение списка свободного времени на конкретную дату
+def get_available_times(selected_date):
+    try:
+        studio_date = StudioDate.parse(selected_date)
+        occupancy = get_day_occupancy(studio_date)
+        if occupancy is None:
+            print(f"🚫 {studio_date.clean}: студия не работает")
+            return []
+        
+        window, (labels, _), busy_mask = occupancy
+        first = first_bookable_slot(studio_date, window)
+        available_times = [label for index, label in enumerate(labels) if index >= first and not busy_mask >> index & 1]
+        
+        print(f"📅 Свободные слоты на {studio_date.clean}: {available_times}")
+        return available_times
+    except Exception as e:
+        logger.error(f"Error in get_available_times: {e}")
+        return []
+
+# Допустимые времена начала сессии с подходящими продолжительностями - за один проход по занятости дня
+def day_start_options(studio_date, occupancy):
+    """Возвращает {время начала: (подписи продолжительностей)} в порядке времени.
+    Длина свободного участка от каждого слота считается с конца дня, поэтому
+    проверка любой продолжительности сводится к одному сравнению"""
+    if occupancy is None:
+        return {}
+    
+    window, (labels, _), busy_mask = occupancy
+    first = first_bookable_slot(studio_date, window)
+    options = []
+    free_run = 0
+    for index in range(len(labels) - 1, first - 1, -1):
+        free_run = 0 if busy_mask >> index & 1 else free_run + 1
+        # Свободные минуты от начала слота: до ближайшего занятого слота, но не позже закрытия
+        free_minutes = min(free_run * SLOT_MINUTES, window[1] - window[0] - index * SLOT_MINUTES)
+        durations = tuple(label for label, hours in SESSION_DURATIONS.items() if hours * 60 <= free_minutes)
+        if durations:
+            options.append((labels[index], durations))
+    
+    return dict(reversed(options))
+
+# Допустимые времена начала сессии на дату с подходящими продолжительностями
+def get_start_options(selected_date):
+    try:
+        studio_date = StudioDate.parse(selected_date)
+        return day_start_options(studio_date, get_day_occupancy(studio_date))
+    except Exception as e:
+        logger.error(f"Error in get_start_options: {e}")
+        return {}
+
+# Горизонт записи в днях от сегодня: ручной ввод даты, календарь и поиск свободного времени
+BOOKING_HORIZON_DAYS = 90
+
+# Состояние дня для календаря: 'free', 'partial', 'full' или 'closed'
+def day_occupancy_state(studio_date, occupancy):
+    if occupancy is None:
+        return 'closed'
+    if not day_start_options(studio_date, occupancy):
+        return 'full'
+    return 'free' if occupancy[2] == 0 else 'partial'
+
+# Состояния всех дней месяца
+def get_month_day_states(year, month):
+    """Занятость месяца читается одним запросом и хранится до следующего изменения броней.
+    Сегодняшний день зависит от текущего времени, поэтому его состояние считается при показе"""
+    cached = _month_states_cache.get((year, month))
+    if cached and cached[0] == _bookings_data_version:
+        return cached[1]
+    
+    data_version = _bookings_data_version
+    first_day = datetime(year, month, 1).date()
+    next_month = (first_day + timedelta(days=31)).replace(day=1)
+    
+    states = {
+        studio_date.date: day_occupancy_state(studio_date, occupancy)
+        for studio_date, occupancy in get_range_occupancy(first_day.strftime("%d.%m.%Y"), (next_month - first_day).days)
+    }
+    _month_states_cache[(year, month)] = (data_version, states)
+    print(f"🗓️ Календарь {month:02d}.{year} посчитан (версия данных {data_version})")
+    return states
+
+# Сколько найденных вариантов показывать за раз (по одному на день)
+FREE_SLOT_SEARCH_LIMIT = 6
+
+# Предпочтительное время для поиска: подпись кнопки -> (не раньше, не позже) или None
+PREFERRED_HOURS = {
+    '🕘 Любое время': None,
+    '🌅 Утро (до 13:00)': ('00:00', '13:00'),
+    '☀️ День (12:00 - 18:00)': ('12:00', '18:00'),
+    '🌆 Вечер (с 18:00)': ('18:00', '24:00')
+}
+PREFERRED_HOURS_KEYBOARD = ReplyKeyboardMarkup(
+    [list(PREFERRED_HOURS)[i:i+2] for i in range(0, len(PREFERRED_HOURS), 2)] + [['🔙 Назад']],
+    resize_keyboard=True
+)
+
+# Начало поиска: с сегодняшнего дня или с введенной даты
+FREE_SLOT_FROM_TODAY = '📅 С сегодняшнего дня'
+FREE_SLOT_FROM_KEYBOARD = ReplyKeyboardMarkup([[FREE_SLOT_FROM_TODAY], ['🔙 Назад']], resize_keyboard=True)
+
+# Поиск ближайших свободных сессий заданной продолжительности
+def find_free_slots(duration_text, after_date=None, preferred=None, limit=FREE_SLOT_SEARCH_LIMIT):
+    """Первое подходящее время в каждом дне начиная с after_date (по умолчанию - сегодня) и до конца горизонта.
+    preferred = ('18:00', '24:00') - сессия должна начаться не раньше и закончиться не позже.
+    Возвращает список SessionSlot, занятость всех дней читается одним запросом"""
+    try:
+        today = datetime.now().date()
+        start = max(StudioDate.parse(after_date).date, today) if after_date else today
+        days = (today + timedelta(days=BOOKING_HORIZON_DAYS) - start).days + 1
+        if days <= 0:
+            return []
+        
+        duration = SESSION_DURATIONS[duration_text]
+        earliest, latest = (clock_minutes(value) for value in preferred or ('00:00', '24:00'))
+        
+        found = []
+        for studio_date, occupancy in get_range_occupancy(start.strftime("%d.%m.%Y"), days):
+            for start_time, durations in day_start_options(studio_date, occupancy).items():
+                slot = SessionSlot(studio_date, start_time, duration)
+                if duration_text in durations and slot.start_minutes >= earliest and slot.end_minutes <= latest:
+                    found.append(slot)
+                    break
+            
+            if len(found) >= limit:
+                break
+        
+        print(f"🔍 Поиск {duration_text} с {start.strftime('%d.%m.%Y')}: найдено {len(found)}")
+        return found
+    except Exception as e:
+        logger.error(f"Error in find_free_slots: {e}")
+        return []
+
+# Клавиатура выбора времени начала (по два в ряд)
+def build_time_keyboard(times):
+    times = list(times)
+    return ReplyKeyboardMarkup([times[i:i+2] for i in range(0, len(times), 2)] + [['🔙 Назад']], resize_keyboard=True)
+
+# Клавиатура выбора продолжительности: только те, что помещаются с выбранного времени
+def build_duration_keyboard(durations):
+    if len(durations) == len(SESSION_DURATIONS):
+        return DURATION_KEYBOARD
+    return ReplyKeyboardMarkup(duration_keyboard_rows(durations), resize_keyboard=True)
+
+# Помещается ли сессия в занятость своего дня
+def slot_fits(slot, occupancy):
+    if occupancy is None:
+        return False
+    
+    window, (labels, slot_index), busy_mask = occupancy
+    index = slot_index.get(slot.time)
+    
+    # Сессия должна начинаться на сетке, не раньше текущего времени и заканчиваться до закрытия
+    if index is None or index < first_bookable_slot(slot.day, window) or slot.end_minutes > window[1]:
+        return False
+    
+    return not busy_mask & interval_mask(window, slot.start_minutes, slot.end_minutes)
+
+# Проверка пачки сессий на пересечения одним проходом по занятости
+def check_slots_batch(slots):
+    """slots - SessionSlot в порядке дат. Занятость всего диапазона читается одним запросом, а каждая
+    принятая сессия сразу занимает свои слоты, поэтому пересечения внутри пачки тоже находятся.
+    Возвращает признаки "сессия помещается" в порядке slots"""
+    if not slots:
+        return []
     
-    for i in range(0, 7):  # Начинаем с 0 (сегодня)
-        date = today + timedelta(days=i)
-        date_str = date.strftime("%d.%m.%Y")
-        day_name = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"][date.weekday()]
-        
-        # Для сегодняшнего дня добавляем пометку
-        if i == 0:
-            dates.append(f"{date_str} ({day_name}) - Сегодня")
-        else:
-            dates.append(f"{date_str} ({day_name})")
+    days = (slots[-1].day.date - slots[0].day.date).days + 1
+    occupancy_by_date = dict(get_range_occupancy(slots[0].day, days))
     
-    return dates
+    fits = []
+    for slot in slots:
+        occupancy = occupancy_by_date[slot.day]
+        fit = slot_fits(slot, occupancy)
+        if fit:
+            window, grid, busy_mask = occupancy
+            occupancy_by_date[slot.day] = (window, grid, busy_mask | interval_mask(window, slot.start_minutes, slot.end_minutes))
+        fits.append(fit)
+    
+    return fits
 
-# Получение занятого времени на конкретную дату
-def get_booked_times(selected_date):
+# Проверка доступности сессии с учетом продолжительности
+def is_slot_available(slot):
     try:
-        # Убираем пометку " - Сегодня" из даты для поиска в базе
-        clean_date = selected_date.replace(" - Сегодня", "")
-        # Убираем день недели в скобках, оставляем только дату
-        clean_date = clean_date.split(' (')[0]
-        
-        print(f"🔍 Поиск бронирований для даты: '{clean_date}'")
-        
-        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT time, duration FROM bookings 
-            WHERE day = ? AND status = 'confirmed'
-        ''', (clean_date,))
-        
-        booked_slots = cursor.fetchall()
-        conn.close()
+        occupancy = get_day_occupancy(slot.day)
+        if occupancy is None:
+            print(f"❌ {slot.day.clean}: студия не работает")
+            return False
         
-        # Преобразуем в список занятых часов
-        booked_hours = []
-        for time_slot, duration in booked_slots:
-            start_hour = int(time_slot.split(':')[0])
-            for i in range(duration):
-                booked_hours.append(start_hour + i)
+        if not slot_fits(slot, occupancy):
+            print(f"❌ Время {slot.time} продолжительностью {slot.duration} часов недоступно на {slot.day.clean}")
+            return False
         
-        print(f"📅 Занятые часы на {clean_date}: {booked_hours}")
-        return booked_hours
+        print(f"✅ Время {slot.time} продолжительностью {slot.duration} часов доступно на {slot.day.clean}")
+        return True
     except Exception as e:
-        logger.error(f"Error in get_booked_times: {e}")
-        return []
+        logger.error(f"Error in is_slot_available: {e}")
+        return False
 
-# Получение списка свободного времени на конкретную дату
-def get_available_times(selected_date):
-    try:
-        # Убираем пометку " - Сегодня" из даты для поиска в базе
-        clean_date = selected_date.replace(" - Сегодня", "")
-        # Убираем день недели в скобках, оставляем только дату
-        clean_date = clean_date.split(' (')[0]
-        
-        booked_hours = get_booked_times(clean_date)
-        available_times = []
-        
-        # Определяем минимальное доступное время
-        current_hour = datetime.now().hour
-        current_minute = datetime.now().minute
-        
-        # Для сегодняшнего дня начинаем со следующего часа
-        if " - Сегодня" in selected_date:
-            start_hour = current_hour + 1 if current_minute > 0 else current_hour
-            start_hour = max(start_hour, 9)  # Не раньше 9:00
+# Часы работы в дату для отображения
+def format_working_hours(selected_date):
+    window = get_working_window(selected_date)
+    if window is None:
+        return "студия не работает"
+    return " - ".join(f"{minutes // 60:02d}:{minutes % 60:02d}" for minutes in window)
+
+# Подпись времени окончания слота (для последнего слота - время закрытия)
+def slot_end_label(window, index):
+    minutes = window[0] + index * SLOT_MINUTES
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+# Разбиение слотов начиная с first на подряд идущие свободные и занятые интервалы: (начало, конец, занят).
+# При часовой сетке каждый слот - отдельный интервал
+def slot_runs(labels, busy_mask, first=0):
+    runs = []
+    for index in range(first, len(labels)):
+        busy = bool(busy_mask >> index & 1)
+        if runs and SLOT_MINUTES < 60 and runs[-1][2] == busy:
+            runs[-1][1] = index + 1
         else:
-            start_hour = 9  # Для других дней начинаем с 9:00
-        
-        # Все возможные временные слоты с start_hour до 21:00
-        for hour in range(start_hour, 22):
-            time_slot = f"{hour:02d}:00"
-            if hour not in booked_hours:
-                available_times.append(time_slot)
-        
-        print(f"📅 Свободные слоты на {clean_date}: {available_times}")
-        return available_times
-    except Exception as e:
-        logger.error(f"Error in get_available_times: {e}")
-        return []
+            runs.append([index, index + 1, busy])
+    return runs
 
 # Проверка доступности времени на выбранную дату с учетом продолжительности
 def is_time_available(selected_date, selected_time, duration):
     try:
-        # Убираем пометку " - Сегодня" из даты для поиска в базе
-        clean_date = selected_date.replace(" - Сегодня", "")
-        # Убираем день недели в скобках, оставляем только дату
-        clean_date = clean_date.split(' (')[0]
-        
-        booked_hours = get_booked_times(clean_date)
-        start_hour = int(selected_time.split(':')[0])
-        
-        # Проверяем все часы в выбранном диапазоне
-        for i in range(duration):
-            check_hour = start_hour + i
-            if check_hour in booked_hours:
-                print(f"❌ Час {check_hour} занят на дату {clean_date}")
-                return False
-        
-        print(f"✅ Время {selected_time} продолжительностью {duration} часов доступно на {clean_date}")
-        return True
-    except Exception as e:
+        return is_slot_available(SessionSlot(selected_date, selected_time, duration))
+    except ValueError as e:
         logger.error(f"Error in is_time_available: {e}")
         return False
 
@@ -638,17 +2852,10 @@ async def send_reminder_to_admin(context: CallbackContext):
         job.schedule_removal()
         return
     
-    reminder_text = f"""🔔 <b>НАПОМИНАНИЕ О НЕПОДТВЕРЖДЕННОЙ ЗАЯВКЕ!</b>
-
-Заявка ожидает подтверждения уже более 30 минут:
-
-👤 <b>Клиент</b>: {user_name}
-📅 <b>Дата</b>: {selected_date}
-🕐 <b>Время</b>: {selected_time}
-⏱ <b>Продолжительность</b>: {duration} час(а)
-🆔 <b>ID заявки</b>: {booking_id}
-
-❗ <i>Пожалуйста, подтвердите или отклоните заявку как можно скорее!</i>"""
+    reminder_text = render_template(
+        'admin_reminder', user_name=user_name, selected_date=selected_date,
+        selected_time=selected_time, duration=duration, booking_id=booking_id
+    )
 
     keyboard = [
         [
@@ -678,23 +2885,7 @@ async def send_24h_reminder_to_client(context: CallbackContext):
         selected_time = job.data['selected_time']
         duration = job.data['duration']
         
-        reminder_text = f"""🎵 <b>НАПОМИНАНИЕ О ЗАПИСИ</b>
-
-⏰ До вашей сессии в студии осталось <b>24 часа</b>!
-
-📅 <b>Дата</b>: {selected_date}
-🕐 <b>Время</b>: {selected_time}
-⏱ <b>Продолжительность</b>: {duration} час(а)
-
-🏢 <b>MS Studio</b>
-📍 <b>Адрес</b>: г. Ставрополь, ул. Спартака 8, 2-ой этаж
-
-💡 <i>Пожалуйста, планируйте свое время заранее.</i>
-🚗 <i>Рекомендуем приехать за 10-15 минут до начала сессии.</i>
-
-📞 <b>По всем вопросам:</b> +7 (918) 880-52-92
-
-🎶 <i>Ждем вас в студии!</i>"""
+        reminder_text = render_template('reminder_24h', selected_date=selected_date, selected_time=selected_time, duration=duration)
         
         await context.bot.send_message(
             chat_id=user_id,
@@ -714,23 +2905,7 @@ async def send_2h_reminder_to_client(context: CallbackContext):
         selected_time = job.data['selected_time']
         duration = job.data['duration']
         
-        reminder_text = f"""🎵 <b>НАПОМИНАНИЕ О ЗАПИСИ</b>
-
-⏰ До вашей сессии в студии осталось <b>2 часа</b>!
-
-📅 <b>Дата</b>: {selected_date}
-🕐 <b>Время</b>: {selected_time}
-⏱ <b>Продолжительность</b>: {duration} час(а)
-
-🏢 <b>MS Studio</b>
-📍 <b>Адрес</b>: г. Ставрополь, ул. Спартака 8, 2-ой этаж
-
-🚗 <i>Скоро начинаем! Рекомендуем приехать за 10-15 минут до начала.</i>
-🎤 <i>Не забудьте взять все необходимое для записи!</i>
-
-📞 <b>Если опаздываете:</b> +7 (918) 880-52-92
-
-🎶 <i>До скорой встречи в студии!</i>"""
+        reminder_text = render_template('reminder_2h', selected_date=selected_date, selected_time=selected_time, duration=duration)
         
         await context.bot.send_message(
             chat_id=user_id,
@@ -744,22 +2919,8 @@ async def send_2h_reminder_to_client(context: CallbackContext):
 # Расчет времени для напоминаний
 def calculate_reminder_times(selected_date, selected_time):
     try:
-        # Убираем пометку " - Сегодня" и день недели из даты
-        clean_date = selected_date.replace(" - Сегодня", "")
-        # Убираем день недели в скобках, оставляем только дату
-        clean_date = clean_date.split(' (')[0]
-        
-        print(f"🔧 Очистка даты: '{selected_date}' -> '{clean_date}'")
-        
-        # Парсим дату и время
-        date_obj = datetime.strptime(clean_date, "%d.%m.%Y")
-        time_obj = datetime.strptime(selected_time, "%H:%M")
-        
-        # Создаем datetime объекта начала сессии
-        session_datetime = datetime(
-            date_obj.year, date_obj.month, date_obj.day,
-            time_obj.hour, time_obj.minute
-        )
+        # Начало сессии
+        session_datetime = SessionSlot(selected_date, selected_time).start
         
         current_datetime = datetime.now()
         
@@ -790,19 +2951,65 @@ def calculate_reminder_times(selected_date, selected_time):
         print(f"❌ Ошибка парсинга даты: '{selected_date}'")
         return None, None
 
+# Настройка напоминаний клиенту за 24 и за 2 часа до сессии
+def schedule_client_reminders(job_queue, booking_id, user_id, day, time, duration):
+    delay_24h, delay_2h = calculate_reminder_times(day, time)
+    data = {
+        'user_id': user_id,
+        'selected_date': day,
+        'selected_time': time,
+        'duration': duration
+    }
+    
+    # Имя задачи по id брони - чтобы снять напоминания при отмене
+    for callback, delay in ((send_24h_reminder_to_client, delay_24h), (send_2h_reminder_to_client, delay_2h)):
+        if delay and delay > 0:
+            job_queue.run_once(callback, when=delay, data=data, name=f"client_reminder_{booking_id}")
+    
+    print(f"✅ Напоминания настроены для клиента {user_id} по брони {booking_id} (через {delay_24h} и {delay_2h} сек)")
+
+# Снятие запланированных задач по брони (напоминания администратору и клиенту)
+def remove_booking_jobs(job_queue, booking_id):
+    for job_name in (f"admin_reminder_{booking_id}", f"client_reminder_{booking_id}"):
+        for job in job_queue.get_jobs_by_name(job_name):
+            job.schedule_removal()
+
+# Ограничения для массовой отправки уведомлений (лимит Telegram - около 30 сообщений в секунду)
+NOTIFY_CONCURRENCY = 8
+NOTIFY_MESSAGES_PER_SECOND = 25
+
+# Параллельная отправка сообщений с ограничением частоты
+async def send_notifications(bot, messages):
+    """messages - список (chat_id, text). Возвращает список chat_id, которым отправить не удалось"""
+    semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    interval = 1 / NOTIFY_MESSAGES_PER_SECOND
+    next_send_at = loop.time()
+    
+    async def send(chat_id, text):
+        nonlocal next_send_at
+        async with semaphore:
+            # Каждой отправке - свой момент времени, не чаще лимита
+            send_at = max(next_send_at, loop.time())
+            next_send_at = send_at + interval
+            await asyncio.sleep(send_at - loop.time())
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML')
+                return None
+            except Exception as e:
+                logger.error(f"Не удалось отправить уведомление {chat_id}: {e}")
+                return chat_id
+    
+    results = await asyncio.gather(*(send(chat_id, text) for chat_id, text in messages))
+    return [chat_id for chat_id in results if chat_id is not None]
+
 # Отправка уведомления администратору о новой заявке
 async def send_admin_notification(context: CallbackContext, booking_id: int, user_name: str, selected_date: str, selected_time: str, duration: int, user_id: int, username: str):
-    admin_message = f"""🎵 <b>НОВАЯ ЗАПИСЬ!</b>
-
-👤 <b>Клиент</b>: {user_name}
-📱 <b>Telegram</b>: @{username or 'без username'}
-📅 <b>Дата</b>: {selected_date}
-🕐 <b>Время</b>: {selected_time}
-⏱ <b>Продолжительность</b>: {duration} час(а)
-🆔 <b>ID клиента</b>: {user_id}
-📋 <b>ID заявки</b>: {booking_id}
-
-⏰ <i>Заявка ожидает подтверждения!</i>"""
+    admin_message = render_template(
+        'admin_new_booking', user_name=user_name, username=username or 'без username',
+        selected_date=selected_date, selected_time=selected_time, duration=duration,
+        user_id=user_id, booking_id=booking_id
+    )
 
     keyboard = [
         [
@@ -811,200 +3018,94 @@ async def send_admin_notification(context: CallbackContext, booking_id: int, use
         ]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    try:
-        await context.bot.send_message(
-            chat_id=ADMIN_ID, 
-            text=admin_message,
-            parse_mode='HTML',
-            reply_markup=reply_markup
-        )
-        print(f"✅ Уведомление отправлено администратору {ADMIN_ID} о бронировании {booking_id}")
-        return True
-    except Exception as e:
-        logger.error(f"Не удалось отправить уведомление админу: {e}")
-        print(f"❌ Ошибка отправки уведомления администратору: {e}")
-        return False
-
-# Команда /start
-async def start(update: Update, context: CallbackContext) -> None:
-    user_id = update.message.from_user.id
-    username = update.message.from_user.username or 'без username'
-    first_name = update.message.from_user.first_name
-    last_name = update.message.from_user.last_name or ''
-    
-    # Обновляем статистику пользователя
-    update_user_stats(user_id, username, first_name, last_name)
-    
-    reply_markup = get_main_keyboard(user_id)
-    
-    await update.message.reply_text(
-        '🎧 Добро пожаловать в бот студии звукозаписи MS Studio!\n\n'
-        'Выберите действие:',
-        reply_markup=reply_markup
-    )
-
-# Показываем расписание
-async def show_schedule(update: Update, context: CallbackContext) -> None:
-    try:
-        user_id = update.message.from_user.id
-        username = update.message.from_user.username or 'без username'
-        first_name = update.message.from_user.first_name
-        last_name = update.message.from_user.last_name or ''
-        
-        # Обновляем статистику пользователя
-        update_user_stats(user_id, username, first_name, last_name)
-        
-        dates = generate_dates()
-        
-        # Создаем красивое расписание с эмодзи и форматированием
-        schedule_text = "🎵 <b>РАСПИСАНИЕ СТУДИИ НА 7 ДНЕЙ</b> 🎵\n\n"
-        schedule_text += "⏰ <i>Часы работы: 9:00 - 21:00</i>\n\n"
-        
-        for date in dates:
-            schedule_text += f"🎯 <b>{date}</b>\n"
-            
-            # Получаем занятые часы для этой даты
-            booked_hours = get_booked_times(date)
-            
-            # Определяем минимальное доступное время для отображения
-            current_hour = datetime.now().hour
-            current_minute = datetime.now().minute
-            
-            # Для сегодняшнего дня начинаем со следующего часа
-            if " - Сегодня" in date:
-                start_hour = current_hour + 1 if current_minute > 0 else current_hour
-                start_hour = max(start_hour, 9)  # Не раньше 9:00
-            else:
-                start_hour = 9  # Для других дней начинаем с 9:00
-            
-            # Показываем все часы с start_hour до 21:00
-            for hour in range(start_hour, 22):
-                time_slot = f"{hour:02d}:00"
-                if hour in booked_hours:
-                    schedule_text += f"   ❌ {time_slot} - <i>Занято</i>\n"
-                else:
-                    schedule_text += f"   ✅ {time_slot} - <b>Свободно</b>\n"
-            
-            schedule_text += "\n" + "─" * 40 + "\n\n"
-        
-        schedule_text += "💡 <b>Для бронирования нажмите '🎵 Забронировать'</b>"
-        
-        await update.message.reply_text(schedule_text, parse_mode='HTML')
-        
-    except Exception as e:
-        logger.error(f"Error in show_schedule: {e}")
-        await update.message.reply_text(
-            "❌ Произошла ошибка при загрузке расписания. Попробуйте позже."
-        )
-
-# Показываем цены
-async def show_prices(update: Update, context: CallbackContext) -> None:
-    user_id = update.message.from_user.id
-    username = update.message.from_user.username or 'без username'
-    first_name = update.message.from_user.first_name
-    last_name = update.message.from_user.last_name or ''
-    
-    # Обновляем статистику пользователя
-    update_user_stats(user_id, username, first_name, last_name)
-    
-    prices_text = """🎹 <b>ПРАЙС-ЛИСТ СТУДИИ ЗВУКОЗАПИСИ</b> 🎹
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🎤 <b>ОСНОВНЫЕ УСЛУГИ ЗАПИСИ</b>
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-🎵 <b>Запись</b>
-💰 <i>1000 ₽/час</i>
-📝 Запись вокала или многодорожечная запись любых музыкальных инструментов (до 16-ти каналов)
-
-🎵 <b>Трек под минус</b>
-💰 <i>5 000 ₽</i>
-📝 Запись вокала под ваш готовый минус
-✅ В услугу входит:
-   • 2 часа записи
-   • Ручная коррекция вокала
-   • Сведение вокала с минусом
-   • Мастеринг трека
-
-🎵 <b>Запись песни</b>
-💰 <i>12 000 ₽</i>
-📝 Полный цикл производства трека от записи до мастеринга
-✅ В услугу входит:
-   • Запись вокала и инструментов (до 7 часов)
-   • Ручная коррекция вокала
-   • Ритмические коррекции инструментов
-   • Эффекты и саундизайн
-   • Сведение и мастеринг
-   • До 3-х пакетов правок
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🎧 <b>ОБРАБОТКА И ПРОДАКШЕН</b>
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-🎵 <b>Сведение и мастеринг</b>
-💰 <i>7 500 ₽</i>
-📝 Полное сведение мультитрека
-✅ В услугу входит:
-   • Ручная коррекция вокала
-   • Ритмические коррекции инструментов
-   • Эффекты и саундизайн
-   • Сведение и мастеринг
-   • До 3-х пакетов правок
-
-🎵 <b>Сведение вместе с артистом</b>
-💰 <i>1 500 ₽/час</i>
-📝 Совместная работа над сведением с участием артиста
-✅ Идеально для:
-   • Точной реализации вашего видения звука
-   • Обучения процессу сведения
-   • Быстрой обратной связи и правок
-
-🎵 <b>Аранжировка</b>
-💰 <i>от 10 000 ₽</i>
-📝 Написание бита/аранжировки с нуля по референсу или вместе с артистом
-✅ В услугу входит:
-   • Непосредственное написание аранжировки
-   • Эффекты, саундизайн
-   • Типовое сведение
-   • Экспорт мультитрека
-   • Полные права
-   • До 3-х пакетов правок
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-👨‍🏫 <b>ОБУЧЕНИЕ</b>
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-🎵 <b>Обучение звукорежиссуре</b>
-💰 <i>1 500 ₽/занятие</i>
-📝 Обучение звукорежиссуре, написанию аранжировок, битов и студийной работе
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🛠️ <b>ДОПОЛНИТЕЛЬНЫЕ УСЛУГИ</b>
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-• 🎛️ <b>Мастеринг</b>: 2 000 ₽
-• 🎤 <b>Ручная коррекция вокала</b>: 750 ₽/трек
-• 🥁 <b>Ритмические коррекции инструментов</b>: 1 500 ₽/инструмент
-• 📝 <b>Написание текста</b>: от 5 000 ₽
-• 🎨 <b>Обложка к релизу</b>: от 3 000 ₽
-• 🌐 <b>Дистрибуция</b>: 750 ₽
-• 💼 <b>Коммерческий трек</b>: цены обсуждаются индивидуально
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🏢 <b>АРЕНДА СТУДИИ</b>
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-🎵 <b>Для самостоятельной работы:</b>
-• ⏱️ 3 часа — 3 000 ₽
-• ⏱️ 6 часов — 5 500 ₽
-• ⏱️ 12 часов — 10 000 ₽
+    
+    try:
+        await context.bot.send_message(
+            chat_id=ADMIN_ID, 
+            text=admin_message,
+            parse_mode='HTML',
+            reply_markup=reply_markup
+        )
+        print(f"✅ Уведомление отправлено администратору {ADMIN_ID} о бронировании {booking_id}")
+        return True
+    except Exception as e:
+        logger.error(f"Не удалось отправить уведомление админу: {e}")
+        print(f"❌ Ошибка отправки уведомления администратору: {e}")
+        return False
 
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# Команда /start
+async def start(update: Update, context: CallbackContext) -> None:
+    user_id = update.message.from_user.id
+    username = update.message.from_user.username or 'без username'
+    first_name = update.message.from_user.first_name
+    last_name = update.message.from_user.last_name or ''
+    
+    # Обновляем статистику пользователя
+    update_user_stats(user_id, username, first_name, last_name)
+    
+    reply_markup = get_main_keyboard(user_id)
+    
+    await update.message.reply_text(render_template('welcome'), reply_markup=reply_markup)
 
-🎯 <i>Индивидуальный подход к каждому клиенту</i>
+# Показываем расписание
+async def show_schedule(update: Update, context: CallbackContext) -> None:
+    try:
+        user_id = update.message.from_user.id
+        username = update.message.from_user.username or 'без username'
+        first_name = update.message.from_user.first_name
+        last_name = update.message.from_user.last_name or ''
+        
+        # Обновляем статистику пользователя
+        update_user_stats(user_id, username, first_name, last_name)
+        
+        dates = generate_studio_dates()
+        
+        # Создаем красивое расписание с эмодзи и форматированием
+        schedule_text = "🎵 <b>РАСПИСАНИЕ СТУДИИ НА 7 ДНЕЙ</b> 🎵\n\n"
+        
+        for studio_date in dates:
+            schedule_text += f"🎯 <b>{studio_date.label}</b>\n"
+            
+            # Занятость слотов этой даты одной маской
+            occupancy = get_day_occupancy(studio_date)
+            if occupancy is None:
+                schedule_text += "   🚫 <i>Студия не работает</i>\n"
+            else:
+                window, (labels, _), busy_mask = occupancy
+                schedule_text += f"   ⏰ <i>Часы работы: {format_working_hours(studio_date)}</i>\n"
+                
+                # Для сегодняшнего дня начинаем с ближайшего слота; мелкая сетка показывается интервалами
+                first = first_bookable_slot(studio_date, window)
+                for run_start, run_end, busy in slot_runs(labels, busy_mask, first):
+                    time_slot = labels[run_start] if SLOT_MINUTES == 60 else f"{labels[run_start]}-{slot_end_label(window, run_end)}"
+                    if busy:
+                        schedule_text += f"   ❌ {time_slot} - <i>Занято</i>\n"
+                    else:
+                        schedule_text += f"   ✅ {time_slot} - <b>Свободно</b>\n"
+            
+            schedule_text += "\n" + "─" * 40 + "\n\n"
+        
+        schedule_text += "💡 <b>Для бронирования нажмите '🎵 Забронировать'</b>"
+        
+        await update.message.reply_text(schedule_text, parse_mode='HTML')
+        
+    except Exception as e:
+        logger.error(f"Error in show_schedule: {e}")
+        await update.message.reply_text(
+            "❌ Произошла ошибка при загрузке расписания. Попробуйте позже."
+        )
 
-📞 <b>Для записи и консультации - свяжитесь с администратором!</b>"""
+# Показываем цены
+async def show_prices(update: Update, context: CallbackContext) -> None:
+    user_id = update.message.from_user.id
+    username = update.message.from_user.username or 'без username'
+    first_name = update.message.from_user.first_name
+    last_name = update.message.from_user.last_name or ''
+    
+    # Обновляем статистику пользователя
+    update_user_stats(user_id, username, first_name, last_name)
+    
+    prices_text = render_template('prices')
     
     await update.message.reply_text(prices_text, parse_mode='HTML')
 
@@ -1018,17 +3119,7 @@ async def contact_admin(update: Update, context: CallbackContext) -> None:
     # Обновляем статистику пользователя
     update_user_stats(user_id, username, first_name, last_name)
     
-    admin_info = """👨‍💻 <b>Связь с администратором</b>
-
-📞 <b>Телефон</b>: +7 (918) 880-52-92
-📱 <b>Telegram</b>: @Solnyshkin_Mikhail
-🔗 <b>Telegram канал студии</b>: https://t.me/+UPYAZ7ULL403YmEy
-👥 <b>VK группа</b>: https://vk.com/m_s_studio?from=groups
-🌐 <b>Сайт студии</b>: https://msstudio-stav.ru/
-⏰ <b>Время связи</b>: 9:00-22:00
-
-💬 <i>Напишите или позвоните для уточнения деталей!</i>
-🎵 <i>Поможем подобрать оптимальное решение для вашего проекта</i>"""
+    admin_info = render_template('contacts')
     
     await update.message.reply_text(admin_info, parse_mode='HTML')
 
@@ -1046,7 +3137,7 @@ async def show_admin_panel(update: Update, context: CallbackContext) -> None:
         ['📝 Добавить запись', '❌ Отменить запись'],
         ['🗓️ Админ расписание', '📢 Рассылка'],
         ['📈 Аналитика', '📊 Статистика пользователей'],
-        ['🔙 В главное меню']
+        ['💾 Снимок базы', '🔙 В главное меню']
     ]
     reply_markup = ReplyKeyboardMarkup(admin_keyboard, resize_keyboard=True)
     
@@ -1058,6 +3149,7 @@ async def show_admin_panel(update: Update, context: CallbackContext) -> None:
 📢 <b>Рассылка</b> - отправка сообщений всем пользователям
 📈 <b>Аналитика</b> - детальные отчеты и тренды
 📊 <b>Статистика пользователей</b> - базовая статистика
+💾 <b>Снимок базы</b> - выгрузка всей базы данных одним файлом
 
 Выберите действие:"""
     
@@ -1078,7 +3170,7 @@ async def show_add_booking_menu(update: Update, context: CallbackContext) -> int
         "Например: 25.12.2024\n\n"
         "📝 Введите дату в указанном формате:",
         parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+        reply_markup=BACK_KEYBOARD
     )
     
     return ADMIN_ADD_DAY
@@ -1105,56 +3197,41 @@ async def handle_admin_add_date(update: Update, context: CallbackContext) -> int
             await update.message.reply_text(
                 '❌ Нельзя выбрать прошедшую дату.\n'
                 'Пожалуйста, введите сегодняшнюю или будущую дату:',
-                reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                reply_markup=BACK_KEYBOARD
             )
             return ADMIN_ADD_DAY
         
         # Проверяем что дата не слишком далеко (максимум 3 месяца)
-        max_date = today + timedelta(days=90)
+        max_date = today + timedelta(days=BOOKING_HORIZON_DAYS)
         if selected_date > max_date:
             await update.message.reply_text(
                 '❌ Бронирование доступно только на 3 месяца вперед.\n'
                 'Пожалуйста, введите более близкую дату:',
-                reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                reply_markup=BACK_KEYBOARD
             )
             return ADMIN_ADD_DAY
         
-        # Форматируем дату для отображения
-        date_str = selected_date.strftime("%d.%m.%Y")
-        day_name = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"][selected_date.weekday()]
-        
-        # Добавляем пометку "Сегодня" если это сегодняшняя дата
-        if selected_date.date() == today.date():
-            formatted_date = f"{date_str} ({day_name}) - Сегодня"
-        else:
-            formatted_date = f"{date_str} ({day_name})"
+        # Подпись даты для отображения (для сегодняшней - с пометкой "Сегодня")
+        studio_date = StudioDate.from_date(selected_date.date())
+        date_str = studio_date.clean
+        formatted_date = studio_date.label
         
         # Сохраняем ОБЕ версии даты
         context.user_data['admin_booking_day'] = formatted_date  # для отображения
         context.user_data['admin_booking_clean_date'] = date_str  # для базы данных
         
-        # Показываем доступное время для выбранной даты - используем форматированную дату для проверки
-        available_times = get_available_times(formatted_date)
+        # Показываем время, с которого помещается хотя бы самая короткая сессия
+        start_options = get_start_options(formatted_date)
         
-        if not available_times:
+        if not start_options:
             await update.message.reply_text(
                 f'❌ На {formatted_date} нет свободного времени.\n'
                 f'Пожалуйста, выберите другую дату:',
-                reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                reply_markup=BACK_KEYBOARD
             )
             return ADMIN_ADD_DAY
         
-        time_keyboard = []
-        row = []
-        for i, time_slot in enumerate(available_times):
-            row.append(time_slot)
-            if len(row) == 2 or i == len(available_times) - 1:
-                time_keyboard.append(row)
-                row = []
-        
-        time_keyboard.append(['🔙 Назад'])
-        
-        reply_markup = ReplyKeyboardMarkup(time_keyboard, resize_keyboard=True)
+        reply_markup = build_time_keyboard(start_options)
         
         await update.message.reply_text(
             f'📅 Выбрана дата: <b>{formatted_date}</b>\n'
@@ -1172,7 +3249,7 @@ async def handle_admin_add_date(update: Update, context: CallbackContext) -> int
             'Пожалуйста, введите дату в формате <b>ДД.ММ.ГГГГ</b>\n'
             'Например: 25.12.2024',
             parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+            reply_markup=BACK_KEYBOARD
         )
         return ADMIN_ADD_DAY
 
@@ -1190,24 +3267,19 @@ async def handle_admin_add_time(update: Update, context: CallbackContext) -> int
         return ADMIN_ADD_DAY
     
     formatted_date = context.user_data['admin_booking_day']
-    available_times = get_available_times(formatted_date)
+    start_options = get_start_options(formatted_date)
     
-    if selected_time not in available_times:
+    if selected_time not in start_options:
         await update.message.reply_text(
             f'❌ Время {selected_time} недоступно.\n'
             f'Пожалуйста, выберите другое время:',
-            reply_markup=ReplyKeyboardMarkup([available_times[i:i+2] for i in range(0, len(available_times), 2)] + [['🔙 Назад']], resize_keyboard=True)
+            reply_markup=build_time_keyboard(start_options)
         )
         return ADMIN_ADD_TIME
     
     context.user_data['admin_booking_time'] = selected_time
     
-    duration_keyboard = [
-        ['1 час', '2 часа'],
-        ['3 часа', '4 часа'],
-        ['🔙 Назад']
-    ]
-    reply_markup = ReplyKeyboardMarkup(duration_keyboard, resize_keyboard=True)
+    reply_markup = build_duration_keyboard(start_options[selected_time])
     
     await update.message.reply_text(
         f'📅 Дата: <b>{formatted_date}</b>\n'
@@ -1230,19 +3302,9 @@ async def handle_admin_add_duration(update: Update, context: CallbackContext) ->
     
     if duration_text == '🔙 Назад':
         formatted_date = context.user_data['admin_booking_day']
-        available_times = get_available_times(formatted_date)
+        start_options = get_start_options(formatted_date)
         
-        time_keyboard = []
-        row = []
-        for i, time_slot in enumerate(available_times):
-            row.append(time_slot)
-            if len(row) == 2 or i == len(available_times) - 1:
-                time_keyboard.append(row)
-                row = []
-        
-        time_keyboard.append(['🔙 Назад'])
-        
-        reply_markup = ReplyKeyboardMarkup(time_keyboard, resize_keyboard=True)
+        reply_markup = build_time_keyboard(start_options)
         
         await update.message.reply_text(
             f'📅 Выбрана дата: <b>{formatted_date}</b>\n'
@@ -1253,38 +3315,25 @@ async def handle_admin_add_duration(update: Update, context: CallbackContext) ->
         )
         return ADMIN_ADD_TIME
     
-    duration_map = {
-        '1 час': 1, 
-        '2 часа': 2, 
-        '3 часа': 3, 
-        '4 часа': 4
-    }
+    formatted_date = context.user_data['admin_booking_day']
+    selected_time = context.user_data['admin_booking_time']
+    durations = get_start_options(formatted_date).get(selected_time, ())
     
-    if duration_text not in duration_map:
+    if duration_text not in SESSION_DURATIONS:
         await update.message.reply_text(
             '❌ Пожалуйста, выберите продолжительность из списка:',
-            reply_markup=ReplyKeyboardMarkup([
-                ['1 час', '2 часа'],
-                ['3 часа', '4 часа'],
-                ['🔙 Назад']
-            ], resize_keyboard=True)
+            reply_markup=build_duration_keyboard(durations)
         )
         return ADMIN_ADD_DURATION
     
-    duration = duration_map[duration_text]
-    formatted_date = context.user_data['admin_booking_day']
-    selected_time = context.user_data['admin_booking_time']
+    duration = SESSION_DURATIONS[duration_text]
     
-    # ПРОВЕРЯЕМ ДОСТУПНОСТЬ ВРЕМЕНИ С УЧЕТОМ ПРОДОЛЖИТЕЛЬНОСТИ
-    if not is_time_available(formatted_date, selected_time, duration):
+    # ПРОВЕРЯЕМ ДОСТУПНОСТЬ ВРЕМЕНИ С УЧЕТОМ ПРОДОЛЖИТЕЛЬНОСТИ (время могли занять, пока шел выбор)
+    if duration_text not in durations:
         await update.message.reply_text(
             f'❌ Время {selected_time} продолжительностью {duration} час(а) недоступно.\n'
-            f'Пожалуйста, выберите другое время или продолжительность.',
-            reply_markup=ReplyKeyboardMarkup([
-                ['1 час', '2 часа'],
-                ['3 часа', '4 часа'],
-                ['🔙 Назад']
-            ], resize_keyboard=True)
+            f'Пожалуйста, выберите другую продолжительность или вернитесь к выбору времени.',
+            reply_markup=build_duration_keyboard(durations)
         )
         return ADMIN_ADD_DURATION
     
@@ -1297,7 +3346,7 @@ async def handle_admin_add_duration(update: Update, context: CallbackContext) ->
         f'⏱ Продолжительность: <b>{duration} час(а)</b>\n\n'
         f'✍️ <b>Введите имя клиента:</b>',
         parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+        reply_markup=BACK_KEYBOARD
     )
     
     return ADMIN_ADD_CLIENT_NAME
@@ -1315,12 +3364,7 @@ async def handle_admin_add_client_name(update: Update, context: CallbackContext)
         formatted_date = context.user_data['admin_booking_day']
         selected_time = context.user_data['admin_booking_time']
         
-        duration_keyboard = [
-            ['1 час', '2 часа'],
-            ['3 часа', '4 часа'],
-            ['🔙 Назад']
-        ]
-        reply_markup = ReplyKeyboardMarkup(duration_keyboard, resize_keyboard=True)
+        reply_markup = build_duration_keyboard(get_start_options(formatted_date).get(selected_time, ()))
         
         await update.message.reply_text(
             f'📅 Дата: <b>{formatted_date}</b>\n'
@@ -1342,7 +3386,7 @@ async def handle_admin_add_client_name(update: Update, context: CallbackContext)
         f'📞 <b>Введите контакт клиента (телефон или Telegram):</b>\n'
         f'💡 <i>Эта информация будет отображаться в админ расписании</i>',
         parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+        reply_markup=BACK_KEYBOARD
     )
     
     return ADMIN_ADD_CLIENT_CONTACT
@@ -1364,7 +3408,7 @@ async def handle_admin_add_client_contact(update: Update, context: CallbackConte
             f'⏱ Продолжительность: <b>{context.user_data["admin_booking_duration"]} час(а)</b>\n\n'
             f'✍️ <b>Введите имя клиента:</b>',
             parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+            reply_markup=BACK_KEYBOARD
         )
         return ADMIN_ADD_CLIENT_NAME
     
@@ -1398,11 +3442,13 @@ async def handle_admin_add_client_contact(update: Update, context: CallbackConte
     cursor = conn.cursor()
     
     cursor.execute('''
-        INSERT INTO bookings (user_id, user_name, day, time, duration, status, created_at, added_by_admin, client_contact)
-        VALUES (?, ?, ?, ?, ?, 'confirmed', ?, ?, ?)
-    ''', (None, client_name, clean_date, selected_time, duration, get_current_time(), True, client_contact))
+        INSERT INTO bookings (user_id, user_name, day, time, duration, status, created_at, added_by_admin, client_contact, session_date)
+        VALUES (?, ?, ?, ?, ?, 'confirmed', ?, ?, ?, ?)
+    ''', (None, client_name, clean_date, selected_time, duration, get_current_time(), True, client_contact, to_session_date(clean_date)))
     booking_id = cursor.lastrowid
+    record_booking_transition(cursor, clean_date, selected_time, duration, None, client_name, None, 'confirmed')
     conn.commit()
+    mark_bookings_changed(booking_id)
     conn.close()
     
     # Сообщение администратору об успешном добавлении
@@ -1423,6 +3469,12 @@ async def handle_admin_add_client_contact(update: Update, context: CallbackConte
         reply_markup=get_main_keyboard(user_id)
     )
     
+    # Запись регулярного клиента можно сразу сделать еженедельной
+    await update.message.reply_text(
+        '🔁 Клиент ходит регулярно? Запись можно повторять каждую неделю в это же время.',
+        reply_markup=recurring_series_button(booking_id)
+    )
+    
     # Очищаем данные из контекста
     context.user_data.pop('admin_booking_day', None)
     context.user_data.pop('admin_booking_clean_date', None)
@@ -1442,47 +3494,96 @@ async def show_user_statistics(update: Update, context: CallbackContext) -> None
         return
     
     try:
-        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
-        cursor = conn.cursor()
+        stats_text, reply_markup = build_user_statistics_page()
+        await update.message.reply_text(stats_text, parse_mode='HTML', reply_markup=reply_markup)
         
-        # Получаем общую статистику
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        # Используем локальное время для подсчета активных пользователей
-        current_time = datetime.now()
-        week_ago = current_time - timedelta(days=7)
-        month_ago = current_time - timedelta(days=30)
+    except Exception as e:
+        logger.error(f"Error in show_user_statistics: {e}")
+        await update.message.reply_text(
+            "❌ Произошла ошибка при загрузке статистики пользователей."
+        )
+
+# Листание списка пользователей (сообщение редактируется на месте)
+async def handle_user_statistics_page(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    try:
+        # users_next_<позиция>_<last_activity>_<user_id> или users_prev_...
+        _, direction, offset, last_activity, key_user_id = query.data.split('_', 4)
+        stats_text, reply_markup = build_user_statistics_page(direction, (last_activity, int(key_user_id)), int(offset))
+        await query.edit_message_text(stats_text, parse_mode='HTML', reply_markup=reply_markup)
         
-        # Получаем всех пользователей и фильтруем локально
-        cursor.execute('''
-            SELECT user_id, username, first_name, last_name, first_seen, last_activity, bookings_count, total_hours
-            FROM users 
-            ORDER BY last_activity DESC
-        ''')
+    except Exception as e:
+        logger.error(f"Error in handle_user_statistics_page: {e}")
+
+# Сколько пользователей показывать на одной странице статистики
+USERS_PAGE_SIZE = 10
+
+# Формирование страницы статистики пользователей
+def build_user_statistics_page(direction=None, key=None, offset=0):
+    """Страница списка по ключу (last_activity, user_id): direction = 'next' - пользователи после key,
+    'prev' - перед key, None - первая страница. offset - номер первого пользователя страницы (для подписи).
+    Счетчики считаются запросами COUNT(*) по индексам, поэтому стоимость не зависит от числа пользователей"""
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    
+    # Получаем общую статистику
+    cursor.execute('SELECT COUNT(*) FROM users')
+    total_users = cursor.fetchone()[0]
+    
+    # Используем локальное время для подсчета активных пользователей
+    # (last_activity хранится как ГГГГ-ММ-ДД ЧЧ:ММ:СС, поэтому строки сравниваются как время)
+    current_time = datetime.now()
+    week_ago = (current_time - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
+    month_ago = (current_time - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    cursor.execute('SELECT COUNT(*) FROM users WHERE last_activity >= ?', (week_ago,))
+    active_users_7d = cursor.fetchone()[0]
+    
+    cursor.execute('SELECT COUNT(*) FROM users WHERE last_activity >= ?', (month_ago,))
+    active_users_30d = cursor.fetchone()[0]
+    
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(duration), 0) FROM bookings WHERE status = 'confirmed'")
+    total_bookings, total_hours = cursor.fetchone()
+    
+    # Страница пользователей по ключу, без чтения остальных строк
+    columns = 'user_id, username, first_name, last_name, first_seen, last_activity, bookings_count, total_hours'
+    if direction == 'next':
+        cursor.execute(f'''
+            SELECT {columns} FROM users
+            WHERE (last_activity, user_id) < (?, ?)
+            ORDER BY last_activity DESC, user_id DESC
+            LIMIT ?
+        ''', (*key, USERS_PAGE_SIZE + 1))
         users = cursor.fetchall()
-        
-        # Подсчитываем активных пользователей
-        active_users_7d = 0
-        active_users_30d = 0
-        
-        for user in users:
-            last_activity = parse_db_time(user[5])
-            if last_activity >= week_ago:
-                active_users_7d += 1
-            if last_activity >= month_ago:
-                active_users_30d += 1
-        
-        cursor.execute('SELECT COUNT(*) FROM bookings WHERE status = "confirmed"')
-        total_bookings = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT SUM(duration) FROM bookings WHERE status = "confirmed"')
-        total_hours = cursor.fetchone()[0] or 0
-        
-        conn.close()
-        
-        # Формируем сообщение со статистикой
-        stats_text = f"""📊 <b>СТАТИСТИКА ПОЛЬЗОВАТЕЛЕЙ</b>
+    elif direction == 'prev':
+        cursor.execute(f'''
+            SELECT {columns} FROM users
+            WHERE (last_activity, user_id) > (?, ?)
+            ORDER BY last_activity ASC, user_id ASC
+            LIMIT ?
+        ''', (*key, USERS_PAGE_SIZE))
+        users = cursor.fetchall()[::-1]
+    else:
+        cursor.execute(f'''
+            SELECT {columns} FROM users
+            ORDER BY last_activity DESC, user_id DESC
+            LIMIT ?
+        ''', (USERS_PAGE_SIZE + 1,))
+        users = cursor.fetchall()
+    
+    conn.close()
+    
+    # Лишняя строка при движении вперед показывает, есть ли следующая страница
+    has_next = len(users) > USERS_PAGE_SIZE if direction != 'prev' else True
+    users = users[:USERS_PAGE_SIZE]
+    
+    # Формируем сообщение со статистикой
+    stats_text = f"""📊 <b>СТАТИСТИКА ПОЛЬЗОВАТЕЛЕЙ</b>
 
 👥 <b>Общая статистика:</b>
 • Всего пользователей: <b>{total_users}</b>
@@ -1495,65 +3596,72 @@ async def show_user_statistics(update: Update, context: CallbackContext) -> None
 
 📋 <b>СПИСОК ПОЛЬЗОВАТЕЛЕЙ</b> (отсортирован по активности):
 """
+    
+    # Добавляем информацию о каждом пользователе страницы
+    for i, user in enumerate(users, offset + 1):
+        user_id, username, first_name, last_name, first_seen, last_activity, bookings_count, user_hours = user
+        
+        # Парсим время из базы данных
+        first_seen_dt = parse_db_time(first_seen)
+        last_activity_dt = parse_db_time(last_activity)
+        
+        # Форматируем даты для отображения
+        first_seen_date = first_seen_dt.strftime('%d.%m.%Y %H:%M')
+        last_activity_date = last_activity_dt.strftime('%d.%m.%Y %H:%M')
+        
+        # Определяем активность
+        days_since_activity = (current_time - last_activity_dt).days
+        
+        if days_since_activity == 0:
+            activity_status = "🟢 Сегодня"
+        elif days_since_activity == 1:
+            activity_status = "🟢 Вчера"
+        elif days_since_activity <= 7:
+            activity_status = "🟡 Неделю назад"
+        elif days_since_activity <= 30:
+            activity_status = "🟠 Месяц назад"
+        else:
+            activity_status = "🔴 Давно"
         
-        # Добавляем информацию о каждом пользователе
-        for i, user in enumerate(users, 1):
-            user_id, username, first_name, last_name, first_seen, last_activity, bookings_count, total_hours = user
-            
-            # Парсим время из базы данных
-            first_seen_dt = parse_db_time(first_seen)
-            last_activity_dt = parse_db_time(last_activity)
-            
-            # Форматируем даты для отображения
-            first_seen_date = first_seen_dt.strftime('%d.%m.%Y %H:%M')
-            last_activity_date = last_activity_dt.strftime('%d.%m.%Y %H:%M')
-            
-            # Определяем активность
-            days_since_activity = (datetime.now() - last_activity_dt).days
-            
-            if days_since_activity == 0:
-                activity_status = "🟢 Сегодня"
-            elif days_since_activity == 1:
-                activity_status = "🟢 Вчера"
-            elif days_since_activity <= 7:
-                activity_status = "🟡 Неделю назад"
-            elif days_since_activity <= 30:
-                activity_status = "🟠 Месяц назад"
-            else:
-                activity_status = "🔴 Давно"
-            
-            # Формируем ссылку на пользователя
-            user_link = f"<a href=\"tg://user?id={user_id}\">{first_name} {last_name}</a>" if first_name or last_name else f"<a href=\"tg://user?id={user_id}\">Пользователь</a>"
-            username_display = f"@{username}" if username else "без username"
-            
-            stats_text += f"""
+        # Формируем ссылку на пользователя
+        user_link = f"<a href=\"tg://user?id={user_id}\">{first_name} {last_name}</a>" if first_name or last_name else f"<a href=\"tg://user?id={user_id}\">Пользователь</a>"
+        username_display = f"@{username}" if username else "без username"
+        
+        stats_text += f"""
 {i}. {user_link}
    📱 {username_display}
    📅 Первый визит: {first_seen_date}
    ⏰ Последняя активность: {last_activity_date}
    🎵 Бронирований: {bookings_count}
-   ⏱️ Всего часов: {total_hours}
+   ⏱️ Всего часов: {user_hours}
    🔄 {activity_status}
 """
-            
-            # Ограничиваем вывод чтобы сообщение не было слишком длинным
-            if i >= 20:
-                stats_text += f"\n... и еще {len(users) - 20} пользователей"
-                break
-        
-        stats_text += f"""
+    
+    if not users:
+        stats_text += "\n• Пользователей пока нет\n"
+    
+    shown_to = offset + len(users)
+    stats_text += f"""
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
-💡 <i>Всего пользователей в базе: {len(users)}</i>
+💡 <i>Показаны {offset + 1 if users else 0}-{shown_to} из {total_users} пользователей</i>
 🔄 <i>Для обновления статистики нажмите "📊 Статистика пользователей" еще раз</i>"""
-        
-        await update.message.reply_text(stats_text, parse_mode='HTML')
-        
-    except Exception as e:
-        logger.error(f"Error in show_user_statistics: {e}")
-        await update.message.reply_text(
-            "❌ Произошла ошибка при загрузке статистики пользователей."
-        )
+    
+    # Кнопки листания несут ключ крайнего пользователя страницы
+    navigation = []
+    if users and offset > 0:
+        first = users[0]
+        navigation.append(InlineKeyboardButton(
+            "◀️ Назад", callback_data=f"users_prev_{max(offset - USERS_PAGE_SIZE, 0)}_{first[5]}_{first[0]}"
+        ))
+    if users and has_next and shown_to < total_users:
+        last = users[-1]
+        navigation.append(InlineKeyboardButton(
+            "Вперед ▶️", callback_data=f"users_next_{shown_to}_{last[5]}_{last[0]}"
+        ))
+    
+    reply_markup = InlineKeyboardMarkup([navigation]) if navigation else None
+    return stats_text, reply_markup
 
 # Меню рассылки
 async def show_broadcast_menu(update: Update, context: CallbackContext) -> int:
@@ -1583,7 +3691,7 @@ async def show_broadcast_menu(update: Update, context: CallbackContext) -> int:
     await update.message.reply_text(
         broadcast_text,
         parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+        reply_markup=BACK_KEYBOARD
     )
     
     return BROADCAST_MESSAGE
@@ -1648,7 +3756,7 @@ async def handle_broadcast_media(update: Update, context: CallbackContext) -> in
     else:
         await update.message.reply_text(
             "❌ Неподдерживаемый тип сообщения. Используйте текст, фото или видео.",
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+            reply_markup=BACK_KEYBOARD
         )
         return BROADCAST_MESSAGE
     
@@ -1818,6 +3926,7 @@ async def show_analytics_menu(update: Update, context: CallbackContext) -> int:
     analytics_keyboard = [
         ['📈 Аналитика за 7 дней', '📊 Аналитика за 30 дней'],
         ['📅 Аналитика за 90 дней', '🎯 Произвольный период'],
+        ['🔥 Загрузка студии', '👥 Вовлеченность'],
         ['🔙 Назад в админ-панель']
     ]
     reply_markup = ReplyKeyboardMarkup(analytics_keyboard, resize_keyboard=True)
@@ -1830,6 +3939,8 @@ async def show_analytics_menu(update: Update, context: CallbackContext) -> int:
 📊 <b>Аналитика за 30 дней</b> - стандартный отчет за месяц  
 📅 <b>Аналитика за 90 дней</b> - долгосрочный анализ трендов
 🎯 <b>Произвольный период</b> - ввод любого количества дней
+🔥 <b>Загрузка студии</b> - тепловая карта по дням недели и часам
+👥 <b>Вовлеченность</b> - DAU/WAU/MAU и удержание пользователей
 
 Отчет включает:
 • Общую статистику бронирований
@@ -1867,17 +3978,23 @@ async def handle_analytics_period(update: Update, context: CallbackContext) -> i
         await show_advanced_analytics(update, context, period_days)
         return ConversationHandler.END
     
-    elif choice == '🎯 Произвольный период':
+    elif choice in ('🎯 Произвольный период', '🔥 Загрузка студии'):
+        # Запоминаем, какой отчет строить после ввода периода
+        context.user_data['analytics_mode'] = 'utilization' if choice == '🔥 Загрузка студии' else 'report'
         await update.message.reply_text(
             "📅 <b>ВВЕДИТЕ КОЛИЧЕСТВО ДНЕЙ ДЛЯ АНАЛИЗА</b>\n\n"
             "Например: <b>14</b> (для анализа за 2 недели)\n"
             "Максимум: 365 дней\n\n"
             "Введите число:",
             parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+            reply_markup=BACK_KEYBOARD
         )
         return ANALYTICS_PERIOD
     
+    elif choice == '👥 Вовлеченность':
+        await show_engagement_analytics(update, context)
+        return ANALYTICS_MENU
+    
     elif choice == '🔙 Назад в админ-панель':
         await show_admin_panel(update, context)
         return ConversationHandler.END
@@ -1888,6 +4005,7 @@ async def handle_analytics_period(update: Update, context: CallbackContext) -> i
             reply_markup=ReplyKeyboardMarkup([
                 ['📈 Аналитика за 7 дней', '📊 Аналитика за 30 дней'],
                 ['📅 Аналитика за 90 дней', '🎯 Произвольный период'],
+                ['🔥 Загрузка студии', '👥 Вовлеченность'],
                 ['🔙 Назад в админ-панель']
             ], resize_keyboard=True)
         )
@@ -1911,17 +4029,22 @@ async def handle_custom_period(update: Update, context: CallbackContext) -> int:
         if period_days <= 0:
             await update.message.reply_text(
                 "❌ Число должно быть положительным.\nПожалуйста, введите корректное число:",
-                reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                reply_markup=BACK_KEYBOARD
             )
             return ANALYTICS_PERIOD
         
         if period_days > 365:
             await update.message.reply_text(
                 "❌ Максимальный период - 365 дней.\nПожалуйста, введите меньшее число:",
-                reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                reply_markup=BACK_KEYBOARD
             )
             return ANALYTICS_PERIOD
         
+        # После тепловой карты остаемся в меню аналитики
+        if context.user_data.pop('analytics_mode', 'report') == 'utilization':
+            await show_utilization_heatmap(update, context, period_days)
+            return ANALYTICS_MENU
+        
         await show_advanced_analytics(update, context, period_days)
         return ConversationHandler.END
         
@@ -1930,7 +4053,7 @@ async def handle_custom_period(update: Update, context: CallbackContext) -> int:
             "❌ Пожалуйста, введите корректное число:\n\n"
             "Например: <b>14</b> (для анализа за 2 недели)",
             parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+            reply_markup=BACK_KEYBOARD
         )
         return ANALYTICS_PERIOD
 
@@ -1950,8 +4073,19 @@ async def show_advanced_analytics(update: Update, context: CallbackContext, peri
         parse_mode='HTML'
     )
     
+    # Расчет идет в пуле процессов, ход расчета показываем в сообщении о загрузке
+    async def show_progress(text):
+        await context.bot.edit_message_text(
+            chat_id=update.message.chat_id,
+            message_id=loading_message.message_id,
+            text=f"📊 <b>ЗАГРУЖАЮ АНАЛИТИКУ...</b>\n\n"
+                 f"Период: последние <b>{period_days}</b> дней\n"
+                 f"{text}",
+            parse_mode='HTML'
+        )
+    
     # Получаем аналитику
-    analytics = get_advanced_analytics(period_days)
+    analytics = await get_advanced_analytics_async(period_days, on_progress=show_progress)
     
     if not analytics:
         await context.bot.edit_message_text(
@@ -1965,7 +4099,7 @@ async def show_advanced_analytics(update: Update, context: CallbackContext, peri
     report_text = f"""📈 <b>АНАЛИТИКА СТУДИИ</b>
     
 ⏰ <b>Период анализа:</b> последние {period_days} дней
-📅 <b>Дата отчета:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}
+📅 <b>Дата отчета:</b> {parse_db_time(analytics['computed_at']).strftime('%d.%m.%Y %H:%M') if analytics.get('computed_at') else datetime.now().strftime('%d.%m.%Y %H:%M')}
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 📊 <b>ОСНОВНЫЕ ПОКАЗАТЕЛИ</b>
@@ -2096,6 +4230,154 @@ async def show_advanced_analytics(update: Update, context: CallbackContext, peri
         reply_markup=reply_markup
     )
 
+# Показ тепловой карты загрузки студии
+async def show_utilization_heatmap(update: Update, context: CallbackContext, period_days: int):
+    user_id = update.message.from_user.id
+    
+    if user_id != ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет доступа к админ-панели")
+        return
+    
+    loading_message = await update.message.reply_text(
+        f"🔥 <b>СЧИТАЮ ЗАГРУЗКУ СТУДИИ...</b>\n\n"
+        f"Период: последние <b>{period_days}</b> дней",
+        parse_mode='HTML'
+    )
+    
+    # Расчет и отрисовка идут в пуле процессов
+    async def show_progress(text):
+        await context.bot.edit_message_text(
+            chat_id=update.message.chat_id,
+            message_id=loading_message.message_id,
+            text=f"🔥 <b>СЧИТАЮ ЗАГРУЗКУ СТУДИИ...</b>\n\n"
+                 f"Период: последние <b>{period_days}</b> дней\n"
+                 f"{text}",
+            parse_mode='HTML'
+        )
+    
+    report = await run_analytics_task(build_utilization_report, period_days, on_progress=show_progress)
+    
+    if not report:
+        await context.bot.edit_message_text(
+            chat_id=update.message.chat_id,
+            message_id=loading_message.message_id,
+            text="❌ Произошла ошибка при расчете загрузки студии."
+        )
+        return
+    
+    utilization = report['utilization']
+    
+    # Самые загруженные и самые свободные часы по всей неделе
+    hour_fill = sorted(zip(utilization['hours'], utilization['hour_fill']), key=lambda item: item[1], reverse=True)
+    busiest = ', '.join(f"{hour}:00 ({round(rate * 100)}%)" for hour, rate in hour_fill[:3])
+    quietest = ', '.join(f"{hour}:00 ({round(rate * 100)}%)" for hour, rate in hour_fill[-3:])
+    
+    report_text = f"""🔥 <b>ЗАГРУЗКА СТУДИИ</b>
+
+⏰ <b>Период:</b> {utilization['start_date'].strftime('%d.%m.%Y')} - {utilization['end_date'].strftime('%d.%m.%Y')} ({period_days} дней)
+🕘 <b>Рабочее время:</b> {format_weekly_hours()}
+
+• ⏱️ <b>Занято часов:</b> {utilization['booked_hours']} из {utilization['capacity_hours']}
+• 📊 <b>Заполняемость:</b> {round(utilization['fill_rate'] * 100, 1)}%
+• 🔝 <b>Самые загруженные часы:</b> {busiest}
+• 💤 <b>Самые свободные часы:</b> {quietest}
+
+<pre>{format_utilization_grid(utilization)}</pre>
+<i>{HEATMAP_SHADES[1]} до 25%  {HEATMAP_SHADES[2]} до 50%  {HEATMAP_SHADES[3]} до 75%  {HEATMAP_SHADES[4]} до 100% занятых слотов</i>"""
+    
+    await context.bot.edit_message_text(
+        chat_id=update.message.chat_id,
+        message_id=loading_message.message_id,
+        text=report_text,
+        parse_mode='HTML'
+    )
+    
+    if report['image']:
+        await update.message.reply_photo(
+            photo=report['image'],
+            caption=f"🔥 Загрузка студии за {period_days} дней"
+        )
+    
+    await show_analytics_menu(update, context)
+
+# Показ вовлеченности пользователей (DAU/WAU/MAU и когорты удержания)
+async def show_engagement_analytics(update: Update, context: CallbackContext):
+    user_id = update.message.from_user.id
+    
+    if user_id != ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет доступа к админ-панели")
+        return
+    
+    engagement = await run_analytics_task(compute_engagement_stats)
+    
+    if not engagement:
+        await update.message.reply_text("❌ Произошла ошибка при загрузке вовлеченности пользователей.")
+        return
+    
+    report_text = f"""👥 <b>ВОВЛЕЧЕННОСТЬ ПОЛЬЗОВАТЕЛЕЙ</b>
+
+📅 <b>Дата отчета:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📊 <b>АКТИВНЫЕ ПОЛЬЗОВАТЕЛИ</b>
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+• 🟢 <b>DAU (24 часа):</b> {engagement['dau']}
+• 🟡 <b>WAU (7 дней):</b> {engagement['wau']}
+• 🟠 <b>MAU (30 дней):</b> {engagement['mau']}
+• 📈 <b>Средний DAU за 30 дней:</b> {engagement['avg_dau']}
+• 🔁 <b>Липкость (DAU/MAU):</b> {round(engagement['stickiness'] * 100, 1)}%
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📅 <b>ПО ДНЯМ</b> (последние 14 дней)
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
+    
+    for day, active_users, new_users in engagement['daily_stats']:
+        report_text += f"• {datetime.strptime(day, '%Y-%m-%d').strftime('%d.%m')}: {active_users} активных, {new_users} новых\n"
+    
+    report_text += """
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🗓️ <b>ПО НЕДЕЛЯМ</b>
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
+    
+    if engagement['weekly_stats']:
+        for week, active_users, new_users in engagement['weekly_stats']:
+            report_text += f"• с {datetime.strptime(week, '%Y-%m-%d').strftime('%d.%m')}: {active_users} активных, {new_users} новых\n"
+    else:
+        report_text += "• Нет данных\n"
+    
+    report_text += """
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📈 <b>ПО МЕСЯЦАМ</b>
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
+    
+    if engagement['monthly_stats']:
+        for month, active_users, new_users in engagement['monthly_stats']:
+            report_text += f"• {datetime.strptime(month, '%Y-%m').strftime('%m.%Y')}: {active_users} активных, {new_users} новых\n"
+    else:
+        report_text += "• Нет данных\n"
+    
+    report_text += """
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🔄 <b>УДЕРЖАНИЕ ПО КОГОРТАМ</b> (неделя первого визита)
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
+    
+    if engagement['cohorts']:
+        cohort_lines = ['Неделя  Польз ' + ' '.join(f"Н{weeks_since:<3}" for weeks_since in range(ENGAGEMENT_COHORTS))]
+        for cohort_week, cohort_size, retention in engagement['cohorts']:
+            cells = ' '.join(f"{round(rate * 100):>3}%" for rate in retention)
+            cohort_lines.append(f"{datetime.strptime(cohort_week, '%Y-%m-%d').strftime('%d.%m')}   {cohort_size:>5} {cells}")
+        report_text += "<pre>" + "\n".join(cohort_lines) + "</pre>\n"
+        report_text += "<i>Н0 - неделя первого визита, Н1 - следующая неделя и т.д.</i>"
+    else:
+        report_text += "• Нет данных"
+    
+    await update.message.reply_text(report_text, parse_mode='HTML')
+
 # Функция для экспорта данных
 async def export_analytics_data(update: Update, context: CallbackContext):
     """Экспорт данных аналитики в CSV файлы"""
@@ -2116,9 +4398,23 @@ async def export_analytics_data(update: Update, context: CallbackContext):
         parse_mode='HTML'
     )
     
+    # CSV файлы готовятся в пуле процессов, ход подготовки показываем в сообщении об экспорте
+    async def show_progress(text):
+        await context.bot.edit_message_text(
+            chat_id=update.message.chat_id,
+            message_id=export_message.message_id,
+            text=f"📊 <b>НАЧИНАЮ ЭКСПОРТ ДАННЫХ...</b>\n\n"
+                 f"Период: последние <b>{period_days}</b> дней\n"
+                 f"{text}",
+            parse_mode='HTML'
+        )
+    
     try:
         # Экспортируем данные аналитики
-        analytics_data = export_analytics_to_csv(period_days)
+        analytics = await get_advanced_analytics_async(period_days, on_progress=show_progress)
+        analytics_data = await run_analytics_task(
+            export_analytics_to_csv, period_days, analytics, on_progress=show_progress
+        ) if analytics else None
         
         if not analytics_data:
             await context.bot.edit_message_text(
@@ -2129,7 +4425,7 @@ async def export_analytics_data(update: Update, context: CallbackContext):
             return
         
         # Экспортируем данные пользователей
-        users_data = export_users_to_csv()
+        users_data = await run_analytics_task(export_users_to_csv)
         
         if not users_data:
             await context.bot.edit_message_text(
@@ -2245,6 +4541,53 @@ async def export_analytics_data(update: Update, context: CallbackContext):
             parse_mode='HTML'
         )
 
+# Выгрузка снимка базы данных администратору
+async def export_db_snapshot(update: Update, context: CallbackContext):
+    """Отправка консистентного снимка studio_schedule.db одним файлом"""
+    user_id = update.message.from_user.id
+
+    if user_id != ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет доступа к этой функции")
+        return
+
+    # /snapshot raw - снимок без сжатия
+    vacuum = not (context.args and context.args[0] == 'raw')
+
+    snapshot_message = await update.message.reply_text(
+        "💾 <b>СОЗДАЮ СНИМОК БАЗЫ ДАННЫХ...</b>\n\n"
+        "⏳ Бронирования продолжают работать во время копирования",
+        parse_mode='HTML'
+    )
+
+    # Копирование идет в отдельном потоке, чтобы не останавливать бота
+    snapshot = await asyncio.to_thread(create_db_snapshot, vacuum)
+
+    if not snapshot:
+        await context.bot.edit_message_text(
+            chat_id=update.message.chat_id,
+            message_id=snapshot_message.message_id,
+            text="❌ Произошла ошибка при создании снимка базы данных."
+        )
+        return
+
+    await context.bot.send_document(
+        chat_id=user_id,
+        document=io.BytesIO(snapshot['content']),
+        filename=snapshot['filename'],
+        caption="💾 Снимок базы данных" + (" (сжатый)" if snapshot['vacuumed'] else "")
+    )
+
+    await context.bot.edit_message_text(
+        chat_id=update.message.chat_id,
+        message_id=snapshot_message.message_id,
+        text=f"✅ <b>СНИМОК БАЗЫ ДАННЫХ ГОТОВ</b>\n\n"
+             f"📁 <b>Файл:</b> {snapshot['filename']}\n"
+             f"📦 <b>Размер:</b> {round(len(snapshot['content']) / 1024, 1)} КБ\n"
+             f"⏰ <b>Время снимка:</b> {snapshot['export_time']}\n\n"
+             f"💡 <i>Файл открывается любым клиентом SQLite (DB Browser, sqlite3, pandas)</i>",
+        parse_mode='HTML'
+    )
+
 # Меню админ расписания
 async def show_admin_schedule_menu(update: Update, context: CallbackContext) -> int:
     user_id = update.message.from_user.id
@@ -2255,6 +4598,7 @@ async def show_admin_schedule_menu(update: Update, context: CallbackContext) ->
     
     admin_schedule_keyboard = [
         ['🗓️ Расписание на сегодня', '📅 Выбрать другую дату'],
+        ['📆 Расписание на неделю', '📆 Выбрать диапазон'],
         ['🔙 Назад в админ-панель']
     ]
     reply_markup = ReplyKeyboardMarkup(admin_schedule_keyboard, resize_keyboard=True)
@@ -2265,6 +4609,8 @@ async def show_admin_schedule_menu(update: Update, context: CallbackContext) ->
 
 🗓️ <b>Расписание на сегодня</b> - просмотр и управление бронированиями на сегодня
 📅 <b>Выбрать другую дату</b> - просмотр расписания на конкретную дату
+📆 <b>Расписание на неделю</b> - все записи на 7 дней вперед в одном отчете
+📆 <b>Выбрать диапазон</b> - записи за произвольный период (до 31 дня)
 
 Здесь вы можете:
 • Просматривать все бронирования на выбранную дату
@@ -2289,13 +4635,7 @@ async def handle_admin_schedule_choice(update: Update, context: CallbackContext)
         return ConversationHandler.END
     
     if choice == '🗓️ Расписание на сегодня':
-        # Получаем сегодняшнюю дату в нужном формате
-        today = datetime.now()
-        date_str = today.strftime("%d.%m.%Y")
-        day_name = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"][today.weekday()]
-        formatted_date = f"{date_str} ({day_name}) - Сегодня"
-        
-        await show_admin_schedule_for_date(update, context, formatted_date)
+        await show_admin_schedule_for_date(update, context, StudioDate.from_date(datetime.now().date()))
         return ConversationHandler.END
     
     elif choice == '📅 Выбрать другую дату':
@@ -2305,10 +4645,27 @@ async def handle_admin_schedule_choice(update: Update, context: CallbackContext)
             "Например: 25.12.2024\n\n"
             "📝 Введите дату в указанном формате:",
             parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+            reply_markup=BACK_KEYBOARD
         )
         return ADMIN_SCHEDULE_DATE
     
+    elif choice == '📆 Расписание на неделю':
+        today = datetime.now().date()
+        await show_admin_schedule_range(update, context, today, today + timedelta(days=6))
+        return ConversationHandler.END
+    
+    elif choice == '📆 Выбрать диапазон':
+        await update.message.reply_text(
+            "📆 <b>ВВЕДИТЕ ДИАПАЗОН ДАТ</b>\n\n"
+            "Формат: <b>ДД.ММ.ГГГГ - ДД.ММ.ГГГГ</b>\n"
+            "Например: 22.12.2024 - 28.12.2024\n"
+            f"Максимум: {SCHEDULE_RANGE_MAX_DAYS} дней\n\n"
+            "📝 Введите диапазон в указанном формате:",
+            parse_mode='HTML',
+            reply_markup=BACK_KEYBOARD
+        )
+        return ADMIN_SCHEDULE_RANGE
+    
     elif choice == '🔙 Назад в админ-панель':
         await show_admin_panel(update, context)
         return ConversationHandler.END
@@ -2318,6 +4675,7 @@ async def handle_admin_schedule_choice(update: Update, context: CallbackContext)
             "Пожалуйста, выберите действие из меню:",
             reply_markup=ReplyKeyboardMarkup([
                 ['🗓️ Расписание на сегодня', '📅 Выбрать другую дату'],
+                ['📆 Расписание на неделю', '📆 Выбрать диапазон'],
                 ['🔙 Назад в админ-панель']
             ], resize_keyboard=True)
         )
@@ -2345,19 +4703,13 @@ async def handle_admin_schedule_date(update: Update, context: CallbackContext) -
             await update.message.reply_text(
                 '❌ Нельзя просматривать прошедшие даты.\n'
                 'Пожалуйста, введите сегодняшнюю или будущую дату:',
-                reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                reply_markup=BACK_KEYBOARD
             )
             return ADMIN_SCHEDULE_DATE
         
-        # Форматируем дату для отображения
-        date_str = selected_date.strftime("%d.%m.%Y")
-        day_name = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"][selected_date.weekday()]
-        
-        # Добавляем пометку "Сегодня" если это сегодняшняя дата
-        if selected_date.date() == today.date():
-            formatted_date = f"{date_str} ({day_name}) - Сегодня"
-        else:
-            formatted_date = f"{date_str} ({day_name})"
+        # Подпись даты для отображения (для сегодняшней - с пометкой "Сегодня")
+        studio_date = StudioDate.from_date(selected_date.date())
+        formatted_date = studio_date.label
         
         # Очищаем предыдущие данные
         if 'admin_schedule_date' in context.user_data:
@@ -2372,164 +4724,521 @@ async def handle_admin_schedule_date(update: Update, context: CallbackContext) -
             'Пожалуйста, введите дату в формате <b>ДД.ММ.ГГГГ</b>\n'
             'Например: 25.12.2024',
             parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+            reply_markup=BACK_KEYBOARD
         )
         return ADMIN_SCHEDULE_DATE
 
-# Показ расписания для конкретной даты (админ версия) - ИСПРАВЛЕННАЯ ВЕРСИЯ
-async def show_admin_schedule_for_date(update: Update, context: CallbackContext, selected_date: str):
-    user_id = update.message.from_user.id
+# Сколько записей показывать на одной странице списков
+LIST_PAGE_SIZE = 8
+
+# Выборка страницы по ключу сортировки (keyset): стоимость не зависит от номера страницы
+def fetch_keyset_page(cursor, select_sql, params, key_columns, key=None, direction='next', page_size=LIST_PAGE_SIZE):
+    """select_sql - запрос с условием WHERE, key_columns - уникальный ключ сортировки по возрастанию,
+    key - значения ключа крайней записи соседней страницы (None - первая страница),
+    для direction='from' - ключ первой записи самой страницы (перерисовка после действия над записью).
+    Возвращает строки страницы и признаки наличия предыдущей и следующей страниц"""
+    columns = ', '.join(key_columns)
+    placeholders = ', '.join('?' * len(key_columns))
+    
+    if key is None:
+        cursor.execute(f"{select_sql} ORDER BY {columns} LIMIT ?", (*params, page_size + 1))
+        rows = cursor.fetchall()
+        return rows[:page_size], False, len(rows) > page_size
+    
+    if direction == 'next':
+        cursor.execute(
+            f"{select_sql} AND ({columns}) > ({placeholders}) ORDER BY {columns} LIMIT ?",
+            (*params, *key, page_size + 1)
+        )
+        rows = cursor.fetchall()
+        return rows[:page_size], True, len(rows) > page_size
     
-    if user_id != ADMIN_ID:
-        await update.message.reply_text("❌ У вас нет доступа к админ-панели")
+    if direction == 'from':
+        cursor.execute(
+            f"{select_sql} AND ({columns}) >= ({placeholders}) ORDER BY {columns} LIMIT ?",
+            (*params, *key, page_size + 1)
+        )
+        rows = cursor.fetchall()
+        # Если записей страницы не осталось - показываем предыдущую
+        if rows:
+            return rows[:page_size], True, len(rows) > page_size
+    
+    # Назад: читаем в обратном порядке от ключа и разворачиваем
+    descending = ', '.join(f"{column} DESC" for column in key_columns)
+    cursor.execute(
+        f"{select_sql} AND ({columns}) < ({placeholders}) ORDER BY {descending} LIMIT ?",
+        (*params, *key, page_size + 1)
+    )
+    rows = cursor.fetchall()
+    return rows[:page_size][::-1], len(rows) > page_size, True
+
+# Кнопки листания: несут имя списка, его параметр и ключ крайней записи страницы
+def list_page_navigation(name, arg, rows, key_of, has_prev, has_next):
+    navigation = []
+    if rows and has_prev:
+        navigation.append(InlineKeyboardButton(
+            "◀️ Назад", callback_data=f"pg|{name}|prev|{arg}|" + '|'.join(map(str, key_of(rows[0])))
+        ))
+    if rows and has_next:
+        navigation.append(InlineKeyboardButton(
+            "Вперед ▶️", callback_data=f"pg|{name}|next|{arg}|" + '|'.join(map(str, key_of(rows[-1])))
+        ))
+    return navigation
+
+# Callback действия над записью на странице списка: pa|<действие>|<id брони>|<список>|<параметр>|<ключ первой записи страницы>.
+# Ключ пустой для первой страницы
+def list_item_callback(action, booking_id, name, arg, anchor):
+    return f"pa|{action}|{booking_id}|{name}|{arg}|" + '|'.join(map(str, anchor))
+
+# Разбор callback действия над записью: (действие, id брони, (список, параметр, ключ) или None для отдельного сообщения брони)
+def parse_booking_callback(data):
+    if data.startswith('pa|'):
+        _, action, booking_id, name, arg, *key = data.split('|')
+        key = [int(value) if value.isdigit() else value for value in key if value] or None
+        return action, int(booking_id), (name, arg, key)
+    
+    action, booking_id = data.rsplit('_', 1)
+    return action, int(booking_id), None
+
+# Результат действия над записью: сообщение отдельной брони заменяется результатом,
+# а страница списка перерисовывается на месте, и результат приходит новым сообщением
+async def show_booking_action_result(query, text, reply_markup=None):
+    _, _, page = parse_booking_callback(query.data)
+    
+    if page is None:
+        await query.edit_message_text(text, parse_mode='HTML', reply_markup=reply_markup)
         return
     
-    try:
-        # Убираем пометку " - Сегодня" из даты для поиска в базе
-        clean_date = selected_date.replace(" - Сегодня", "")
-        # Убираем день недели в скобках, оставляем только дату
-        clean_date = clean_date.split(' (')[0]
-        
-        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
-        cursor = conn.cursor()
-        
-        # Получаем все бронирования на эту дату
-        cursor.execute('''
-            SELECT b.id, b.user_id, b.user_name, b.time, b.duration, b.status, b.created_at, b.added_by_admin, u.username, b.client_contact
-            FROM bookings b
-            LEFT JOIN users u ON b.user_id = u.user_id
-            WHERE b.day = ?
-            ORDER BY b.time
-        ''', (clean_date,))
-        
-        bookings = cursor.fetchall()
-        conn.close()
-        
-        # Создаем красивое расписание с эмодзи и форматированием
-        schedule_text = f"""🗓️ <b>АДМИН РАСПИСАНИЕ</b>
+    name, arg, key = page
+    page_text, page_markup = build_list_page(name, arg, query.from_user.id, key, 'from' if key else 'next')
+    await query.edit_message_text(page_text, parse_mode='HTML', reply_markup=page_markup)
+    await query.message.reply_text(text, parse_mode='HTML', reply_markup=reply_markup)
+
+# Подпись даты брони с днем недели (и пометкой "Сегодня"), как в меню выбора даты
+def format_date_label(clean_date):
+    return StudioDate.parse(clean_date).label
+
+# Страница админ расписания на дату: все брони с действиями для активных
+def build_schedule_page(clean_date, viewer_id, key=None, direction='next'):
+    selected_date = format_date_label(clean_date)
+    session_date = to_session_date(clean_date)
+    
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    
+    # Статистика по дате одним запросом по индексу даты сессии
+    cursor.execute('SELECT status, COUNT(*) FROM bookings WHERE session_date = ? GROUP BY status', (session_date,))
+    status_counts = dict(cursor.fetchall())
+    
+    bookings, has_prev, has_next = fetch_keyset_page(cursor, '''
+        SELECT b.id, b.user_id, b.user_name, b.time, b.duration, b.status, b.added_by_admin, u.username, b.client_contact
+        FROM bookings b
+        LEFT JOIN users u ON b.user_id = u.user_id
+        WHERE b.session_date = ?
+    ''', (session_date,), ('b.time', 'b.id'), key, direction)
+    conn.close()
+    
+    # Создаем красивое расписание с эмодзи и форматированием
+    schedule_text = f"""🗓️ <b>АДМИН РАСПИСАНИЕ</b>
 
 📅 <b>Дата:</b> {selected_date}
-⏰ <b>Часы работы:</b> 9:00 - 21:00
+⏰ <b>Часы работы:</b> {format_working_hours(clean_date)}
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 🎵 <b>БРОНИРОВАНИЯ НА ЭТУ ДАТУ</b>
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 """
+    
+    status_labels = {
+        'confirmed': "✅",
+        'pending': "⏳ ожидает",
+        'cancelled': "❌ отменена (клиентом)",
+        'cancelled_by_admin': "❌ отменена (админом)"
+    }
+    keyboard = []
+    anchor = (bookings[0][3], bookings[0][0]) if bookings and has_prev else ()
+    
+    if not bookings:
+        schedule_text += "\n📝 <b>На эту дату нет бронирований.</b>\n\n"
+        schedule_text += "💡 <i>Все временные слоты свободны для записи.</i>\n"
+    
+    for booking in bookings:
+        booking_id, user_id, user_name, time, duration, status, added_by_admin, username, client_contact = booking
         
-        if not bookings:
-            schedule_text += "\n📝 <b>На эту дату нет бронирований.</b>\n\n"
-            schedule_text += "💡 <i>Все временные слоты свободны для записи.</i>"
+        # Определяем источник записи
+        source = "👤 (админ)" if added_by_admin else "🤖 (бот)"
+        
+        # Формируем ссылку на пользователя если есть user_id
+        if user_id:
+            user_display = f'<a href="tg://user?id={user_id}">{user_name}</a>'
+            username_display = f"(@{username})" if username else ""
         else:
-            # Группируем бронирования по статусам
-            confirmed_bookings = [b for b in bookings if b[5] == 'confirmed']
-            pending_bookings = [b for b in bookings if b[5] == 'pending']
-            cancelled_bookings = [b for b in bookings if b[5] == 'cancelled']
-            cancelled_by_admin_bookings = [b for b in bookings if b[5] == 'cancelled_by_admin']
-            
-            # Показываем подтвержденные брони
-            if confirmed_bookings:
-                schedule_text += "\n✅ <b>ПОДТВЕРЖДЕННЫЕ БРОНИ:</b>\n\n"
-                for booking in confirmed_bookings:
-                    booking_id, user_id, user_name, time, duration, status, created_at, added_by_admin, username, client_contact = booking
-                    
-                    # Определяем источник записи
-                    source = "👤 (админ)" if added_by_admin else "🤖 (бот)"
-                    
-                    # Формируем ссылку на пользователя если есть user_id
-                    if user_id:
-                        user_display = f'<a href="tg://user?id={user_id}">{user_name}</a>'
-                        username_display = f"(@{username})" if username else ""
-                    else:
-                        user_display = user_name
-                        username_display = ""
-                    
-                    # Добавляем контакт если есть
-                    contact_display = f"\n   📞 Контакт: {client_contact}" if client_contact else ""
-                    
-                    schedule_text += f"🕐 <b>{time}</b> - {duration} час(а) {source}\n"
-                    schedule_text += f"   👤 {user_display} {username_display}{contact_display}\n"
-                    if user_id:
-                        schedule_text += f"   📞 ID: {user_id}\n"
-                    schedule_text += f"   📋 ID брони: {booking_id}\n\n"
-            
-            # Показываем ожидающие подтверждения брони
-            if pending_bookings:
-                schedule_text += "⏳ <b>ОЖИДАЮТ ПОДТВЕРЖДЕНИЯ:</b>\n\n"
-                for booking in pending_bookings:
-                    booking_id, user_id, user_name, time, duration, status, created_at, added_by_admin, username, client_contact = booking
-                    
-                    # Определяем источник записи
-                    source = "👤 (админ)" if added_by_admin else "🤖 (бот)"
-                    
-                    # Формируем ссылку на пользователя если есть user_id
-                    if user_id:
-                        user_display = f'<a href="tg://user?id={user_id}">{user_name}</a>'
-                        username_display = f"(@{username})" if username else ""
-                    else:
-                        user_display = user_name
-                        username_display = ""
-                    
-                    # Добавляем контакт если есть
-                    contact_display = f"\n   📞 Контакт: {client_contact}" if client_contact else ""
-                    
-                    schedule_text += f"🕐 <b>{time}</b> - {duration} час(а) {source}\n"
-                    schedule_text += f"   👤 {user_display} {username_display}{contact_display}\n"
-                    if user_id:
-                        schedule_text += f"   📞 ID: {user_id}\n"
-                    schedule_text += f"   📋 ID брони: {booking_id}\n\n"
-            
-            # Показываем отмененные брони
-            if cancelled_bookings or cancelled_by_admin_bookings:
-                schedule_text += "❌ <b>ОТМЕНЕННЫЕ БРОНИ:</b>\n\n"
-                all_cancelled = cancelled_bookings + cancelled_by_admin_bookings
-                for booking in all_cancelled:
-                    booking_id, user_id, user_name, time, duration, status, created_at, added_by_admin, username, client_contact = booking
-                    
-                    # Определяем источник записи
-                    source = "👤 (админ)" if added_by_admin else "🤖 (бот)"
-                    cancel_source = " (админом)" if status == 'cancelled_by_admin' else " (клиентом)"
-                    
-                    # Формируем ссылку на пользователя если есть user_id
-                    if user_id:
-                        user_display = f'<a href="tg://user?id={user_id}">{user_name}</a>'
-                        username_display = f"(@{username})" if username else ""
-                    else:
-                        user_display = user_name
-                        username_display = ""
-                    
-                    # Добавляем контакт если есть
-                    contact_display = f"\n   📞 Контакт: {client_contact}" if client_contact else ""
-                    
-                    schedule_text += f"🕐 <b>{time}</b> - {duration} час(а) {source}{cancel_source}\n"
-                    schedule_text += f"   👤 {user_display} {username_display}{contact_display}\n"
-                    if user_id:
-                        schedule_text += f"   📞 ID: {user_id}\n"
-                    schedule_text += f"   📋 ID брони: {booking_id}\n\n"
-        
-        # Добавляем информацию о свободных слотах
-        schedule_text += "\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-        schedule_text += "🆓 <b>СВОБОДНЫЕ ВРЕМЕННЫЕ СЛОТЫ</b>\n"
-        schedule_text += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
-        
-        available_times = get_available_times(selected_date)
-        if available_times:
-            for time_slot in available_times:
-                schedule_text += f"✅ {time_slot} - Свободно\n"
+            user_display = user_name
+            username_display = ""
+        
+        # Добавляем контакт если есть
+        contact_display = f"\n   📞 Контакт: {client_contact}" if client_contact else ""
+        
+        schedule_text += f"\n🕐 <b>{time}</b> - {duration} час(а) {source} {status_labels.get(status, status)}\n"
+        schedule_text += f"   👤 {user_display} {username_display}{contact_display}\n"
+        if user_id:
+            schedule_text += f"   📞 ID: {user_id}\n"
+        schedule_text += f"   📋 ID брони: {booking_id}\n"
+        
+        # Действия над записью: заявку можно подтвердить или отклонить, подтвержденную - отменить
+        if status == 'pending':
+            keyboard.append([
+                InlineKeyboardButton(f"✅ Подтвердить #{booking_id}", callback_data=list_item_callback('confirm', booking_id, 'sched', clean_date, anchor)),
+                InlineKeyboardButton(f"❌ Отклонить #{booking_id}", callback_data=list_item_callback('cancel', booking_id, 'sched', clean_date, anchor))
+            ])
+        elif status == 'confirmed':
+            keyboard.append([InlineKeyboardButton(f"❌ Отменить #{booking_id} ({time})", callback_data=list_item_callback('admin_cancel', booking_id, 'sched', clean_date, anchor))])
+    
+    # Добавляем информацию о свободных слотах
+    schedule_text += "\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+    schedule_text += "🆓 <b>СВОБОДНЫЕ ВРЕМЕННЫЕ СЛОТЫ</b>\n"
+    schedule_text += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+    
+    available_times = get_available_times(selected_date)
+    if available_times:
+        schedule_text += ", ".join(available_times) + "\n"
+    else:
+        schedule_text += "❌ На эту дату нет свободного времени.\n"
+    
+    schedule_text += f"\n💡 <b>Статистика по дате:</b>\n"
+    schedule_text += f"• ✅ Подтверждено: {status_counts.get('confirmed', 0)}\n"
+    schedule_text += f"• ⏳ Ожидание: {status_counts.get('pending', 0)}\n"
+    schedule_text += f"• ❌ Отменено: {status_counts.get('cancelled', 0) + status_counts.get('cancelled_by_admin', 0)}\n"
+    schedule_text += f"• 🆓 Свободных слотов: {len(available_times)}"
+    
+    navigation = list_page_navigation('sched', clean_date, bookings, lambda booking: (booking[3], booking[0]), has_prev, has_next)
+    if navigation:
+        keyboard.append(navigation)
+    
+    # Массовые действия над всеми записями даты (не только текущей страницы)
+    keyboard.extend(bulk_action_buttons('sched', clean_date, status_counts.get('pending', 0), status_counts.get('confirmed', 0)))
+    
+    return schedule_text, InlineKeyboardMarkup(keyboard) if keyboard else None
+
+# Страница активных записей на дату для отмены администратором
+def build_cancellation_page(clean_date, viewer_id, key=None, direction='next'):
+    formatted_date = format_date_label(clean_date)
+    session_date = to_session_date(clean_date)
+    
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT COUNT(*) FROM bookings
+        WHERE session_date = ? AND status IN ('confirmed', 'pending')
+    ''', (session_date,))
+    active_count = cursor.fetchone()[0]
+    
+    # Получаем активные бронирования страницы (подтвержденные и ожидающие)
+    bookings, has_prev, has_next = fetch_keyset_page(cursor, '''
+        SELECT b.id, b.user_id, b.user_name, b.time, b.duration, b.status, u.username, b.client_contact
+        FROM bookings b
+        LEFT JOIN users u ON b.user_id = u.user_id
+        WHERE b.session_date = ? AND b.status IN ('confirmed', 'pending')
+    ''', (session_date,), ('b.time', 'b.id'), key, direction)
+    conn.close()
+    
+    if not bookings:
+        return (
+            f'📝 На <b>{formatted_date}</b> нет активных записей для отмены.\n\n'
+            f'💡 Все записи на эту дату уже отменены или их нет.'
+        ), None
+    
+    # Сообщение с общей информацией
+    info_text = f"""❌ <b>ОТМЕНА ЗАПИСЕЙ</b>
+
+📅 <b>Дата:</b> {formatted_date}
+📋 <b>Активных записей:</b> {active_count}
+
+👇 <b>Выберите запись для отмены:</b>
+"""
+    keyboard = []
+    anchor = (bookings[0][3], bookings[0][0]) if has_prev else ()
+    
+    for booking in bookings:
+        booking_id, user_id, user_name, time, duration, status, username, client_contact = booking
+        
+        status_icon = "✅" if status == 'confirmed' else "⏳"
+        
+        # Формируем ссылку на пользователя
+        user_link = f"<a href=\"tg://user?id={user_id}\">{user_name}</a>" if user_id else user_name
+        username_display = f"@{username}" if username else "без username"
+        
+        # Добавляем контакт если есть
+        contact_display = f", 📞 {client_contact}" if client_contact else ""
+        
+        info_text += f"""
+{status_icon} <b>#{booking_id}</b> 🕐 <b>{time}</b>, {duration} час(а)
+   👤 {user_link} ({username_display}){contact_display}
+"""
+        keyboard.append([InlineKeyboardButton(f"❌ Отменить #{booking_id} ({time})", callback_data=list_item_callback('admin_cancel', booking_id, 'cancel', clean_date, anchor))])
+    
+    navigation = list_page_navigation('cancel', clean_date, bookings, lambda booking: (booking[3], booking[0]), has_prev, has_next)
+    if navigation:
+        keyboard.append(navigation)
+    
+    keyboard.extend(bulk_action_buttons('cancel', clean_date, 0, active_count))
+    
+    return info_text, InlineKeyboardMarkup(keyboard)
+
+# Страница активных броней клиента
+def build_user_bookings_page(arg, viewer_id, key=None, direction='next'):
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    
+    bookings, has_prev, has_next = fetch_keyset_page(cursor, '''
+        SELECT id, day, time, duration, status, session_date
+        FROM bookings
+        WHERE user_id = ? AND status IN ('pending', 'confirmed')
+    ''', (viewer_id,), ('session_date', 'time', 'id'), key, direction)
+    conn.close()
+    
+    if not bookings:
+        return '📝 У вас нет активных бронирований.', None
+    
+    bookings_text = "🎵 <b>ВАШИ БРОНИРОВАНИЯ</b>\n"
+    keyboard = []
+    anchor = (bookings[0][5], bookings[0][2], bookings[0][0]) if has_prev else ()
+    
+    for booking_id, day, time, duration, status, session_date in bookings:
+        status_icon = "✅" if status == 'confirmed' else "⏳"
+        status_text = "Подтверждено" if status == 'confirmed' else "Ожидание подтверждения"
+        
+        bookings_text += f"""
+{status_icon} <b>{day}</b> в <b>{time}</b>, {duration} час(а)
+   📊 {status_text}, 🆔 {booking_id}
+"""
+        keyboard.append([InlineKeyboardButton(f"❌ Отменить {day} {time}", callback_data=list_item_callback('user_cancel', booking_id, 'mybk', '', anchor))])
+    
+    navigation = list_page_navigation('mybk', '', bookings, lambda booking: (booking[5], booking[2], booking[0]), has_prev, has_next)
+    if navigation:
+        keyboard.append(navigation)
+    
+    return bookings_text, InlineKeyboardMarkup(keyboard)
+
+# Кнопки массовых действий на дату: bulk|ask|<действие>|<список для возврата>|<дата>
+def bulk_action_buttons(page_name, clean_date, pending_count, active_count):
+    buttons = []
+    if pending_count:
+        buttons.append([InlineKeyboardButton(f"✅ Подтвердить все заявки ({pending_count})", callback_data=f"bulk|ask|confirm|{page_name}|{clean_date}")])
+    if pending_count + active_count:
+        buttons.append([InlineKeyboardButton(f"🚫 Отменить все записи ({pending_count + active_count})", callback_data=f"bulk|ask|cancel|{page_name}|{clean_date}")])
+    return buttons
+
+# Постраничные списки: имя -> (функция страницы, только для администратора)
+LIST_PAGES = {
+    'sched': (build_schedule_page, True),
+    'cancel': (build_cancellation_page, True),
+    'mybk': (build_user_bookings_page, False)
+}
+
+# Формирование страницы списка по имени
+def build_list_page(name, arg, viewer_id, key=None, direction='next'):
+    builder, _ = LIST_PAGES[name]
+    return builder(arg, viewer_id, key, direction)
+
+# Листание постраничных списков (сообщение редактируется на месте)
+async def handle_list_page(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    await query.answer()
+    
+    try:
+        # pg|<список>|<next или prev>|<параметр>|<ключ крайней записи>...
+        _, name, direction, arg, *key = query.data.split('|')
+        builder, admin_only = LIST_PAGES[name]
+        
+        if admin_only and query.from_user.id != ADMIN_ID:
+            return
+        
+        key = [int(value) if value.isdigit() else value for value in key]
+        page_text, reply_markup = builder(arg, query.from_user.id, key, direction)
+        await query.edit_message_text(page_text, parse_mode='HTML', reply_markup=reply_markup)
+        
+    except Exception as e:
+        logger.error(f"Error in handle_list_page: {e}")
+
+# Обработка ввода диапазона дат для админ расписания
+async def handle_admin_schedule_range(update: Update, context: CallbackContext) -> int:
+    user_id = update.message.from_user.id
+    user_input = update.message.text
+    
+    if user_id != ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет доступа к админ-панели")
+        return ConversationHandler.END
+    
+    if user_input == '🔙 Назад':
+        await show_admin_schedule_menu(update, context)
+        return ADMIN_SCHEDULE_MENU
+    
+    try:
+        start_text, end_text = [part.strip() for part in user_input.split('-')]
+        start_date = datetime.strptime(start_text, "%d.%m.%Y").date()
+        end_date = datetime.strptime(end_text, "%d.%m.%Y").date()
+    except ValueError:
+        await update.message.reply_text(
+            '❌ Неправильный формат диапазона.\n'
+            'Пожалуйста, введите даты в формате <b>ДД.ММ.ГГГГ - ДД.ММ.ГГГГ</b>\n'
+            'Например: 22.12.2024 - 28.12.2024',
+            parse_mode='HTML',
+            reply_markup=BACK_KEYBOARD
+        )
+        return ADMIN_SCHEDULE_RANGE
+    
+    if end_date < start_date or (end_date - start_date).days >= SCHEDULE_RANGE_MAX_DAYS:
+        await update.message.reply_text(
+            f'❌ Конечная дата должна быть не раньше начальной, а диапазон - не больше {SCHEDULE_RANGE_MAX_DAYS} дней.\n'
+            'Пожалуйста, введите другой диапазон:',
+            reply_markup=BACK_KEYBOARD
+        )
+        return ADMIN_SCHEDULE_RANGE
+    
+    await show_admin_schedule_range(update, context, start_date, end_date)
+    return ConversationHandler.END
+
+# Максимальная длина диапазона админ расписания (в днях)
+SCHEDULE_RANGE_MAX_DAYS = 31
+
+# Получение расписания за диапазон дат одним запросом
+def get_schedule_range(start_date, end_date):
+    """Один проход по индексу (session_date, time): брони группируются по дням сразу при чтении.
+    Возвращает список дней диапазона (включая пустые) с активными бронями и итогами"""
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT id, session_date, time, duration, status, user_name, added_by_admin
+        FROM bookings
+        WHERE session_date BETWEEN ? AND ?
+        ORDER BY session_date, time
+    ''', (start_date.isoformat(), end_date.isoformat()))
+    
+    days = {}
+    for offset in range((end_date - start_date).days + 1):
+        date = start_date + timedelta(days=offset)
+        days[date.isoformat()] = {
+            'date': date, 'bookings': [], 'confirmed': 0, 'pending': 0, 'cancelled': 0, 'booked_slots': []
+        }
+    
+    for booking_id, session_date, time, duration, status, user_name, added_by_admin in cursor:
+        day = days[session_date]
+        
+        if status in ('cancelled', 'cancelled_by_admin'):
+            day['cancelled'] += 1
+            continue
+        
+        day[status] += 1
+        day['bookings'].append((booking_id, time, duration, status, user_name, added_by_admin))
+        
+        if status == 'confirmed':
+            day['booked_slots'].append((time, duration))
+    
+    conn.close()
+    
+    # Занятое и рабочее время дня - по сетке его часов работы (закрытый день: емкость 0)
+    for day in days.values():
+        capacity = build_day_capacity(StudioDate.from_date(day['date']), day.pop('booked_slots'))
+        day['is_open'] = capacity is not None
+        _, open_mask, booked_mask = capacity or (None, 0, 0)
+        day['booked_hours'] = slots_to_hours(bin(booked_mask).count('1'))
+        day['capacity_hours'] = slots_to_hours(bin(open_mask).count('1'))
+    
+    return list(days.values())
+
+# Формирование компактного отчета по диапазону дат (список сообщений не длиннее лимита Telegram)
+def format_schedule_range(days, message_limit=4000):
+    short_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+    total_confirmed = sum(day['confirmed'] for day in days)
+    total_pending = sum(day['pending'] for day in days)
+    total_hours = sum(day['booked_hours'] for day in days)
+    capacity = sum(day['capacity_hours'] for day in days)
+    
+    header = f"""📆 <b>РАСПИСАНИЕ {days[0]['date'].strftime('%d.%m.%Y')} - {days[-1]['date'].strftime('%d.%m.%Y')}</b>
+
+• ✅ Подтверждено: <b>{total_confirmed}</b>, ⏳ ожидает: <b>{total_pending}</b>
+• ⏱️ Занято часов: <b>{total_hours:g}</b> из {capacity:g} ({round(total_hours / capacity * 100) if capacity else 0}%)
+"""
+    
+    blocks = []
+    for day in days:
+        block = f"\n📅 <b>{short_names[day['date'].weekday()]} {day['date'].strftime('%d.%m')}</b>"
+        if not day['bookings']:
+            block += " - свободно" if day['is_open'] else " - студия не работает"
         else:
-            schedule_text += "❌ На эту дату нет свободного времени.\n"
+            fill = round(day['booked_hours'] / day['capacity_hours'] * 100) if day['capacity_hours'] else 0
+            block += f" - {day['booked_hours']} ч ({fill}%)"
+        if day['cancelled']:
+            block += f", отмен: {day['cancelled']}"
+        block += "\n"
+        
+        for booking_id, time, duration, status, user_name, added_by_admin in day['bookings']:
+            end = clock_minutes(time) + duration * 60
+            icon = "✅" if status == 'confirmed' else "⏳"
+            source = " 👤" if added_by_admin else ""
+            block += f"{icon} {time}-{end // 60:02d}:{end % 60:02d} {user_name}{source} #{booking_id}\n"
+        
+        blocks.append(block)
+    
+    # Длинный диапазон делится на несколько сообщений по границам дней,
+    # а день, который сам не помещается в сообщение, - по строкам
+    messages = [header]
+    for block in blocks:
+        if len(messages[-1]) + len(block) > message_limit:
+            messages.append("")
+        for line in block.splitlines(keepends=True):
+            if len(messages[-1]) + len(line) > message_limit:
+                messages.append("")
+            messages[-1] += line
+    
+    return messages
+
+# Показ админ расписания за диапазон дат
+async def show_admin_schedule_range(update: Update, context: CallbackContext, start_date, end_date):
+    user_id = update.message.from_user.id
+    
+    if user_id != ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет доступа к админ-панели")
+        return
+    
+    try:
+        days = get_schedule_range(start_date, end_date)
         
-        # Статистика по дате
-        confirmed_count = len([b for b in bookings if b[5] == 'confirmed'])
-        pending_count = len([b for b in bookings if b[5] == 'pending'])
-        cancelled_count = len([b for b in bookings if b[5] in ['cancelled', 'cancelled_by_admin']])
+        for message_text in format_schedule_range(days):
+            await update.message.reply_text(message_text, parse_mode='HTML')
         
-        schedule_text += f"\n💡 <b>Статистика по дате:</b>\n"
-        schedule_text += f"• ✅ Подтверждено: {confirmed_count}\n"
-        schedule_text += f"• ⏳ Ожидание: {pending_count}\n"
-        schedule_text += f"• ❌ Отменено: {cancelled_count}\n"
-        schedule_text += f"• 🆓 Свободных слотов: {len(available_times)}"
+        await update.message.reply_text(
+            "💡 <b>Что дальше?</b>\n\n"
+            "📋 Подробности и действия с записями - в расписании на конкретную дату\n"
+            "🔙 <b>Главное меню</b> - вернуться к основному меню",
+            parse_mode='HTML',
+            reply_markup=ReplyKeyboardMarkup([['🔙 Главное меню']], resize_keyboard=True)
+        )
         
-        await update.message.reply_text(schedule_text, parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"Error in show_admin_schedule_range: {e}")
+        await update.message.reply_text(
+            "❌ Произошла ошибка при загрузке расписания.",
+            reply_markup=get_main_keyboard(user_id)
+        )
+
+# Показ расписания для конкретной даты (админ версия) - ИСПРАВЛЕННАЯ ВЕРСИЯ
+async def show_admin_schedule_for_date(update: Update, context: CallbackContext, selected_date: str):
+    user_id = update.message.from_user.id
+    
+    if user_id != ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет доступа к админ-панели")
+        return
+    
+    try:
+        clean_date = StudioDate.parse(selected_date).clean
+        
+        # Расписание - одна страница в одном сообщении, листание редактирует его
+        schedule_text, reply_markup = build_list_page('sched', clean_date, user_id)
+        await update.message.reply_text(schedule_text, parse_mode='HTML', reply_markup=reply_markup)
         
         # ИСПРАВЛЕНИЕ ЗАДАЧИ 3: Заменяем кнопку "Назад в админ-панель" на "Главное меню"
         action_keyboard = [
@@ -2566,7 +5275,7 @@ async def show_cancel_booking_menu(update: Update, context: CallbackContext) ->
         "Например: 25.12.2024\n\n"
         "📝 Введите дату в указанном формате:",
         parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+        reply_markup=BACK_KEYBOARD
     )
     
     return ADMIN_CANCEL_DAY
@@ -2593,19 +5302,14 @@ async def handle_admin_cancel_date(update: Update, context: CallbackContext) ->
             await update.message.reply_text(
                 '❌ Нельзя отменять прошедшие записи.\n'
                 'Пожалуйста, введите сегодняшнюю или будущую дату:',
-                reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                reply_markup=BACK_KEYBOARD
             )
             return ADMIN_CANCEL_DAY
         
-        # Форматируем дату для отображения
-        date_str = selected_date.strftime("%d.%m.%Y")
-        day_name = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"][selected_date.weekday()]
-        
-        # Добавляем пометку "Сегодня" если это сегодняшняя дата
-        if selected_date.date() == today.date():
-            formatted_date = f"{date_str} ({day_name}) - Сегодня"
-        else:
-            formatted_date = f"{date_str} ({day_name})"
+        # Подпись даты для отображения (для сегодняшней - с пометкой "Сегодня")
+        studio_date = StudioDate.from_date(selected_date.date())
+        date_str = studio_date.clean
+        formatted_date = studio_date.label
         
         # Сохраняем дату в контексте
         context.user_data['admin_cancel_date'] = formatted_date
@@ -2621,139 +5325,64 @@ async def handle_admin_cancel_date(update: Update, context: CallbackContext) ->
             'Пожалуйста, введите дату в формате <b>ДД.ММ.ГГГГ</b>\n'
             'Например: 25.12.2024',
             parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+            reply_markup=BACK_KEYBOARD
         )
         return ADMIN_CANCEL_DAY
 
 # Показ записей для отмены
 async def show_bookings_for_cancellation(update: Update, context: CallbackContext, formatted_date: str, clean_date: str):
-    try:
-        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
-        cursor = conn.cursor()
-        
-        # Получаем все активные бронирования на эту дату (подтвержденные и ожидающие)
-        cursor.execute('''
-            SELECT b.id, b.user_id, b.user_name, b.time, b.duration, b.status, u.username, b.client_contact
-            FROM bookings b
-            LEFT JOIN users u ON b.user_id = u.user_id
-            WHERE b.day = ? AND b.status IN ('confirmed', 'pending')
-            ORDER BY b.time
-        ''', (clean_date,))
-        
-        bookings = cursor.fetchall()
-        conn.close()
-        
-        if not bookings:
-            await update.message.reply_text(
-                f'📝 На <b>{formatted_date}</b> нет активных записей для отмены.\n\n'
-                f'💡 Все записи на эту дату уже отменены или их нет.',
-                parse_mode='HTML',
-                reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
-            )
-            return
-        
-        # Сообщение с общей информацией
-        info_text = f"""❌ <b>ОТМЕНА ЗАПИСЕЙ</b>
-
-📅 <b>Дата:</b> {formatted_date}
-📋 <b>Активных записей:</b> {len(bookings)}
-
-👇 <b>Выберите запись для отмены:</b>"""
-        
-        await update.message.reply_text(
-            info_text,
-            parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
-        )
-        
-        # Показываем каждую запись отдельным сообщением с кнопкой отмены
-        for booking in bookings:
-            booking_id, user_id, user_name, time, duration, status, username, client_contact = booking
-            
-            status_icon = "✅" if status == 'confirmed' else "⏳"
-            status_text = "Подтверждена" if status == 'confirmed' else "Ожидает подтверждения"
-            
-            # Формируем ссылку на пользователя
-            user_link = f"<a href=\"tg://user?id={user_id}\">{user_name}</a>" if user_id else user_name
-            username_display = f"@{username}" if username else "без username"
-            
-            # Добавляем контакт если есть
-            contact_display = f"\n📞 <b>Контакт:</b> {client_contact}" if client_contact else ""
-            
-            booking_text = f"""{status_icon} <b>ЗАПИСЬ #{booking_id}</b>
-
-👤 <b>Клиент:</b> {user_link}
-📱 <b>Telegram:</b> {username_display}{contact_display}
-🕐 <b>Время:</b> {time}
-⏱ <b>Продолжительность:</b> {duration} час(а)
-📊 <b>Статус:</b> {status_text}
-🆔 <b>ID клиента:</b> {user_id if user_id else 'N/A'}"""
-            
-            # Создаем кнопку отмены для каждой записи
-            keyboard = [
-                [InlineKeyboardButton("❌ Отменить эту запись", callback_data=f"admin_cancel_{booking_id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                booking_text,
-                parse_mode='HTML',
-                reply_markup=reply_markup
-            )
+    try:
+        # Все записи страницы - одним сообщением с кнопкой отмены у каждой
+        info_text, reply_markup = build_list_page('cancel', clean_date, update.message.from_user.id)
+        await update.message.reply_text(info_text, parse_mode='HTML', reply_markup=reply_markup)
         
-        # Финальное сообщение с инструкцией
+        # Инструкция с кнопкой возврата к выбору даты
         await update.message.reply_text(
             "💡 <b>Как отменить запись:</b>\n\n"
-            "1. Найдите нужную запись выше\n"
-            "2. Нажмите кнопку <b>❌ Отменить эту запись</b>\n"
-            "3. Подтвердите отмену\n"
-            "4. Клиент получит уведомление об отмене\n\n"
+            "1. Найдите нужную запись в списке выше (◀️ ▶️ - другие страницы)\n"
+            "2. Нажмите кнопку <b>❌ Отменить</b> с ее номером\n"
+            "3. Клиент получит уведомление об отмене\n\n"
             "🔄 Время записи станет доступным для бронирования другим клиентам.",
-            parse_mode='HTML'
+            parse_mode='HTML',
+            reply_markup=BACK_KEYBOARD
         )
         
     except Exception as e:
         logger.error(f"Error in show_bookings_for_cancellation: {e}")
         await update.message.reply_text(
             "❌ Произошла ошибка при загрузке записей.",
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+            reply_markup=BACK_KEYBOARD
         )
 
 # Обработка отмены записи администратором - ИСПРАВЛЕНА ДЛЯ ЗАДАЧИ 1
 async def handle_admin_cancellation(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
-    await query.answer()
     
-    booking_id = int(query.data.split('_')[2])
-    
-    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
-    cursor = conn.cursor()
+    if is_duplicate_callback(query):
+        await query.answer()
+        return
     
-    # Получаем полную информацию о бронировании
-    cursor.execute('''
-        SELECT b.user_id, b.user_name, b.day, b.time, b.duration, b.status, u.username, b.client_contact
-        FROM bookings b
-        LEFT JOIN users u ON b.user_id = u.user_id
-        WHERE b.id = ?
-    ''', (booking_id,))
+    _, booking_id, _ = parse_booking_callback(query.data)
     
-    booking = cursor.fetchone()
+    # Обновляем статус брони на "отменено администратором" (если она еще активна)
+    booking, applied = transition_booking(booking_id, 'cancelled_by_admin')
     
     if not booking:
-        await query.edit_message_text("❌ Запись не найдена")
-        conn.close()
+        await query.answer()
+        await show_booking_action_result(query, "❌ Запись не найдена")
         return
     
     user_id, user_name, day, time, duration, status, username, client_contact = booking
     
-    # Обновляем статус брони на "отменено администратором"
-    cursor.execute('UPDATE bookings SET status = ? WHERE id = ?', ('cancelled_by_admin', booking_id))
-    conn.commit()
-    conn.close()
+    if not applied:
+        await answer_stale_booking(query, booking_id, status)
+        return
     
-    # Обновляем статистику бронирований пользователя
-    if user_id:
-        update_user_booking_stats(user_id)
+    await query.answer()
+    
+    # Напоминания по отмененной брони больше не нужны
+    if context.job_queue:
+        remove_booking_jobs(context.job_queue, booking_id)
     
     # Сообщение администратору об успешной отмене
     admin_success_text = f"""✅ <b>ЗАПИСЬ ОТМЕНЕНА</b>
@@ -2769,31 +5398,12 @@ async def handle_admin_cancellation(update: Update, context: CallbackContext) ->
 ✅ <i>Запись отменена. Время стало доступным для бронирования.</i>
 📞 <i>Клиент уведомлен об отмене.</i>"""
     
-    await query.edit_message_text(
-        admin_success_text,
-        parse_mode='HTML'
-    )
+    await show_booking_action_result(query, admin_success_text)
     
     # ИСПРАВЛЕНИЕ ЗАДАЧИ 1: Убираем кнопку "В главное меню" из сообщения клиенту
     if user_id:
         try:
-            client_message = f"""😔 <b>ВАША ЗАПИСЬ ОТМЕНЕНА АДМИНИСТРАТОРОМ</b>
-
-📅 <b>Дата:</b> {day}
-🕐 <b>Время:</b> {time}
-⏱ <b>Продолжительность:</b> {duration} час(а)
-
-💡 <b>Что делать дальше?</b>
-
-🎵 <b>Забронируйте новое время</b> - выберите удобное время для записи
-📞 <b>Свяжитесь с администратором</b> - для уточнения деталей
-
-📱 <b>Контакты:</b>
-Телефон: +7 (918) 880-52-92
-Telegram: @Solnyshkin_Mikhail
-
-🙏 <i>Приносим извинения за доставленные неудобства!</i>
-🎶 <i>Надеемся увидеть вас в нашей студии в другое время!</i>"""
+            client_message = render_template('booking_cancelled_by_admin', day=day, time=time, duration=duration)
             
             await context.bot.send_message(
                 chat_id=user_id,
@@ -2832,6 +5442,420 @@ Telegram: @Solnyshkin_Mikhail
         reply_markup=reply_markup
     )
 
+# Массовые действия: из каких статусов и в какой переводятся записи даты
+BULK_ACTIONS = {
+    'confirm': (('pending',), 'confirmed'),
+    'cancel': (('pending', 'confirmed'), 'cancelled_by_admin')
+}
+
+# Сколько записей перечислять в отчете о массовом действии (ограничение длины сообщения)
+BULK_LIST_LIMIT = 40
+
+# Массовая смена статуса всех записей на дату одной транзакцией
+def bulk_update_bookings(clean_date, action):
+    """Возвращает измененные записи: (id, user_id, user_name, day, time, duration, старый статус)"""
+    from_statuses, new_status = BULK_ACTIONS[action]
+    placeholders = ', '.join('?' * len(from_statuses))
+    
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    
+    try:
+        # Блокировка на запись сразу: между выборкой и обновлением статусы не изменятся
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute(f'''
+            SELECT id, user_id, user_name, day, time, duration, status
+            FROM bookings
+            WHERE session_date = ? AND status IN ({placeholders})
+            ORDER BY time, id
+        ''', (to_session_date(clean_date),) + from_statuses)
+        bookings = cursor.fetchall()
+        
+        if bookings:
+            cursor.executemany('UPDATE bookings SET status = ? WHERE id = ? AND status = ?', [(new_status, booking[0], booking[6]) for booking in bookings])
+            record_booking_transitions(cursor, [
+                (day, time, duration, user_id, user_name, status, new_status)
+                for _, user_id, user_name, day, time, duration, status in bookings
+            ])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    if bookings:
+        mark_bookings_changed(*(booking[0] for booking in bookings))
+    
+    print(f"📦 Массовое действие '{action}' на {clean_date}: изменено записей {len(bookings)}")
+    return bookings
+
+# Обработка массовых действий администратора над записями на дату
+async def handle_bulk_action(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    
+    if is_duplicate_callback(query):
+        await query.answer()
+        return
+    
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    try:
+        # bulk|<ask, do или back>|<confirm или cancel>|<список для возврата>|<дата>
+        _, step, action, page_name, clean_date = query.data.split('|')
+        formatted_date = format_date_label(clean_date)
+        
+        if step == 'back':
+            page_text, reply_markup = build_list_page(page_name, clean_date, ADMIN_ID)
+            await query.edit_message_text(page_text, parse_mode='HTML', reply_markup=reply_markup)
+            return
+        
+        if step == 'ask':
+            if action == 'confirm':
+                question = f"✅ <b>Подтвердить все ожидающие заявки на {formatted_date}?</b>"
+            else:
+                question = (f"🚫 <b>Отменить все записи на {formatted_date}?</b>\n\n"
+                            f"Подтвержденные записи и заявки будут отменены, клиенты получат уведомление.")
+            
+            keyboard = [[
+                InlineKeyboardButton("✅ Да", callback_data=f"bulk|do|{action}|{page_name}|{clean_date}"),
+                InlineKeyboardButton("🔙 Нет", callback_data=f"bulk|back|{action}|{page_name}|{clean_date}")
+            ]]
+            await query.edit_message_text(question, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
+            return
+        
+        bookings = bulk_update_bookings(clean_date, action)
+        
+        if not bookings:
+            await query.edit_message_text(f"📝 На <b>{formatted_date}</b> нет записей для этого действия.", parse_mode='HTML')
+            return
+        
+        # Задачи по всем броням снимаются и ставятся одним проходом
+        if context.job_queue:
+            for booking_id, user_id, _, day, time, duration, _ in bookings:
+                remove_booking_jobs(context.job_queue, booking_id)
+                if action == 'confirm' and user_id:
+                    schedule_client_reminders(context.job_queue, booking_id, user_id, day, time, duration)
+        
+        template_name = 'booking_confirmed' if action == 'confirm' else 'booking_cancelled_by_admin'
+        messages = [
+            (user_id, render_template(template_name, day=day, time=time, duration=duration))
+            for _, user_id, _, day, time, duration, _ in bookings if user_id
+        ]
+        
+        title = "✅ <b>ЗАЯВКИ ПОДТВЕРЖДЕНЫ</b>" if action == 'confirm' else "🚫 <b>ЗАПИСИ ОТМЕНЕНЫ</b>"
+        result_text = f"{title}\n\n📅 <b>Дата:</b> {formatted_date}\n📋 <b>Записей:</b> {len(bookings)}\n"
+        for booking_id, _, user_name, _, time, duration, _ in bookings[:BULK_LIST_LIMIT]:
+            result_text += f"\n🕐 {time}, {duration} ч - {user_name} #{booking_id}"
+        if len(bookings) > BULK_LIST_LIMIT:
+            result_text += f"\n... и еще {len(bookings) - BULK_LIST_LIMIT}"
+        
+        await query.edit_message_text(
+            result_text + f"\n\n🔄 <i>Уведомляю клиентов: {len(messages)}...</i>",
+            parse_mode='HTML'
+        )
+        
+        failed = await send_notifications(context.bot, messages)
+        
+        result_text += f"\n\n📨 <b>Клиентов уведомлено:</b> {len(messages) - len(failed)} из {len(messages)}"
+        if failed:
+            result_text += "\n⚠️ <i>Не удалось уведомить: " + ", ".join(str(chat_id) for chat_id in failed) + "</i>"
+        
+        await query.edit_message_text(result_text, parse_mode='HTML')
+        
+    except Exception as e:
+        logger.error(f"Error in handle_bulk_action: {e}")
+        await query.edit_message_text("❌ Произошла ошибка при выполнении массового действия.")
+
+# Сессии серий регулярных записей вносятся в расписание на столько дней вперед
+RECURRING_MATERIALIZE_DAYS = 28
+
+# Время ежедневного продления серий
+RECURRING_MATERIALIZE_TIME = dt_time(3, 30, tzinfo=datetime.now().astimezone().tzinfo)
+
+# Сколько дат перечислять в сообщениях о сериях
+RECURRING_LIST_LIMIT = 10
+
+# Даты сессий серии позже after и не позже until: каждые interval_weeks недель от первой сессии
+def series_dates(start_date, interval_weeks, after, until):
+    step = timedelta(weeks=interval_weeks)
+    current = start_date + step * max((after - start_date) // step + 1, 0)
+    while current <= until:
+        yield current
+        current += step
+
+# Строки списка сессий серий для сообщений
+def format_series_slots(slots):
+    lines = [f"• {slot.day.clean} ({slot.day.weekday_name}) {slot.time}" for slot in slots[:RECURRING_LIST_LIMIT]]
+    if len(slots) > RECURRING_LIST_LIMIT:
+        lines.append(f"... и еще {len(slots) - RECURRING_LIST_LIMIT}")
+    return "\n".join(lines)
+
+# Создание серии еженедельных записей по подтвержденной брони
+def create_recurring_series(booking_id, interval_weeks=1):
+    """Серия начинается с этой брони. Все ее даты до горизонта записи проверяются одной пачкой.
+    Возвращает (id серии, user_id клиента, первая сессия, сессии с пересечениями)
+    или (None, None, None, []), если бронь не подтверждена или уже в серии"""
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT user_id, user_name, client_contact, time, duration, session_date, added_by_admin
+            FROM bookings
+            WHERE id = ? AND status = 'confirmed' AND series_id IS NULL
+        ''', (booking_id,))
+        booking = cursor.fetchone()
+        
+        if not booking:
+            conn.rollback()
+            return None, None, None, []
+        
+        user_id, user_name, client_contact, time, duration, session_date, added_by_admin = booking
+        start_date = datetime.strptime(session_date, "%Y-%m-%d").date()
+        today = datetime.now().date()
+        first_slot = SessionSlot(StudioDate.from_date(start_date), time, duration)
+        
+        slots = [
+            SessionSlot(StudioDate.from_date(date), time, duration)
+            for date in series_dates(start_date, interval_weeks, max(start_date, today - timedelta(days=1)), today + timedelta(days=BOOKING_HORIZON_DAYS))
+        ]
+        conflicts = [slot for slot, fit in zip(slots, check_slots_batch(slots)) if not fit]
+        
+        # Сессии после первой вносятся в расписание отдельно, по мере приближения
+        cursor.execute('''
+            INSERT INTO recurring_series (user_id, user_name, client_contact, time, duration, interval_weeks, start_date, materialized_until, created_at, added_by_admin)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, user_name, client_contact, time, duration, interval_weeks, session_date, session_date, get_current_time(), added_by_admin))
+        series_id = cursor.lastrowid
+        cursor.execute('UPDATE bookings SET series_id = ? WHERE id = ?', (series_id, booking_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    print(f"🔁 Серия #{series_id} создана по брони {booking_id}: дат с пересечениями до горизонта {len(conflicts)}")
+    return series_id, user_id, first_slot, conflicts
+
+# Внесение сессий активных серий в расписание до горизонта RECURRING_MATERIALIZE_DAYS
+def materialize_recurring_series(series_id=None):
+    """Сессии создаются по мере приближения дат, а не все сразу. Сессии всех серий проверяются
+    одной пачкой, даты с пересечениями пропускаются. Прошедшие даты (если бот не работал) не вносятся.
+    Возвращает (внесенные, пропущенные) - списки (id брони или None, id серии, user_id, user_name, SessionSlot)"""
+    today = datetime.now().date()
+    until = today + timedelta(days=RECURRING_MATERIALIZE_DAYS)
+    
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    
+    try:
+        # Блокировка на запись сразу: два продления не внесут одну сессию дважды
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT id, user_id, user_name, client_contact, time, duration, interval_weeks, start_date, materialized_until, added_by_admin
+            FROM recurring_series
+            WHERE status = 'active' AND materialized_until < ? AND (? IS NULL OR id = ?)
+        ''', (until.isoformat(), series_id, series_id))
+        series_rows = cursor.fetchall()
+        
+        pending = []
+        for row in series_rows:
+            start_date, materialized_until = (datetime.strptime(value, "%Y-%m-%d").date() for value in row[7:9])
+            for date in series_dates(start_date, row[6], max(materialized_until, today - timedelta(days=1)), until):
+                pending.append((SessionSlot(StudioDate.from_date(date), row[4], row[5]), row))
+        pending.sort(key=lambda item: (item[0].day.date, item[0].start_minutes))
+        
+        created, skipped, transitions = [], [], []
+        for (slot, row), fit in zip(pending, check_slots_batch([slot for slot, _ in pending])):
+            series, user_id, user_name, client_contact = row[:4]
+            if not fit:
+                skipped.append((None, series, user_id, user_name, slot))
+                continue
+            
+            cursor.execute('''
+                INSERT INTO bookings (user_id, user_name, day, time, duration, status, created_at, added_by_admin, client_contact, session_date, series_id)
+                VALUES (?, ?, ?, ?, ?, 'confirmed', ?, ?, ?, ?, ?)
+            ''', (user_id, user_name, slot.day.clean, slot.time, slot.duration, get_current_time(), row[9], client_contact, slot.day.iso, series))
+            created.append((cursor.lastrowid, series, user_id, user_name, slot))
+            transitions.append((slot.day.clean, slot.time, slot.duration, user_id, user_name, None, 'confirmed'))
+        
+        record_booking_transitions(cursor, transitions)
+        cursor.executemany('UPDATE recurring_series SET materialized_until = ? WHERE id = ?', [(until.isoformat(), row[0]) for row in series_rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    if created:
+        mark_bookings_changed(*(booking[0] for booking in created))
+    
+    print(f"🔁 Серии продлены до {until.strftime('%d.%m.%Y')}: внесено {len(created)}, пропущено из-за пересечений {len(skipped)}")
+    return created, skipped
+
+# Остановка серии: новые сессии больше не вносятся, внесенные по серии будущие (со следующего дня) отменяются.
+# Бронь, с которой началась серия, остается
+def stop_recurring_series(series_id):
+    """Возвращает отмененные брони (id, user_id, user_name, day, time, duration, старый статус)
+    или None, если серия уже остановлена"""
+    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute("UPDATE recurring_series SET status = 'stopped' WHERE id = ? AND status = 'active'", (series_id,))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return None
+        
+        cursor.execute('SELECT start_date FROM recurring_series WHERE id = ?', (series_id,))
+        cancel_after = max(cursor.fetchone()[0], datetime.now().date().isoformat())
+        
+        cursor.execute('''
+            SELECT id, user_id, user_name, day, time, duration, status
+            FROM bookings
+            WHERE series_id = ? AND session_date > ? AND status IN ('pending', 'confirmed')
+            ORDER BY session_date, time
+        ''', (series_id, cancel_after))
+        bookings = cursor.fetchall()
+        
+        cursor.executemany("UPDATE bookings SET status = 'cancelled_by_admin' WHERE id = ? AND status = ?", [(booking[0], booking[6]) for booking in bookings])
+        record_booking_transitions(cursor, [
+            (day, time, duration, user_id, user_name, status, 'cancelled_by_admin')
+            for _, user_id, user_name, day, time, duration, status in bookings
+        ])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    if bookings:
+        mark_bookings_changed(*(booking[0] for booking in bookings))
+    
+    print(f"⏹ Серия #{series_id} остановлена: отменено будущих сессий {len(bookings)}")
+    return bookings
+
+# Кнопка "повторять каждую неделю" для подтвержденной брони
+def recurring_series_button(booking_id):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🔁 Повторять каждую неделю", callback_data=f"series|new|{booking_id}")]])
+
+# Создание и остановка серий регулярных записей (кнопки администратора)
+async def handle_recurring_series(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    
+    if is_duplicate_callback(query):
+        await query.answer()
+        return
+    
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    try:
+        # series|<new или stop>|<id брони или серии>
+        _, action, value = query.data.split('|')
+        
+        if action == 'new':
+            series_id, user_id, first_slot, conflicts = create_recurring_series(int(value))
+            if series_id is None:
+                await query.edit_message_reply_markup(reply_markup=None)
+                await query.message.reply_text("❌ Бронь уже не подтверждена или повторяется в другой серии.")
+                return
+            
+            created, _ = materialize_recurring_series(series_id)
+            
+            if context.job_queue:
+                for booking_id, _, user_id, _, slot in created:
+                    if user_id:
+                        schedule_client_reminders(context.job_queue, booking_id, user_id, slot.day.clean, slot.time, slot.duration)
+            
+            await query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton(f"⏹ Остановить серию #{series_id}", callback_data=f"series|stop|{series_id}")]
+            ]))
+            
+            result_text = (f"🔁 <b>СЕРИЯ #{series_id} СОЗДАНА</b>\n\n"
+                           f"📅 Сессии внесены в расписание на {RECURRING_MATERIALIZE_DAYS} дней вперед: {len(created)}\n"
+                           f"🔄 Следующие будут добавляться автоматически\n")
+            if created:
+                result_text += "\n" + format_series_slots([slot for *_, slot in created]) + "\n"
+            if conflicts:
+                result_text += (f"\n⚠️ <b>Занятые даты будут пропущены</b> (в ближайшие {BOOKING_HORIZON_DAYS} дней):\n"
+                                + format_series_slots(conflicts))
+            
+            await query.message.reply_text(result_text, parse_mode='HTML')
+            
+            # Клиент узнает о серии, даже если ближайшие даты заняты и ничего еще не внесено
+            if user_id:
+                client_text = (f"🔁 <b>ВАША ЗАПИСЬ ТЕПЕРЬ ПОВТОРЯЕТСЯ КАЖДУЮ НЕДЕЛЮ</b>\n\n"
+                               f"📅 <b>День:</b> {first_slot.day.weekday_name}\n"
+                               f"⏰ <b>Время:</b> {first_slot.time}\n"
+                               f"⏱️ <b>Продолжительность:</b> {first_slot.duration} ч\n")
+                if created:
+                    client_text += f"\n📅 Ближайшие сессии:\n{format_series_slots([slot for *_, slot in created])}"
+                else:
+                    client_text += "\n🔄 Сессии будут появляться в расписании по мере приближения дат"
+                await send_notifications(context.bot, [(user_id, client_text)])
+            return
+        
+        bookings = stop_recurring_series(int(value))
+        await query.edit_message_reply_markup(reply_markup=None)
+        
+        if bookings is None:
+            await query.message.reply_text(f"📝 Серия #{value} уже остановлена.")
+            return
+        
+        if context.job_queue:
+            for booking in bookings:
+                remove_booking_jobs(context.job_queue, booking[0])
+        
+        messages = [
+            (user_id, render_template('booking_cancelled_by_admin', day=day, time=time, duration=duration))
+            for _, user_id, _, day, time, duration, _ in bookings if user_id
+        ]
+        failed = await send_notifications(context.bot, messages)
+        
+        await query.message.reply_text(
+            f"⏹ <b>СЕРИЯ #{value} ОСТАНОВЛЕНА</b>\n\n"
+            f"🚫 Отменено будущих сессий: {len(bookings)}\n"
+            f"📨 Клиентов уведомлено: {len(messages) - len(failed)} из {len(messages)}",
+            parse_mode='HTML'
+        )
+        
+    except Exception as e:
+        logger.error(f"Error in handle_recurring_series: {e}")
+
+# Ежедневное продление серий: сессии вносятся в расписание, администратор узнает о пропущенных датах
+async def extend_recurring_series(context: CallbackContext):
+    try:
+        created, skipped = materialize_recurring_series()
+        
+        if context.job_queue:
+            for booking_id, _, user_id, _, slot in created:
+                if user_id:
+                    schedule_client_reminders(context.job_queue, booking_id, user_id, slot.day.clean, slot.time, slot.duration)
+        
+        if skipped:
+            await context.bot.send_message(
+                chat_id=ADMIN_ID,
+                text="⚠️ <b>СЕССИИ СЕРИЙ ПРОПУЩЕНЫ - ВРЕМЯ ЗАНЯТО</b>\n\n" + "\n".join(
+                    f"• #{series_id} {user_name}: {slot.day.clean} ({slot.day.weekday_name}) {slot.time}"
+                    for _, series_id, _, user_name, slot in skipped[:RECURRING_LIST_LIMIT]
+                ),
+                parse_mode='HTML'
+            )
+    except Exception as e:
+        logger.error(f"Error in extend_recurring_series: {e}")
+
 # Обработка кнопки "В главное меню" после отмены администратором
 async def handle_to_main_menu_from_cancel(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
@@ -2892,59 +5916,33 @@ async def handle_start_booking_from_cancel(update: Update, context: CallbackCont
         chat_id=user_id,
         text='🎵 <b>ВЫБЕРИТЕ ТИП БРОНИРОВАНИЯ</b>\n\n'
              '📅 <b>Забронировать на ближайшую дату</b> - выбор из ближайших 7 дней (включая сегодня)\n'
-             '🗓️ <b>Забронировать на другую дату</b> - ввод любой даты вручную\n'
+             '🗓️ <b>Забронировать на другую дату</b> - выбор в календаре или ввод даты вручную\n'
              '📋❌ <b>Мои брони/Отменить запись</b> - просмотр и управление вашими записями',
         parse_mode='HTML',
         reply_markup=reply_markup
     )
 
-# Обработка действий в админ-панели - ОБНОВЛЕНА
-async def handle_admin_actions_panel(update: Update, context: CallbackContext) -> None:
-    user_id = update.message.from_user.id
-    text = update.message.text
-    
-    # Проверяем, является ли пользователь администратором
-    if user_id != ADMIN_ID:
-        await update.message.reply_text("❌ У вас нет доступа к админ-панели")
-        return
+# Запрос даты для админ расписания из админ-панели
+async def ask_admin_schedule_date(update: Update, context: CallbackContext) -> None:
+    # Очищаем состояние перед новым вводом даты
+    if 'admin_schedule_date' in context.user_data:
+        context.user_data.pop('admin_schedule_date')
     
-    if text == '📊 Статистика пользователей':
-        await show_user_statistics(update, context)
-    elif text == '📈 Аналитика':
-        await show_analytics_menu(update, context)
-    elif text == '📢 Рассылка':
-        await show_broadcast_menu(update, context)
-    elif text == '🗓️ Админ расписание':
-        await show_admin_schedule_menu(update, context)
-    elif text == '❌ Отменить запись':
-        await show_cancel_booking_menu(update, context)
-    elif text == '📝 Добавить запись':
-        await show_add_booking_menu(update, context)
-    elif text == '🔙 В главное меню' or text == '🔙 Главное меню':
-        await start(update, context)
-    elif text == '📈 Новая аналитика':
-        await show_analytics_menu(update, context)
-    elif text == '📊 Экспорт данных':
-        await export_analytics_data(update, context)
-    elif text == '🔙 В админ-панель':
-        await show_admin_panel(update, context)
-    elif text == '📅 Выбрать другую дату':
-        # Очищаем состояние перед новым вводом даты
-        if 'admin_schedule_date' in context.user_data:
-            context.user_data.pop('admin_schedule_date')
-        
-        await update.message.reply_text(
-            "📅 <b>ВВЕДИТЕ ДАТУ ДЛЯ ПРОСМОТРА РАСПИСАНИЯ</b>\n\n"
-            "Формат: <b>ДД.ММ.ГГГГ</b>\n"
-            "Например: 25.12.2024\n\n"
-            "📝 Введите дату в указанном формате:",
-            parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
-        )
-    elif text == '❌ Отменить еще запись':
-        await show_cancel_booking_menu(update, context)
-    elif text == '🔙 Назад':
-        await show_admin_panel(update, context)
+    await update.message.reply_text(
+        "📅 <b>ВВЕДИТЕ ДАТУ ДЛЯ ПРОСМОТРА РАСПИСАНИЯ</b>\n\n"
+        "Формат: <b>ДД.ММ.ГГГГ</b>\n"
+        "Например: 25.12.2024\n\n"
+        "📝 Введите дату в указанном формате:",
+        parse_mode='HTML',
+        reply_markup=BACK_KEYBOARD
+    )
+
+# Клавиатура меню бронирования
+BOOKING_MENU_KEYBOARD = ReplyKeyboardMarkup([
+    ['📅 Забронировать на ближайшую дату', '🗓️ Забронировать на другую дату'],
+    ['🔍 Найти свободное время'],
+    ['📋❌ Мои брони/Отменить запись', '🔙 Назад']
+], resize_keyboard=True)
 
 # Меню бронирования
 async def show_booking_menu(update: Update, context: CallbackContext) -> int:
@@ -2956,19 +5954,14 @@ async def show_booking_menu(update: Update, context: CallbackContext) -> int:
     # Обновляем статистику пользователя
     update_user_stats(user_id, username, first_name, last_name)
     
-    booking_keyboard = [
-        ['📅 Забронировать на ближайшую дату', '🗓️ Забронировать на другую дату'],
-        ['📋❌ Мои брони/Отменить запись', '🔙 Назад']
-    ]
-    reply_markup = ReplyKeyboardMarkup(booking_keyboard, resize_keyboard=True)
-    
     await update.message.reply_text(
         '🎵 <b>ВЫБЕРИТЕ ТИП БРОНИРОВАНИЯ</b>\n\n'
         '📅 <b>Забронировать на ближайшую дату</b> - выбор из ближайших 7 дней (включая сегодня)\n'
-        '🗓️ <b>Забронировать на другую дату</b> - ввод любой даты вручную\n'
+        '🗓️ <b>Забронировать на другую дату</b> - выбор в календаре или ввод даты вручную\n'
+        '🔍 <b>Найти свободное время</b> - ближайшие дни, где есть сессия нужной длины в удобное время\n'
         '📋❌ <b>Мои брони/Отменить запись</b> - просмотр и управление вашими записями',
         parse_mode='HTML',
-        reply_markup=reply_markup
+        reply_markup=BOOKING_MENU_KEYBOARD
     )
     return SELECT_BOOKING_TYPE
 
@@ -2998,6 +5991,10 @@ async def handle_booking_type(update: Update, context: CallbackContext) -> int:
         await ask_for_specific_date(update, context)
         return SELECT_DAY
     
+    elif choice == '🔍 Найти свободное время':
+        await ask_free_slot_duration(update, context)
+        return FIND_DURATION
+    
     elif choice == '📋❌ Мои брони/Отменить запись':
         await show_user_bookings_with_buttons(update, context, user_id)
         return ConversationHandler.END
@@ -3005,43 +6002,132 @@ async def handle_booking_type(update: Update, context: CallbackContext) -> int:
     else:
         await update.message.reply_text(
             'Пожалуйста, выберите один из предложенных вариантов:',
-            reply_markup=ReplyKeyboardMarkup([
-                ['📅 Забронировать на ближайшую дату', '🗓️ Забронировать на другую дату'],
-                ['📋❌ Мои брони/Отменить запись', '🔙 Назад']
-            ], resize_keyboard=True)
+            reply_markup=BOOKING_MENU_KEYBOARD
         )
         return SELECT_BOOKING_TYPE
 
-# Показ ближайших дат (7 дней ВКЛЮЧАЯ СЕГОДНЯ)
-async def show_nearest_dates(update: Update, context: CallbackContext) -> None:
-    user_id = update.message.from_user.id
-    username = update.message.from_user.username or 'без username'
-    first_name = update.message.from_user.first_name
-    last_name = update.message.from_user.last_name or ''
+# Показ ближайших дат (7 дней ВКЛЮЧАЯ СЕГОДНЯ)
+async def show_nearest_dates(update: Update, context: CallbackContext) -> None:
+    user_id = update.message.from_user.id
+    username = update.message.from_user.username or 'без username'
+    first_name = update.message.from_user.first_name
+    last_name = update.message.from_user.last_name or ''
+    
+    # Обновляем статистику пользователя
+    update_user_stats(user_id, username, first_name, last_name)
+    
+    dates = generate_dates()
+    
+    dates_keyboard = []
+    for i in range(0, len(dates), 2):
+        row = dates[i:i+2]
+        dates_keyboard.append(row)
+    
+    dates_keyboard.append(['🔙 Назад'])
+    
+    reply_markup = ReplyKeyboardMarkup(dates_keyboard, resize_keyboard=True)
+    
+    await update.message.reply_text(
+        '📅 <b>ВЫБЕРИТЕ ДАТУ ДЛЯ ЗАПИСИ</b>\n\n'
+        '🎯 Доступные даты на 7 дней вперед (включая сегодня):\n'
+        '💡 <i>На сегодня доступно время только со следующего часа</i>',
+        parse_mode='HTML',
+        reply_markup=reply_markup
+    )
+
+# Названия месяцев и дней недели для календаря
+MONTH_NAMES = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь", "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
+CALENDAR_WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+# Значки после числа в календаре по состоянию дня
+CALENDAR_DAY_MARKS = {'free': '🟢', 'partial': '🟡', 'full': '🔴'}
+
+CALENDAR_TEXT = (
+    '🗓️ <b>КАЛЕНДАРЬ ЗАПИСИ</b>\n\n'
+    '🟢 свободно  🟡 частично занято  🔴 занято'
+)
+
+# Inline-календарь месяца: листание по месяцам в пределах горизонта записи, день - callback cal|d|<ГГГГ-ММ-ДД>
+def build_month_calendar(year, month):
+    today = datetime.now().date()
+    last_day = today + timedelta(days=BOOKING_HORIZON_DAYS)
+    states = get_month_day_states(year, month)
+    
+    prev_month = (year, month - 1) if month > 1 else (year - 1, 12)
+    next_month = (year, month + 1) if month < 12 else (year + 1, 1)
+    
+    def month_button(text, target, enabled):
+        if not enabled:
+            return InlineKeyboardButton("·", callback_data="cal|x|")
+        return InlineKeyboardButton(text, callback_data=f"cal|m|{target[0]}-{target[1]:02d}")
+    
+    keyboard = [
+        [
+            month_button("◀️", prev_month, prev_month >= (today.year, today.month)),
+            InlineKeyboardButton(f"{MONTH_NAMES[month - 1]} {year}", callback_data="cal|x|"),
+            month_button("▶️", next_month, next_month <= (last_day.year, last_day.month))
+        ],
+        [InlineKeyboardButton(name, callback_data="cal|x|") for name in CALENDAR_WEEKDAYS]
+    ]
+    
+    row = [InlineKeyboardButton("·", callback_data="cal|x|")] * next(iter(states)).weekday()
+    for day, state in states.items():
+        if day == today:
+            state = day_occupancy_state(StudioDate.from_date(day), get_day_occupancy(day.strftime("%d.%m.%Y")))
+        
+        if day < today or day > last_day or state == 'closed':
+            row.append(InlineKeyboardButton("·", callback_data="cal|x|"))
+        else:
+            row.append(InlineKeyboardButton(f"{day.day}{CALENDAR_DAY_MARKS[state]}", callback_data=f"cal|d|{day.isoformat()}"))
+        
+        if len(row) == 7:
+            keyboard.append(row)
+            row = []
+    
+    if row:
+        keyboard.append(row + [InlineKeyboardButton("·", callback_data="cal|x|")] * (7 - len(row)))
+    
+    return InlineKeyboardMarkup(keyboard)
+
+# Листание календаря (сообщение редактируется на месте) и нажатия на неактивные кнопки
+async def handle_calendar_navigation(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    _, action, value = query.data.split('|')
     
-    # Обновляем статистику пользователя
-    update_user_stats(user_id, username, first_name, last_name)
+    if action == 'd':
+        # День из календаря, запись по которому уже не идет
+        await query.answer('⏳ Календарь устарел. Начните запись заново из меню.', show_alert=True)
+        return
     
-    dates = generate_dates()
+    await query.answer()
+    if action != 'm':
+        return
     
-    dates_keyboard = []
-    for i in range(0, len(dates), 2):
-        row = dates[i:i+2]
-        dates_keyboard.append(row)
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        await query.edit_message_text(CALENDAR_TEXT, parse_mode='HTML', reply_markup=build_month_calendar(year, month))
+    except Exception as e:
+        logger.error(f"Error in handle_calendar_navigation: {e}")
+
+# Выбор даты в календаре
+async def handle_calendar_day(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    studio_date = StudioDate.from_date(datetime.strptime(query.data.split('|')[2], "%Y-%m-%d").date())
+    today = datetime.now().date()
     
-    dates_keyboard.append(['🔙 Назад'])
+    # Календарь мог устареть: дата прошла или время уже заняли
+    if not today <= studio_date.date <= today + timedelta(days=BOOKING_HORIZON_DAYS) or not get_start_options(studio_date):
+        await query.answer(f'❌ На {studio_date.clean} нет свободного времени.', show_alert=True)
+        return SELECT_DAY
     
-    reply_markup = ReplyKeyboardMarkup(dates_keyboard, resize_keyboard=True)
+    await query.answer()
+    context.user_data['booking_day'] = studio_date.label
+    await query.edit_message_text(f'🗓️ Выбрана дата: <b>{studio_date.label}</b>', parse_mode='HTML')
     
-    await update.message.reply_text(
-        '📅 <b>ВЫБЕРИТЕ ДАТУ ДЛЯ ЗАПИСИ</b>\n\n'
-        '🎯 Доступные даты на 7 дней вперед (включая сегодня):\n'
-        '💡 <i>На сегодня доступно время только со следующего часа</i>',
-        parse_mode='HTML',
-        reply_markup=reply_markup
-    )
+    await show_time_selection(update, context, studio_date.label)
+    return SELECT_TIME
 
-# Запрос конкретной даты (ручной ввод)
+# Запрос конкретной даты (календарь или ручной ввод)
 async def ask_for_specific_date(update: Update, context: CallbackContext) -> None:
     user_id = update.message.from_user.id
     username = update.message.from_user.username or 'без username'
@@ -3052,12 +6138,18 @@ async def ask_for_specific_date(update: Update, context: CallbackContext) -> Non
     update_user_stats(user_id, username, first_name, last_name)
     
     await update.message.reply_text(
-        '📅 <b>ВВЕДИТЕ ДАТУ ДЛЯ ЗАПИСИ</b>\n\n'
-        'Формат: <b>ДД.ММ.ГГГГ</b>\n'
-        'Например: 25.12.2024\n\n'
-        '📝 Введите дату в указанном формате:',
+        '📅 <b>ВЫБЕРИТЕ ДАТУ ДЛЯ ЗАПИСИ</b>\n\n'
+        '👇 Нажмите на день в календаре или введите дату в формате <b>ДД.ММ.ГГГГ</b>\n'
+        'Например: 25.12.2024',
+        parse_mode='HTML',
+        reply_markup=BACK_KEYBOARD
+    )
+    
+    today = datetime.now().date()
+    await update.message.reply_text(
+        CALENDAR_TEXT,
         parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+        reply_markup=build_month_calendar(today.year, today.month)
     )
 
 # Обработка выбора даты (общая функция для обоих типов)
@@ -3103,29 +6195,23 @@ async def handle_date_selection(update: Update, context: CallbackContext) -> int
                 await update.message.reply_text(
                     '❌ Нельзя выбрать прошедшую дату.\n'
                     'Пожалуйста, введите сегодняшнюю или будущую дату:',
-                    reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                    reply_markup=BACK_KEYBOARD
                 )
                 return SELECT_DAY
             
             # Проверяем что дата не слишком далеко (максимум 3 месяца)
-            max_date = today + timedelta(days=90)
+            max_date = today + timedelta(days=BOOKING_HORIZON_DAYS)
             if selected_date > max_date:
                 await update.message.reply_text(
                     '❌ Бронирование доступно только на 3 месяца вперед.\n'
                     'Пожалуйста, введите более близкую дату:',
-                    reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                    reply_markup=BACK_KEYBOARD
                 )
                 return SELECT_DAY
             
-            # Форматируем дату для отображения
-            date_str = selected_date.strftime("%d.%m.%Y")
-            day_name = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"][selected_date.weekday()]
-            
-            # Добавляем пометку "Сегодня" если это сегодняшняя дата
-            if selected_date.date() == today.date():
-                formatted_date = f"{date_str} ({day_name}) - Сегодня"
-            else:
-                formatted_date = f"{date_str} ({day_name})"
+            # Подпись даты для отображения (для сегодняшней - с пометкой "Сегодня")
+            studio_date = StudioDate.from_date(selected_date.date())
+            formatted_date = studio_date.label
             
             context.user_data['booking_day'] = formatted_date
             
@@ -3135,15 +6221,14 @@ async def handle_date_selection(update: Update, context: CallbackContext) -> int
                 'Пожалуйста, введите дату в формате <b>ДД.ММ.ГГГГ</b>\n'
                 'Например: 25.12.2024',
                 parse_mode='HTML',
-                reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                reply_markup=BACK_KEYBOARD
             )
             return SELECT_DAY
     
-    # Проверяем доступность даты
+    # Проверяем, что на дату помещается хотя бы самая короткая сессия
     selected_date = context.user_data['booking_day']
-    available_times = get_available_times(selected_date)
     
-    if not available_times:
+    if not get_start_options(selected_date):
         if booking_type == 'nearest':
             dates = generate_dates()
             await update.message.reply_text(
@@ -3155,7 +6240,7 @@ async def handle_date_selection(update: Update, context: CallbackContext) -> int
             await update.message.reply_text(
                 f'❌ На {selected_date} нет свободного времени.\n'
                 f'Пожалуйста, выберите другую дату:',
-                reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+                reply_markup=BACK_KEYBOARD
             )
         return SELECT_DAY
     
@@ -3165,37 +6250,29 @@ async def handle_date_selection(update: Update, context: CallbackContext) -> int
 
 # Показ выбора времени
 async def show_time_selection(update: Update, context: CallbackContext, selected_date: str) -> None:
-    user_id = update.message.from_user.id
-    username = update.message.from_user.username or 'без username'
-    first_name = update.message.from_user.first_name
-    last_name = update.message.from_user.last_name or ''
+    # Вызывается и из сообщения, и из нажатия на день календаря
+    user = update.effective_user
+    user_id = user.id
+    username = user.username or 'без username'
+    first_name = user.first_name
+    last_name = user.last_name or ''
     
     # Обновляем статистику пользователя
     update_user_stats(user_id, username, first_name, last_name)
     
-    available_times = get_available_times(selected_date)
+    start_options = get_start_options(selected_date)
     
-    if not available_times:
-        await update.message.reply_text(
+    if not start_options:
+        await update.effective_message.reply_text(
             f'❌ На {selected_date} нет свободного времени.\n'
             f'Пожалуйста, выберите другую дату:',
-            reply_markup=ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
+            reply_markup=BACK_KEYBOARD
         )
         return
     
-    time_keyboard = []
-    row = []
-    for i, time_slot in enumerate(available_times):
-        row.append(time_slot)
-        if len(row) == 2 or i == len(available_times) - 1:
-            time_keyboard.append(row)
-            row = []
-    
-    time_keyboard.append(['🔙 Назад'])
+    reply_markup = build_time_keyboard(start_options)
     
-    reply_markup = ReplyKeyboardMarkup(time_keyboard, resize_keyboard=True)
-    
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         f'📅 Выбрана дата: <b>{selected_date}</b>\n'
         f'🕐 <b>ВЫБЕРИТЕ ВРЕМЯ НАЧАЛА СЕССИИ</b>\n\n'
         f'🎯 Доступное время:',
@@ -3227,22 +6304,22 @@ async def handle_time_selection(update: Update, context: CallbackContext) -> int
         return SELECT_DAY
     
     selected_date = context.user_data['booking_day']
-    available_times = get_available_times(selected_date)
+    start_options = get_start_options(selected_date)
     
-    if selected_time not in available_times:
+    if selected_time not in start_options:
         await update.message.reply_text(
             f'❌ Время {selected_time} недоступно.\n'
             f'Пожалуйста, выберите другое время:',
-            reply_markup=ReplyKeyboardMarkup([available_times[i:i+2] for i in range(0, len(available_times), 2)] + [['🔙 Назад']], resize_keyboard=True)
+            reply_markup=build_time_keyboard(start_options)
         )
         return SELECT_TIME
     
     context.user_data['booking_time'] = selected_time
-    await show_duration_selection(update, context, selected_date, selected_time)
+    await show_duration_selection(update, context, selected_date, selected_time, start_options[selected_time])
     return SELECT_DURATION
 
 # Показ выбора продолжительности
-async def show_duration_selection(update: Update, context: CallbackContext, selected_date: str, selected_time: str) -> None:
+async def show_duration_selection(update: Update, context: CallbackContext, selected_date: str, selected_time: str, durations: tuple) -> None:
     user_id = update.message.from_user.id
     username = update.message.from_user.username or 'без username'
     first_name = update.message.from_user.first_name
@@ -3251,12 +6328,7 @@ async def show_duration_selection(update: Update, context: CallbackContext, sele
     # Обновляем статистику пользователя
     update_user_stats(user_id, username, first_name, last_name)
     
-    duration_keyboard = [
-        ['1 час', '2 часа'],
-        ['3 часа', '4 часа'],
-        ['🔙 Назад']
-    ]
-    reply_markup = ReplyKeyboardMarkup(duration_keyboard, resize_keyboard=True)
+    reply_markup = build_duration_keyboard(durations)
     
     await update.message.reply_text(
         f'📅 Дата: <b>{selected_date}</b>\n'
@@ -3283,61 +6355,55 @@ async def handle_duration_selection(update: Update, context: CallbackContext) ->
         await show_time_selection(update, context, selected_date)
         return SELECT_TIME
     
-    duration_map = {
-        '1 час': 1, 
-        '2 часа': 2, 
-        '3 часа': 3, 
-        '4 часа': 4
-    }
+    selected_date = context.user_data['booking_day']
+    selected_time = context.user_data['booking_time']
+    durations = get_start_options(selected_date).get(selected_time, ())
     
-    if duration_text not in duration_map:
+    if duration_text not in SESSION_DURATIONS:
         await update.message.reply_text(
             '❌ Пожалуйста, выберите продолжительность из списка:',
-            reply_markup=ReplyKeyboardMarkup([
-                ['1 час', '2 часа'],
-                ['3 часа', '4 часа'],
-                ['🔙 Назад']
-            ], resize_keyboard=True)
+            reply_markup=build_duration_keyboard(durations)
         )
         return SELECT_DURATION
     
-    duration = duration_map[duration_text]
-    selected_date = context.user_data['booking_day']
-    selected_time = context.user_data['booking_time']
+    duration = SESSION_DURATIONS[duration_text]
     
-    if not is_time_available(selected_date, selected_time, duration):
+    # Время могли занять, пока шел выбор
+    if duration_text not in durations:
         await update.message.reply_text(
             f'❌ Время {selected_time} продолжительностью {duration} час(а) недоступно.\n'
-            f'Пожалуйста, выберите другое время или продолжительность.',
-            reply_markup=ReplyKeyboardMarkup([
-                ['1 час', '2 часа'],
-                ['3 часа', '4 часа'],
-                ['🔙 Назад']
-            ], resize_keyboard=True)
+            f'Пожалуйста, выберите другую продолжительность или вернитесь к выбору времени.',
+            reply_markup=build_duration_keyboard(durations)
         )
         return SELECT_DURATION
     
+    await submit_booking_request(update, context, SessionSlot(selected_date, selected_time, duration))
+    return ConversationHandler.END
+
+# Сохранение заявки клиента на проверенное свободное время и уведомление администратора
+async def submit_booking_request(update: Update, context: CallbackContext, slot) -> None:
+    user_id = update.message.from_user.id
+    username = update.message.from_user.username or 'без username'
+    selected_date = slot.day.label
+    selected_time = slot.time
+    duration = slot.duration
+    
     # Сохраняем бронирование
     user_name = update.message.from_user.first_name
     
     # Сохраняем дату без пометки " - Сегодня"
-    clean_date = selected_date.replace(" - Сегодня", "")
-        # Убираем день недели в скобках, оставляем только дату
-    clean_date = clean_date.split(' (')[0]
-    
     conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO bookings (user_id, user_name, day, time, duration, status, created_at, added_by_admin, client_contact)
-        VALUES (?, ?, ?, ?, ?, 'pending', ?, ?, ?)
-    ''', (user_id, user_name, clean_date, selected_time, duration, get_current_time(), False, None))
+        INSERT INTO bookings (user_id, user_name, day, time, duration, status, created_at, added_by_admin, client_contact, session_date)
+        VALUES (?, ?, ?, ?, ?, 'pending', ?, ?, ?, ?)
+    ''', (user_id, user_name, slot.day.clean, slot.time, slot.duration, get_current_time(), False, None, slot.day.iso))
     booking_id = cursor.lastrowid
+    record_booking_transition(cursor, slot.day.clean, slot.time, slot.duration, user_id, user_name, None, 'pending')
     conn.commit()
+    mark_bookings_changed(booking_id)
     conn.close()
     
-    # Обновляем статистику бронирований пользователя
-    update_user_booking_stats(user_id)
-    
     # Сообщение пользователю
     await update.message.reply_text(
         f'✅ <b>ЗАЯВКА НА БРОНИРОВАНИЕ ОТПРАВЛЕНА!</b>\n\n'
@@ -3369,7 +6435,199 @@ async def handle_duration_selection(update: Update, context: CallbackContext) ->
             name=f"admin_reminder_{booking_id}"
         )
         print(f"✅ Повторяющееся напоминание настроено для бронирования {booking_id} (каждые 30 минут)")
+
+# Начало поиска свободного времени: выбор продолжительности
+async def ask_free_slot_duration(update: Update, context: CallbackContext) -> None:
+    await update.message.reply_text(
+        '🔍 <b>ПОИСК СВОБОДНОГО ВРЕМЕНИ</b>\n\n'
+        '⏱ Выберите продолжительность сессии:',
+        parse_mode='HTML',
+        reply_markup=DURATION_KEYBOARD
+    )
+
+# Обработка продолжительности для поиска
+async def handle_free_slot_duration(update: Update, context: CallbackContext) -> int:
+    duration_text = update.message.text
+    
+    if duration_text == '🔙 Назад':
+        await show_booking_menu(update, context)
+        return SELECT_BOOKING_TYPE
+    
+    if duration_text not in SESSION_DURATIONS:
+        await update.message.reply_text(
+            '❌ Пожалуйста, выберите продолжительность из списка:',
+            reply_markup=DURATION_KEYBOARD
+        )
+        return FIND_DURATION
+    
+    context.user_data['search_duration'] = duration_text
+    
+    await update.message.reply_text(
+        f'⏱ Продолжительность: <b>{duration_text}</b>\n\n'
+        f'🕐 <b>В КАКОЕ ВРЕМЯ ВАМ УДОБНО?</b>',
+        parse_mode='HTML',
+        reply_markup=PREFERRED_HOURS_KEYBOARD
+    )
+    return FIND_HOURS
+
+# Обработка предпочтительного времени и показ первых найденных вариантов
+async def handle_free_slot_hours(update: Update, context: CallbackContext) -> int:
+    hours_text = update.message.text
+    
+    if hours_text == '🔙 Назад':
+        await ask_free_slot_duration(update, context)
+        return FIND_DURATION
+    
+    if hours_text not in PREFERRED_HOURS:
+        await update.message.reply_text(
+            '❌ Пожалуйста, выберите время из списка:',
+            reply_markup=PREFERRED_HOURS_KEYBOARD
+        )
+        return FIND_HOURS
+    
+    context.user_data['search_hours'] = hours_text
+    await ask_free_slot_from(update, context)
+    return FIND_FROM
+
+# Выбор даты, с которой искать свободное время
+async def ask_free_slot_from(update: Update, context: CallbackContext) -> None:
+    await update.message.reply_text(
+        '📅 <b>С КАКОЙ ДАТЫ ИСКАТЬ?</b>\n\n'
+        '👇 Нажмите кнопку, чтобы искать с сегодняшнего дня,\n'
+        'или введите дату в формате <b>ДД.ММ.ГГГГ</b>\n'
+        'Например: 25.12.2024',
+        parse_mode='HTML',
+        reply_markup=FREE_SLOT_FROM_KEYBOARD
+    )
+
+# Обработка даты начала поиска и показ первых найденных вариантов
+async def handle_free_slot_from(update: Update, context: CallbackContext) -> int:
+    user_input = update.message.text
+    
+    if user_input == '🔙 Назад':
+        await update.message.reply_text(
+            '🕐 <b>В КАКОЕ ВРЕМЯ ВАМ УДОБНО?</b>',
+            parse_mode='HTML',
+            reply_markup=PREFERRED_HOURS_KEYBOARD
+        )
+        return FIND_HOURS
+    
+    if user_input == FREE_SLOT_FROM_TODAY:
+        context.user_data.pop('search_after', None)
+        return await show_free_slots(update, context)
+    
+    try:
+        selected_date = datetime.strptime(user_input, "%d.%m.%Y").date()
+    except ValueError:
+        await update.message.reply_text(
+            '❌ Неправильный формат даты.\n'
+            'Пожалуйста, введите дату в формате <b>ДД.ММ.ГГГГ</b>\n'
+            'Например: 25.12.2024',
+            parse_mode='HTML',
+            reply_markup=FREE_SLOT_FROM_KEYBOARD
+        )
+        return FIND_FROM
+    
+    today = datetime.now().date()
+    if selected_date < today:
+        await update.message.reply_text(
+            '❌ Нельзя выбрать прошедшую дату.\n'
+            'Пожалуйста, введите сегодняшнюю или будущую дату:',
+            reply_markup=FREE_SLOT_FROM_KEYBOARD
+        )
+        return FIND_FROM
+    
+    if selected_date > today + timedelta(days=BOOKING_HORIZON_DAYS):
+        await update.message.reply_text(
+            '❌ Бронирование доступно только на 3 месяца вперед.\n'
+            'Пожалуйста, введите более близкую дату:',
+            reply_markup=FREE_SLOT_FROM_KEYBOARD
+        )
+        return FIND_FROM
+    
+    context.user_data['search_after'] = StudioDate.from_date(selected_date).clean
+    return await show_free_slots(update, context)
+
+# Показ найденного свободного времени (по одному варианту на день) кнопками "ДД.ММ.ГГГГ ЧЧ:ММ"
+async def show_free_slots(update: Update, context: CallbackContext) -> int:
+    duration_text = context.user_data['search_duration']
+    hours_text = context.user_data['search_hours']
+    slots = find_free_slots(duration_text, context.user_data.get('search_after'), PREFERRED_HOURS[hours_text])
+    
+    if not slots:
+        await update.message.reply_text(
+            f'❌ В ближайшие {BOOKING_HORIZON_DAYS} дней больше нет свободного времени '
+            f'на {duration_text} ({hours_text}).\n'
+            f'Пожалуйста, выберите другое время:',
+            reply_markup=PREFERRED_HOURS_KEYBOARD
+        )
+        return FIND_HOURS
+    
+    # Следующий поиск ("Показать позже") начинается со дня после последнего варианта
+    context.user_data['search_after'] = StudioDate.from_date(slots[-1].day.date + timedelta(days=1)).clean
+    
+    slots_text = "\n".join(
+        f"• {slot.day.clean} ({slot.day.weekday_name}) {slot.time} - {slot.end_minutes // 60:02d}:{slot.end_minutes % 60:02d}"
+        for slot in slots
+    )
+    keyboard = [[f"{slot.day.clean} {slot.time}"] for slot in slots] + [['➡️ Показать позже'], ['🔙 Назад']]
+    
+    await update.message.reply_text(
+        f'🔍 <b>БЛИЖАЙШЕЕ СВОБОДНОЕ ВРЕМЯ</b>\n'
+        f'⏱ {duration_text}, {hours_text}\n\n'
+        f'{slots_text}\n\n'
+        f'👆 Нажмите на вариант, чтобы отправить заявку:',
+        parse_mode='HTML',
+        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    )
+    return FIND_SELECT
+
+# Обработка выбора найденного времени
+async def handle_free_slot_choice(update: Update, context: CallbackContext) -> int:
+    user_id = update.message.from_user.id
+    username = update.message.from_user.username or 'без username'
+    first_name = update.message.from_user.first_name
+    last_name = update.message.from_user.last_name or ''
+    
+    # Обновляем статистику пользователя
+    update_user_stats(user_id, username, first_name, last_name)
+    
+    choice = update.message.text
+    
+    if choice == '🔙 Назад':
+        await update.message.reply_text(
+            '🕐 <b>В КАКОЕ ВРЕМЯ ВАМ УДОБНО?</b>',
+            parse_mode='HTML',
+            reply_markup=PREFERRED_HOURS_KEYBOARD
+        )
+        return FIND_HOURS
+    
+    if choice == '➡️ Показать позже':
+        return await show_free_slots(update, context)
+    
+    try:
+        day_text, selected_time = choice.split(' ')
+        studio_date = StudioDate.parse(day_text)
+        clock_minutes(selected_time)
+    except ValueError:
+        await update.message.reply_text(
+            '❌ Пожалуйста, выберите вариант из списка.\n'
+            'Или выберите удобное время для нового поиска:',
+            reply_markup=PREFERRED_HOURS_KEYBOARD
+        )
+        return FIND_HOURS
+    
+    duration_text = context.user_data['search_duration']
+    
+    # Время могли занять, пока пользователь выбирал - ищем заново с этого дня
+    if studio_date.date < datetime.now().date() or duration_text not in get_start_options(studio_date).get(selected_time, ()):
+        await update.message.reply_text(f'❌ Время {choice} уже недоступно.')
+        context.user_data['search_after'] = studio_date.clean
+        return await show_free_slots(update, context)
     
+    context.user_data['booking_day'] = studio_date.label
+    context.user_data['booking_time'] = selected_time
+    await submit_booking_request(update, context, SessionSlot(studio_date, selected_time, SESSION_DURATIONS[duration_text]))
     return ConversationHandler.END
 
 # Показ бронирований пользователя с кнопками отмены
@@ -3383,54 +6641,21 @@ async def show_user_bookings_with_buttons(update: Update, context: CallbackConte
         # Обновляем статистику пользователя
         update_user_stats(user_id, username, first_name, last_name)
         
-        conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, day, time, duration, status 
-            FROM bookings 
-            WHERE user_id = ? AND status IN ('pending', 'confirmed')
-            ORDER BY day, time
-        ''', (user_id,))
-        
-        bookings = cursor.fetchall()
-        conn.close()
+        # Все активные брони - одним сообщением по страницам, с кнопкой отмены у каждой
+        bookings_text, reply_markup = build_list_page('mybk', '', user_id)
         
-        if not bookings:
+        if reply_markup is None:
             await update.message.reply_text(
                 '📝 У вас нет активных бронирований.',
                 reply_markup=get_main_keyboard(user_id)
             )
             return
         
-        for booking in bookings:
-            booking_id, day, time, duration, status = booking
-            status_icon = "✅" if status == 'confirmed' else "⏳"
-            status_text = "Подтверждено" if status == 'confirmed' else "Ожидание подтверждения"
-            
-            booking_text = f"""{status_icon} <b>ВАША БРОНЬ</b>
-
-📅 <b>Дата</b>: {day}
-🕐 <b>Время</b>: {time}
-⏱ <b>Продолжительность</b>: {duration} час(а)
-📊 <b>Статус</b>: {status_text}
-🆔 <b>ID брони</b>: {booking_id}"""
-            
-            # Создаем кнопку отмены для каждой брони
-            keyboard = [
-                [InlineKeyboardButton("❌ Отменить запись", callback_data=f"user_cancel_{booking_id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                booking_text,
-                parse_mode='HTML',
-                reply_markup=reply_markup
-            )
+        await update.message.reply_text(bookings_text, parse_mode='HTML', reply_markup=reply_markup)
         
         # Добавляем основное меню после списка бронирований
         await update.message.reply_text(
-            "💡 Вы можете отменить любую из ваших записей, нажав кнопку '❌ Отменить запись' под соответствующей бронью.",
+            "💡 Вы можете отменить любую из ваших записей, нажав кнопку '❌ Отменить' с ее номером под списком.",
             reply_markup=get_main_keyboard(user_id)
         )
         
@@ -3444,37 +6669,44 @@ async def show_user_bookings_with_buttons(update: Update, context: CallbackConte
 # Обработка отмены брони пользователем - ИСПРАВЛЕНА ДЛЯ ЗАДАЧИ 1
 async def handle_user_cancellation(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
-    await query.answer()
     
-    booking_id = int(query.data.split('_')[2])
+    if is_duplicate_callback(query):
+        await query.answer()
+        return
+    
+    _, booking_id, _ = parse_booking_callback(query.data)
     user_id = query.from_user.id
     
     conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
     cursor = conn.cursor()
+    cursor.execute('SELECT user_id FROM bookings WHERE id = ?', (booking_id,))
+    owner = cursor.fetchone()
+    conn.close()
     
-    cursor.execute('SELECT user_id, user_name, day, time, duration, status FROM bookings WHERE id = ?', (booking_id,))
-    booking = cursor.fetchone()
+    if not owner:
+        await query.answer()
+        await show_booking_action_result(query, "❌ Заявка не найдена")
+        return
     
-    if not booking:
-        await query.edit_message_text("❌ Заявка не найдена")
-        conn.close()
+    # Проверяем, что отменяет именно владелец брони
+    if owner[0] != user_id:
+        await query.answer()
+        await show_booking_action_result(query, "❌ Вы не можете отменить чужую бронь")
         return
     
-    booking_user_id, user_name, day, time, duration, status = booking
+    # Обновляем статус брони (если она еще активна)
+    booking, applied = transition_booking(booking_id, 'cancelled')
+    _, user_name, day, time, duration, status = booking[:6]
     
-    # Проверяем, что отменяет именно владелец брони
-    if booking_user_id != user_id:
-        await query.edit_message_text("❌ Вы не можете отменить чужую бронь")
-        conn.close()
+    if not applied:
+        await answer_stale_booking(query, booking_id, status)
         return
     
-    # Обновляем статус брони
-    cursor.execute('UPDATE bookings SET status = ? WHERE id = ?', ('cancelled', booking_id))
-    conn.commit()
-    conn.close()
+    await query.answer()
     
-    # Обновляем статистику бронирований пользователя
-    update_user_booking_stats(user_id)
+    # Напоминания по отмененной брони больше не нужны
+    if context.job_queue:
+        remove_booking_jobs(context.job_queue, booking_id)
     
     # ИСПРАВЛЕНИЕ ЗАДАЧИ 1: Убираем кнопку "Забронировать новую сессию" из сообщения
     cancellation_text = f"""😔 <b>ВАША ЗАПИСЬ ОТМЕНЕНА</b>
@@ -3491,10 +6723,7 @@ async def handle_user_cancellation(update: Update, context: CallbackContext) ->
 💫 <b>Если передумаете - мы будем ждать вас снова!</b>"""
     
     # Убираем кнопку "Забронировать новую сессию"
-    await query.edit_message_text(
-        cancellation_text,
-        parse_mode='HTML'
-    )
+    await show_booking_action_result(query, cancellation_text)
     
     # Уведомление администратору об отмене
     admin_cancel_message = f"""🚫 <b>ОТМЕНА БРОНИ КЛИЕНТОМ</b>
@@ -3554,7 +6783,7 @@ async def handle_new_booking_after_cancel(update: Update, context: CallbackConte
         chat_id=user_id,
         text='🎵 <b>ВЫБЕРИТЕ ТИП БРОНИРОВАНИЯ</b>\n\n'
              '📅 <b>Забронировать на ближайшую дату</b> - выбор из ближайших 7 дней (включая сегодня)\n'
-             '🗓️ <b>Забронировать на другую дату</b> - ввод любой даты вручную\n'
+             '🗓️ <b>Забронировать на другую дату</b> - выбор в календаре или ввод даты вручную\n'
              '📋❌ <b>Мои брони/Отменить запись</b> - просмотр и управление вашими записями',
         parse_mode='HTML',
         reply_markup=reply_markup
@@ -3563,136 +6792,77 @@ async def handle_new_booking_after_cancel(update: Update, context: CallbackConte
 # Обработка действий администратора
 async def handle_admin_actions(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
-    await query.answer()
     
-    data = query.data
-    booking_id = int(data.split('_')[1])
-    action = data.split('_')[0]
+    if is_duplicate_callback(query):
+        await query.answer()
+        return
     
-    conn = sqlite3.connect('studio_schedule.db', check_same_thread=False)
-    cursor = conn.cursor()
+    action, booking_id, _ = parse_booking_callback(query.data)
     
-    cursor.execute('SELECT user_id, user_name, day, time, duration FROM bookings WHERE id = ?', (booking_id,))
-    booking = cursor.fetchone()
+    # Заявку можно подтвердить или отклонить, только пока она ожидает подтверждения
+    new_status = 'confirmed' if action == 'confirm' else 'cancelled'
+    booking, applied = transition_booking(booking_id, new_status, ('pending',))
     
     if not booking:
-        await query.edit_message_text("❌ Заявка не найдена")
-        conn.close()
+        await query.answer()
+        await show_booking_action_result(query, "❌ Заявка не найдена")
+        return
+    
+    user_id, user_name, day, time, duration, status = booking[:6]
+    
+    if not applied:
+        await answer_stale_booking(query, booking_id, status)
         return
     
-    user_id, user_name, day, time, duration = booking
+    await query.answer()
     
     if action == 'confirm':
-        cursor.execute('UPDATE bookings SET status = ? WHERE id = ?', ('confirmed', booking_id))
-        conn.commit()
-        
-        # Обновляем статистику бронирований пользователя
-        update_user_booking_stats(user_id)
-        
         # ОТМЕНЯЕМ напоминание администратору
         if context.job_queue:
-            job_name = f"admin_reminder_{booking_id}"
-            current_jobs = context.job_queue.get_jobs_by_name(job_name)
-            for job in current_jobs:
-                job.schedule_removal()
-                print(f"🔕 Напоминание администратору отменено для брони {booking_id}")
+            remove_booking_jobs(context.job_queue, booking_id)
+            print(f"🔕 Напоминание администратору отменено для брони {booking_id}")
         
-        await query.edit_message_text(
+        await show_booking_action_result(
+            query,
             f"✅ <b>БРОНЬ ПОДТВЕРЖДЕНА!</b>\n\n"
             f"👤 <b>Клиент</b>: {user_name}\n"
             f"📅 <b>Дата</b>: {day}\n"
             f"🕐 <b>Время</b>: {time}\n"
             f"⏱ <b>Продолжительность</b>: {duration} час(а)\n\n"
             f"✅ <i>Клиент уведомлен о подтверждении.</i>",
-            parse_mode='HTML'
+            recurring_series_button(booking_id)
         )
         
         try:
             # Отправляем подтверждение клиенту
-            confirmation_text = f"""🎉 <b>ВАША БРОНЬ ПОДТВЕРЖДЕНА!</b>
-
-📅 <b>Дата</b>: {day}
-🕐 <b>Время</b>: {time}
-⏱ <b>Продолжительность</b>: {duration} час(а)
-
-🏢 <b>MS Studio</b>
-📍 <b>Адрес</b>: г. Ставрополь, ул. Спартака 8, 2-ой этаж
-
-✅ <i>Ждем вас в студии!</i>
-📞 <b>По всем вопросам:</b> +7 (918) 880-52-92
-
-💡 <i>Вы получите напоминания за 24 часа и за 2 часа до сессии.</i>"""
-            
             await context.bot.send_message(
                 chat_id=user_id,
-                text=confirmation_text,
+                text=render_template('booking_confirmed', day=day, time=time, duration=duration),
                 parse_mode='HTML'
             )
             print(f"✅ Уведомление о подтверждении отправлено клиенту {user_id}")
             
             # НАСТРАИВАЕМ НАПОМИНАНИЯ ДЛЯ КЛИЕНТА
             if context.job_queue:
-                # Рассчитываем время напоминаний
-                delay_24h, delay_2h = calculate_reminder_times(day, time)
-                
-                if delay_24h and delay_24h > 0:
-                    # Напоминание за 24 часа
-                    context.job_queue.run_once(
-                        send_24h_reminder_to_client,
-                        when=delay_24h,
-                        data={
-                            'user_id': user_id,
-                            'selected_date': day,
-                            'selected_time': time,
-                            'duration': duration
-                        }
-                    )
-                    print(f"✅ Напоминание за 24 часа настроено для клиента {user_id} (через {delay_24h} сек)")
-                else:
-                    print(f"⚠️ Напоминание за 24 часа не настроено (недостаточно времени)")
-                
-                if delay_2h and delay_2h > 0:
-                    # Напоминание за 2 часа
-                    context.job_queue.run_once(
-                        send_2h_reminder_to_client,
-                        when=delay_2h,
-                        data={
-                            'user_id': user_id,
-                            'selected_date': day,
-                            'selected_time': time,
-                            'duration': duration
-                        }
-                    )
-                    print(f"✅ Напоминание за 2 часа настроено для клиента {user_id} (через {delay_2h} сек)")
-                else:
-                    print(f"⚠️ Напоминание за 2 часа не настроено (недостаточно времени)")
+                schedule_client_reminders(context.job_queue, booking_id, user_id, day, time, duration)
             
         except Exception as e:
             logger.error(f"Не удалось уведомить клиента о подтверждении: {e}")
             
     elif action == 'cancel':
-        cursor.execute('UPDATE bookings SET status = ? WHERE id = ?', ('cancelled', booking_id))
-        conn.commit()
-        
-        # Обновляем статистику бронирований пользователя
-        update_user_booking_stats(user_id)
-        
         # ОТМЕНЯЕМ напоминание администратору
         if context.job_queue:
-            job_name = f"admin_reminder_{booking_id}"
-            current_jobs = context.job_queue.get_jobs_by_name(job_name)
-            for job in current_jobs:
-                job.schedule_removal()
-                print(f"🔕 Напоминание администратору отменено для брони {booking_id}")
+            remove_booking_jobs(context.job_queue, booking_id)
+            print(f"🔕 Напоминание администратору отменено для брони {booking_id}")
         
-        await query.edit_message_text(
+        await show_booking_action_result(
+            query,
             f"❌ <b>БРОНЬ ОТКЛОНЕНА</b>\n\n"
             f"👤 <b>Клиент</b>: {user_name}\n"
             f"📅 <b>Дата</b>: {day}\n"
             f"🕐 <b>Время</b>: {time}\n"
             f"⏱ <b>Продолжительность</b>: {duration} час(а)\n\n"
-            f"❌ <i>Клиент уведомлен об отмене.</i>",
-            parse_mode='HTML'
+            f"❌ <i>Клиент уведомлен об отмене.</i>"
         )
         
         try:
@@ -3713,8 +6883,43 @@ async def handle_admin_actions(update: Update, context: CallbackContext) -> None
             print(f"✅ Уведомление об отмене отправлено клиенту {user_id}")
         except Exception as e:
             logger.error(f"Не удалось уведомить клиента об отмене: {e}")
-    
-    conn.close()
+
+# Маршруты кнопок меню: текст кнопки -> (обработчик, только для администратора).
+# Кнопки, ведущие к началу диалога, становятся его точками входа (menu_entry_points)
+# и перехватываются ConversationHandler, остальные обрабатывает handle_message
+MENU_ROUTES = {
+    '📅 Расписание': (show_schedule, False),
+    '🎵 Забронировать': (show_booking_menu, False),
+    '💰 Цены': (show_prices, False),
+    '👨‍💻 Связь': (contact_admin, False),
+    # Отказ в доступе для остальных показывает сама админ-панель
+    '👑 Админ панель': (show_admin_panel, False),
+    
+    '📊 Статистика пользователей': (show_user_statistics, True),
+    '📈 Аналитика': (show_analytics_menu, True),
+    '📈 Новая аналитика': (show_analytics_menu, True),
+    '📢 Рассылка': (show_broadcast_menu, True),
+    '🗓️ Админ расписание': (show_admin_schedule_menu, True),
+    '❌ Отменить запись': (show_cancel_booking_menu, True),
+    '❌ Отменить еще запись': (show_cancel_booking_menu, True),
+    '📝 Добавить запись': (show_add_booking_menu, True),
+    '📊 Экспорт данных': (export_analytics_data, True),
+    '💾 Снимок базы': (export_db_snapshot, True),
+    '📅 Выбрать другую дату': (ask_admin_schedule_date, True),
+    '🔙 В главное меню': (start, True),
+    '🔙 Главное меню': (start, True),
+    '🔙 В админ-панель': (show_admin_panel, True),
+    '🔙 Назад': (show_admin_panel, True)
+}
+
+# Фильтр точного совпадения текста кнопки (проверка по множеству вместо регулярного выражения)
+def menu_button(*labels):
+    return filters.Text(labels)
+
+# Точки входа в диалог: все кнопки меню, ведущие к его стартовому обработчику
+def menu_entry_points(handler):
+    labels = [label for label, (route_handler, _) in MENU_ROUTES.items() if route_handler is handler]
+    return [MessageHandler(menu_button(*labels), handler)]
 
 # Обработка обычных сообщений
 async def handle_message(update: Update, context: CallbackContext) -> None:
@@ -3727,56 +6932,61 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
     last_name = update.message.from_user.last_name or ''
     update_user_stats(user_id, username, first_name, last_name)
     
-    if text == '📅 Расписание':
-        await show_schedule(update, context)
-    elif text == '🎵 Забронировать':
-        await show_booking_menu(update, context)
-    elif text == '💰 Цены':
-        await show_prices(update, context)
-    elif text == '👨‍💻 Связь':
-        await contact_admin(update, context)
-    elif text == '👑 Админ панель':
-        await show_admin_panel(update, context)
+    # Поиск обработчика кнопки - одно обращение к словарю независимо от числа пунктов меню
+    route = MENU_ROUTES.get(text)
+    
+    if route and (not route[1] or user_id == ADMIN_ID):
+        await route[0](update, context)
     else:
-        # Проверяем, находится ли пользователь в админ-панели
-        if user_id == ADMIN_ID and text in ['📊 Статистика пользователей', '📈 Аналитика', '📢 Рассылка', '🗓️ Админ расписание', '❌ Отменить запись', '🔙 В главное меню', '🔙 Главное меню', '📈 Новая аналитика', '📊 Экспорт данных', '🔙 В админ-панель', '📅 Выбрать другую дату', '📝 Добавить запись', '❌ Отменить еще запись', '🔙 Назад']:
-            await handle_admin_actions_panel(update, context)
-        else:
-            await update.message.reply_text(
-                "Используйте кнопки меню для навигации:",
-                reply_markup=get_main_keyboard(user_id)
-            )
+        await update.message.reply_text(
+            "Используйте кнопки меню для навигации:",
+            reply_markup=get_main_keyboard(user_id)
+        )
 
 def main():
-    # Инициализация базы данных (полная пересоздание)
+    # Шаблоны сообщений и календарь проверяются до запуска: ошибка в настройках не должна всплыть у клиента
+    load_message_templates()
+    load_studio_calendar()
+    
+    # Инициализация базы данных
     init_db()
     
     # Создание приложения
-    application = Application.builder().token(TOKEN).build()
+    application = Application.builder().token(TOKEN).persistence(SQLitePersistence()).build()
 
     # ConversationHandler для бронирования
     conv_handler = ConversationHandler(
-        entry_points=[
-            MessageHandler(filters.Regex('^🎵 Забронировать$'), show_booking_menu),
+        name="booking",
+        persistent=True,
+        entry_points=menu_entry_points(show_booking_menu) + [
             CallbackQueryHandler(handle_new_booking_after_cancel, pattern='^new_booking_after_cancel$'),
             CallbackQueryHandler(handle_start_booking_from_cancel, pattern='^start_booking_from_cancel$'),
             CallbackQueryHandler(handle_to_main_menu_from_cancel, pattern='^to_main_menu_from_cancel$')
         ],
         states={
             SELECT_BOOKING_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_booking_type)],
-            SELECT_DAY: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_date_selection)],
+            SELECT_DAY: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_date_selection),
+                CallbackQueryHandler(handle_calendar_day, pattern=r'^cal\|d\|')
+            ],
             SELECT_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_time_selection)],
             SELECT_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_duration_selection)],
+            FIND_DURATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_free_slot_duration)],
+            FIND_HOURS: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_free_slot_hours)],
+            FIND_FROM: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_free_slot_from)],
+            FIND_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_free_slot_choice)],
         },
         fallbacks=[CommandHandler('cancel', start)]
     )
 
     # ConversationHandler для рассылки
     broadcast_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^📢 Рассылка$'), show_broadcast_menu)],
+        name="broadcast",
+        persistent=True,
+        entry_points=menu_entry_points(show_broadcast_menu),
         states={
             BROADCAST_MESSAGE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.Regex('^🔙 Назад$'), handle_broadcast_message),
+                MessageHandler(filters.TEXT & ~filters.COMMAND & ~menu_button('🔙 Назад'), handle_broadcast_message),
                 MessageHandler(filters.PHOTO | filters.VIDEO, handle_broadcast_media)
             ],
             BROADCAST_CONFIRM: [
@@ -3784,14 +6994,16 @@ def main():
             ],
         },
         fallbacks=[
-            MessageHandler(filters.Regex('^🔙 Назад$'), cancel_broadcast),
+            MessageHandler(menu_button('🔙 Назад'), cancel_broadcast),
             CommandHandler('cancel', cancel_broadcast)
         ]
     )
 
     # ConversationHandler для аналитики
     analytics_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^📈 Аналитика$'), show_analytics_menu)],
+        name="analytics",
+        persistent=True,
+        entry_points=menu_entry_points(show_analytics_menu),
         states={
             ANALYTICS_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_analytics_period)],
             ANALYTICS_PERIOD: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_custom_period)],
@@ -3801,20 +7013,25 @@ def main():
 
     # ConversationHandler для админ расписания
     admin_schedule_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^🗓️ Админ расписание$'), show_admin_schedule_menu)],
+        name="admin_schedule",
+        persistent=True,
+        entry_points=menu_entry_points(show_admin_schedule_menu),
         states={
             ADMIN_SCHEDULE_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_schedule_choice)],
             ADMIN_SCHEDULE_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_schedule_date)],
+            ADMIN_SCHEDULE_RANGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_schedule_range)],
         },
         fallbacks=[
-            MessageHandler(filters.Regex('^🔙 Назад$'), show_admin_panel),
+            MessageHandler(menu_button('🔙 Назад'), show_admin_panel),
             CommandHandler('cancel', show_admin_panel)
         ]
     )
 
     # ConversationHandler для добавления записи администратором (ОБНОВЛЕН)
     add_booking_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^📝 Добавить запись$'), show_add_booking_menu)],
+        name="admin_add_booking",
+        persistent=True,
+        entry_points=menu_entry_points(show_add_booking_menu),
         states={
             ADMIN_ADD_DAY: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_add_date)],
             ADMIN_ADD_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_add_time)],
@@ -3827,37 +7044,81 @@ def main():
 
     # ConversationHandler для отмены записей администратором
     admin_cancel_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^❌ Отменить запись$'), show_cancel_booking_menu)],
+        name="admin_cancel",
+        persistent=True,
+        entry_points=menu_entry_points(show_cancel_booking_menu),
         states={
             ADMIN_CANCEL_DAY: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_cancel_date)],
             ADMIN_CANCEL_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_cancel_date)],  # Для возврата к выбору даты
         },
         fallbacks=[
-            MessageHandler(filters.Regex('^🔙 Назад$'), show_admin_panel),
+            MessageHandler(menu_button('🔙 Назад'), show_admin_panel),
             CommandHandler('cancel', show_admin_panel)
         ]
     )
 
     # Добавляем обработчики
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("snapshot", export_db_snapshot))
     application.add_handler(conv_handler)
     application.add_handler(broadcast_handler)
     application.add_handler(analytics_handler)
     application.add_handler(admin_schedule_handler)
     application.add_handler(add_booking_handler)
     application.add_handler(admin_cancel_handler)
-    application.add_handler(CallbackQueryHandler(handle_admin_actions, pattern='^(confirm|cancel)_'))
-    application.add_handler(CallbackQueryHandler(handle_user_cancellation, pattern='^user_cancel_'))
+    application.add_handler(CallbackQueryHandler(handle_admin_actions, pattern=r'^(confirm_|cancel_|pa\|(confirm|cancel)\|)'))
+    application.add_handler(CallbackQueryHandler(handle_user_cancellation, pattern=r'^(user_cancel_|pa\|user_cancel\|)'))
     application.add_handler(CallbackQueryHandler(handle_new_booking_after_cancel, pattern='^new_booking_after_cancel$'))
     application.add_handler(CallbackQueryHandler(handle_start_booking_from_cancel, pattern='^start_booking_from_cancel$'))
     application.add_handler(CallbackQueryHandler(handle_to_main_menu_from_cancel, pattern='^to_main_menu_from_cancel$'))
-    application.add_handler(CallbackQueryHandler(handle_admin_cancellation, pattern='^admin_cancel_'))
+    application.add_handler(CallbackQueryHandler(handle_admin_cancellation, pattern=r'^(admin_cancel_|pa\|admin_cancel\|)'))
+    application.add_handler(CallbackQueryHandler(handle_user_statistics_page, pattern='^users_(next|prev)_'))
+    application.add_handler(CallbackQueryHandler(handle_list_page, pattern=r'^pg\|'))
+    application.add_handler(CallbackQueryHandler(handle_bulk_action, pattern=r'^bulk\|'))
+    application.add_handler(CallbackQueryHandler(handle_recurring_series, pattern=r'^series\|'))
+    application.add_handler(CallbackQueryHandler(handle_calendar_navigation, pattern=r'^cal\|'))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+    # Плановое резервное копирование базы данных
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            run_scheduled_backup,
+            interval=BACKUP_INTERVAL,
+            first=60,
+            name="db_backup"
+        )
+        
+        # Отчеты аналитики за стандартные периоды: ночью и сразу после запуска,
+        # чтобы первое открытие меню аналитики не ждало расчета
+        application.job_queue.run_daily(
+            precompute_analytics_reports,
+            time=ANALYTICS_PRECOMPUTE_TIME,
+            name="analytics_precompute"
+        )
+        application.job_queue.run_once(precompute_analytics_reports, when=30, name="analytics_warmup")
+        
+        # Продление серий регулярных записей: ночью и сразу после запуска
+        application.job_queue.run_daily(
+            extend_recurring_series,
+            time=RECURRING_MATERIALIZE_TIME,
+            name="recurring_extend"
+        )
+        application.job_queue.run_once(extend_recurring_series, when=60, name="recurring_warmup")
+        
+        # Проверка счетчиков бронирований пользователей раз в сутки
+        application.job_queue.run_repeating(
+            run_user_stats_check,
+            interval=USER_STATS_CHECK_INTERVAL,
+            first=5 * 60,
+            name="user_stats_check"
+        )
+
     # Запускаем бота
     print("🎵 Бот студии звукозаписи запущен!")
     print(f"🆔 ID администратора: {ADMIN_ID}")
-    print("✅ База данных полностью пересоздана")
+    print(f"✅ Отчеты аналитики за стандартные периоды рассчитываются ежедневно в {ANALYTICS_PRECOMPUTE_TIME.strftime('%H:%M')}")
+    print(f"✅ Состояние диалогов и данные пользователей сохраняются в базе каждые {PERSISTENCE_UPDATE_INTERVAL} сек")
+    print(f"✅ Резервные копии базы каждые {BACKUP_INTERVAL // 3600} ч в каталоге '{BACKUP_DIR}' (хранится {BACKUP_KEEP})")
     print("✅ Добавлена новая функция: 'Добавить запись' в админ-панели")
     print("✅ Изменена расстановка кнопок в админ-панели")
     print("✅ Кнопка 'Расширенная аналитика' переименована в 'Аналитика'")
@@ -3901,5 +7162,8 @@ def main():
     application.run_polling()
 
 if __name__ == '__main__':
+    if '--bench-templates' in sys.argv:
+        benchmark_templates()
+        sys.exit()
 
     main()